@@ -16,12 +16,14 @@
 """ condor related routines """
 from contextlib import contextmanager
 import os
+import hashlib
 import pathlib
 import random
 import re
 import shutil
 import subprocess
 import sys
+import threading
 import time
 from typing import Dict, List, Any, Tuple, Optional, Union, Generator
 
@@ -30,11 +32,12 @@ import classad  # type: ignore
 import htcondor  # type: ignore
 import jinja2  # type: ignore
 
+import disk_cache
 import fake_ifdh
 import packages
 from render_files import render_files
 from tracing import as_span
-from transfer_sandbox import transfer_sandbox
+from transfer_sandbox import start_transfer_sandbox
 
 PREFIX = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
@@ -47,6 +50,19 @@ COLLECTOR_HOST = htcondor.param.get("COLLECTOR_HOST", None)
 # This should ONLY be changed by get_schedd_list
 __schedd_ads: Dict[str, classad.ClassAd] = {}
 
+# Schedd ads are also shared between jobsub processes through an on-disk
+# cache.  Entries younger than JOBSUB_SCHEDD_CACHE_TTL seconds are used as-is;
+# entries up to JOBSUB_SCHEDD_CACHE_MAX_STALE seconds old are still used, but
+# we refresh them in the background.  Keep the stale limit short, so we don't
+# send jobs to a schedd that has gone out of the collector.  A TTL of 0 turns
+# the disk cache off.
+SCHEDD_CACHE_TTL = int(os.environ.get("JOBSUB_SCHEDD_CACHE_TTL", 300))
+SCHEDD_CACHE_MAX_STALE = int(os.environ.get("JOBSUB_SCHEDD_CACHE_MAX_STALE", 600))
+
+# Schedd handles we have already located, so repeated submits/queries
+# in one process don't have to go back to the collector
+__schedd_handles: Dict[str, Any] = {}
+
 
 # pylint: disable=invalid-name,too-many-branches
 @contextmanager
@@ -127,10 +143,6 @@ def get_schedd_list(
             print("\nUsing cached schedd ads - NOT querying condor collector\n")
         return list(__schedd_ads.values())
 
-    # If schedd ads not in memory or refresh_schedd_ads is True, go ahead and get the classads from the collector
-    if vargs.get("verbose", 0) > 1:
-        print(f"\nQuerying condor collector {COLLECTOR_HOST} for schedd ads\n")
-
     # Constraint setup
     constraint = (
         '{% if schedd_for_testing is defined and schedd_for_testing %} Name == "{{schedd_for_testing}}"{% else %}'
@@ -151,19 +163,23 @@ def get_schedd_list(
         print(f"Could not render constraint template: {e}")
         raise
 
-    # pylint: disable-next=no-member
-    coll = htcondor.Collector(COLLECTOR_HOST)
-    # pylint: disable-next=no-member
     if vargs.get("verbose", 0) > 0:
         print(
             f"Using the following constraint for finding schedds: {schedd_constraint}\n"
         )
 
-    # Get schedd ads from collector and store them in memory
-    schedds: List[classad.ClassAd] = coll.query(
-        htcondor.htcondor.AdTypes.Schedd,
-        constraint=schedd_constraint,
-    )
+    schedds: Optional[List[classad.ClassAd]] = None
+    cache_name = schedd_cache_name(schedd_constraint)
+    if available_only and not refresh_schedd_ads and SCHEDD_CACHE_TTL > 0:
+        schedds = load_cached_schedd_ads(cache_name, schedd_constraint, vargs)
+
+    # If schedd ads not cached or refresh_schedd_ads is True, go ahead and get the classads from the collector
+    if schedds is None:
+        if vargs.get("verbose", 0) > 1:
+            print(f"\nQuerying condor collector {COLLECTOR_HOST} for schedd ads\n")
+        schedds = query_schedd_ads(schedd_constraint)
+        if available_only and SCHEDD_CACHE_TTL > 0:
+            store_cached_schedd_ads(cache_name, schedds)
 
     # only cache if we're getting the usual list
     if available_only:
@@ -175,6 +191,87 @@ def get_schedd_list(
     return schedds
 
 
+def query_schedd_ads(schedd_constraint: str) -> List[classad.ClassAd]:
+    """ask the collector for the schedd ads matching schedd_constraint"""
+    # pylint: disable-next=no-member
+    coll = htcondor.Collector(COLLECTOR_HOST)
+    # pylint: disable-next=no-member
+    res: List[classad.ClassAd] = coll.query(
+        htcondor.htcondor.AdTypes.Schedd,
+        constraint=schedd_constraint,
+    )
+    return res
+
+
+def schedd_cache_name(schedd_constraint: str) -> str:
+    """
+    name of the on-disk cache entry for this collector and constraint; the
+    rendered constraint already has the group, devserver and testing schedd
+    in it
+    """
+    h = hashlib.sha256(f"{COLLECTOR_HOST}\n{schedd_constraint}".encode()).hexdigest()
+    return f"schedd_ads_{h[:16]}.json"
+
+
+def store_cached_schedd_ads(cache_name: str, schedds: List[classad.ClassAd]) -> None:
+    """save schedd ads in the on-disk cache, ignoring any failure"""
+    try:
+        disk_cache.store(cache_name, [str(ad) for ad in schedds])
+    except OSError:
+        pass
+
+
+def refresh_cached_schedd_ads(cache_name: str, schedd_constraint: str) -> None:
+    """
+    re-query the collector and update the on-disk cache.  Only one process
+    refreshes a given entry at a time, the rest keep using the stale ads.
+    """
+    try:
+        with disk_cache.locked(cache_name) as have_lock:
+            if have_lock:
+                store_cached_schedd_ads(cache_name, query_schedd_ads(schedd_constraint))
+    except Exception:  # pylint: disable=broad-except
+        # we still have the stale ads, and the next process will try again
+        pass
+
+
+def load_cached_schedd_ads(
+    cache_name: str, schedd_constraint: str, vargs: Dict[str, Any]
+) -> Optional[List[classad.ClassAd]]:
+    """
+    get schedd ads from the on-disk cache if they are fresh enough, starting
+    a background refresh if they are stale.  Returns None if the caller needs
+    to ask the collector itself.
+    """
+    entry = disk_cache.load(cache_name)
+    if entry is None:
+        return None
+    age, adstrs = entry
+    if age > max(SCHEDD_CACHE_TTL, SCHEDD_CACHE_MAX_STALE):
+        return None
+    try:
+        schedds = [classad.parseOne(adstr) for adstr in adstrs]
+    except (SyntaxError, ValueError, TypeError):
+        return None
+
+    if age > SCHEDD_CACHE_TTL:
+        if vargs.get("verbose", 0) > 1:
+            print(f"Schedd ad cache is {int(age)}s old, refreshing in background")
+        threading.Thread(
+            target=refresh_cached_schedd_ads,
+            args=(cache_name, schedd_constraint),
+            name="refresh_schedd_ads",
+            # don't hold up a short jobsub command at exit for the collector
+            daemon=True,
+        ).start()
+
+    if vargs.get("verbose", 0) > 1:
+        print(
+            f"\nUsing schedd ads from {disk_cache.cache_path(cache_name)} - NOT querying condor collector\n"
+        )
+    return schedds
+
+
 def get_schedd_names(vargs: Dict[str, Any], available_only: bool = True) -> List[str]:
     """get jobsub* schedd names from collector"""
     schedds = get_schedd_list(vargs, available_only=available_only)
@@ -234,6 +331,22 @@ def get_schedd(vargs: Dict[str, Any]) -> classad.ClassAd:
     return res
 
 
+def get_schedd_handle(schedd_name: str) -> Any:
+    """get a (reused) htcondor.Schedd for schedd_name"""
+    if schedd_name not in __schedd_handles:
+        ad = __schedd_ads.get(schedd_name, None)
+        if ad is None:
+            # pylint: disable-next=no-member
+            c = htcondor.Collector(COLLECTOR_HOST)
+            # pylint: disable-next=no-member
+            ad = c.locate(htcondor.DaemonTypes.Schedd, schedd_name)
+        if ad is None:
+            raise NameError(f'unable to find schedd "{schedd_name}" in HTCondor pool')
+        # pylint: disable-next=no-member
+        __schedd_handles[schedd_name] = htcondor.Schedd(ad)
+    return __schedd_handles[schedd_name]
+
+
 def load_submit_file(filename: str) -> Tuple[Any, Optional[int]]:
     """pull in a condor submit file, make a dictionary"""
 
@@ -253,7 +366,7 @@ def load_submit_file(filename: str) -> Tuple[Any, Optional[int]]:
             if len(t) == 2:
                 res[t[0]] = t[1]
             elif line.startswith("queue"):
-                nqueue = int(line[5:])
+                nqueue = int(line[5:]) if line[5:].strip() else 1
             elif not line:
                 pass  # blank lines ok
             else:
@@ -299,12 +412,154 @@ def record_vault_storer_run(
 NO_OP_STORER = "/bin/true"
 
 
+def submit_engine() -> str:
+    """
+    which way to submit jobs: "condor_submit" (the default) runs the
+    condor_submit command, "bindings" (opt-in) submits through the htcondor
+    module.  The bindings engine only takes the plain "key = value" plus
+    "queue [N]" files jobsub writes itself, read with load_submit_file: no
+    "queue ... from/in/matching" item lists, line continuations, include or
+    if/else, and none of the extras condor_submit --dump would add.  Files it
+    can't read, and submissions with extra condor_submit arguments, still go
+    through condor_submit.
+    """
+    return os.environ.get("JOBSUB_SUBMIT_ENGINE", "condor_submit")
+
+
+def credential_storer(vargs: Dict[str, Any], schedd_name: str) -> str:
+    """pick our condor_vault_storer, or a no-op if we ran it recently"""
+    if vargs.get("managed_token", False) and ran_vault_storer_recently(
+        schedd_name,
+        vargs["oauth_handle"],
+        vargs["outbase"],
+        int(vargs.get("verbose", 0)),
+    ):
+        return NO_OP_STORER
+    jldir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return f"{jldir}/bin/condor_vault_storer"
+
+
+def oauth_service_requests(subm: Any) -> List[str]:
+    """
+    turn the OAuth service requests of a submit description into
+    condor_vault_storer arguments, the same way condor_submit does:
+        service[&handle=name][&scopes=s1,s2][&audience=aud]
+    """
+    res = []
+    for req in subm.oauth_services:
+        r = req["Service"]
+        if req.get("Handle", ""):
+            r = f"{r}&handle={req['Handle']}"
+        for attr in ("Scopes", "Audience"):
+            val = ",".join(re.split(r"[\s,]+", req.get(attr, "").strip('" ')))
+            if val:
+                r = f"{r}&{attr.lower()}={val}"
+        res.append(r)
+    return res
+
+
+def store_credentials(
+    subm: Any, vargs: Dict[str, Any], schedd_name: str, storer: str
+) -> bool:
+    """
+    run the credential storer for the OAuth services the submit description
+    needs, as condor_submit would before submitting
+    """
+    reqs = oauth_service_requests(subm)
+    if not reqs or storer == NO_OP_STORER:
+        return True
+    verbose = int(vargs.get("verbose", 0))
+    cmd = [storer]
+    if verbose == 1:
+        cmd.append("-v")
+    elif verbose > 1:
+        cmd.append("-d")
+    cmd.extend(reqs)
+    env = os.environ.copy()
+    env["_condor_CREDD_HOST"] = schedd_name
+    if verbose > 0:
+        print(f"Running: {' '.join(cmd)}")
+    output = subprocess.run(cmd, env=env, check=False)
+    return output.returncode == 0
+
+
+def report_job_id(cluster: str, vargs: Dict[str, Any], schedd_name: str) -> None:
+    """give the job id to the user, and call any job_info commands with it"""
+    hl = f"\n{'=-'*30}\n\n"  # highlight line to make result stand out
+    print(f"{hl}Use job id {cluster}.0@{schedd_name} to retrieve output{hl}")
+
+    # call any job_info commands requested with the jobid
+    for ji in vargs.get("job_info", []):
+        os.system(f'{ji} {cluster}.0@{schedd_name} "{repr(sys.argv)}" </dev/null')
+
+
+def submit_with_bindings(
+    f: str,
+    vargs: Dict[str, Any],
+    schedd_name: str,
+    loaded: Optional[Tuple[Any, Optional[int]]] = None,
+) -> Optional[int]:
+    """
+    Submit the jobs in submit file f (already loaded by load_submit_file,
+    if given) through the htcondor python bindings, returning the
+    ClusterId, or None if the submission failed
+    """
+    hl = f"\n{'=-'*30}\n\n"  # highlight line to make result stand out
+    verbose = int(vargs.get("verbose", 0))
+    storer = credential_storer(vargs, schedd_name)
+
+    bearer_token_file = None
+    if vargs.get("token", None) is not None:
+        bearer_token_file = os.environ["BEARER_TOKEN_FILE"]
+    packages.orig_env()
+    if bearer_token_file:
+        os.environ["BEARER_TOKEN_FILE"] = bearer_token_file
+
+    subm, nqueue = loaded if loaded is not None else load_submit_file(f)
+    count = 1 if nqueue is None else nqueue
+    try:
+        with submit_vt(vargs["group"], vargs["role"], schedd_name, verbose):
+            if not store_credentials(subm, vargs, schedd_name, storer):
+                sys.stderr.write(f"{hl}Error: storing credentials failed{hl}\n")
+                return None
+            schedd = get_schedd_handle(schedd_name)
+            # remote schedds need our input files spooled, as condor_submit -remote does
+            result = schedd.submit(subm, count=count, spool=True)
+            cluster = result.cluster()
+            schedd.spool(list(subm.jobs(count=count, clusterid=cluster)))
+    except (RuntimeError, ValueError, NameError, OSError) as e:
+        specific_error_msgs = ""
+        if "MAX_JOBS_PER_SUBMISSION" in str(e):
+            specific_error_msgs = generate_error_message_for_too_many_procs(
+                vargs, schedd_name
+            )
+        sys.stderr.write(
+            f"{hl}Error: submission to {schedd_name} failed: {e}\n\n"
+            f"{specific_error_msgs}{hl}\n"
+        )
+        return None
+
+    if vargs.get("managed_token", False) and storer != NO_OP_STORER:
+        record_vault_storer_run(
+            schedd_name, vargs["oauth_handle"], vargs["outbase"], verbose
+        )
+
+    print(f"{count} job(s) submitted to cluster {cluster}.")
+    report_job_id(str(cluster), vargs, schedd_name)
+    return int(cluster)
+
+
 # pylint: disable=dangerous-default-value,too-many-locals,too-many-branches,too-many-statements
 @as_span("submit", arg_attrs=["*"])
 def submit(
     f: str, vargs: Dict[str, Any], schedd_name: str, cmd_args: List[str] = []
 ) -> Union[Any, bool]:
-    """Actually submit the job, using condor python bindings"""
+    """
+    Actually submit the job, with condor_submit or (JOBSUB_SUBMIT_ENGINE=
+    bindings) the condor python bindings.  Returns the ClusterId, or None
+    if the submission failed; False with --no-submit.  condor_submit output
+    without a cluster id still counts as success, and gives True.
+    """
 
     schedd_args = f"-remote {schedd_name}"
 
@@ -321,8 +576,18 @@ def submit(
     if vargs.get("verbose", 0) > 1:
         print(f"cmd_args: {cmd_args}")
 
-    # commenting this out for now since the 'else' is not implemented
-    #    if True:
+    # the bindings can only do plain submit files; extra condor_submit
+    # arguments still need the real thing
+    if submit_engine() == "bindings" and f and not cmd_args:
+        try:
+            loaded = load_submit_file(f)
+        except (SyntaxError, ValueError) as e:
+            sys.stderr.write(
+                f"Notice: submitting {f} with condor_submit, "
+                f"the bindings submit engine can't read it: {e}\n"
+            )
+        else:
+            return submit_with_bindings(f, vargs, schedd_name, loaded)
 
     qargs = " ".join([f"'{x}'" for x in cmd_args])
     cmd = f"/usr/bin/condor_submit -pool {COLLECTOR_HOST} {schedd_args} {qargs}"
@@ -333,8 +598,6 @@ def submit(
     # set up to use our custom condor_vault_storer until we get
     # the updated one in the condor release
     #
-    jldir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-
     # Set the _condor_SEC_CREDENTIAL_STORER environment variable to the path of the
     # correct vault token storer script
     # In the condor_vault_storer output, debug gives us more output than verbose,
@@ -342,12 +605,7 @@ def submit(
 
     verbose = int(vargs.get("verbose", 0))
 
-    if vargs.get("managed_token", False) and ran_vault_storer_recently(
-        schedd_name, vargs["oauth_handle"], vargs["outbase"], verbose
-    ):
-        _sec_cred_storer_val = NO_OP_STORER
-    else:
-        _sec_cred_storer_val = f"{jldir}/bin/condor_vault_storer"
+    _sec_cred_storer_val = credential_storer(vargs, schedd_name)
 
     cmd = f'_condor_SEC_CREDENTIAL_STORER="{_sec_cred_storer_val}" {cmd}'
     if vargs.get("verbose", 0) == 1:
@@ -414,27 +672,14 @@ def submit(
         # If we had a successful submission, give the job id to the user
         m = re.search(r"\d+ job\(s\) submitted to cluster (\d+).", output.stdout)
         if m:
-            print(f"{hl}Use job id {m.group(1)}.0@{schedd_name} to retrieve output{hl}")
-
-            # call any job_info commands requested with the jobid
-            for ji in vargs.get("job_info", []):
-                os.system(
-                    f'{ji} {m.group(1)}.0@{schedd_name} "{repr(sys.argv)}" </dev/null'
-                )
+            report_job_id(m.group(1), vargs, schedd_name)
+            return int(m.group(1))
 
         return True
     except OSError as e:
         print("Execution failed: ", e)
         return None
 
-    # This 'else' is not currently implemented
-    #    else:
-    #        subm, nqueue = load_submit_file(f)
-    #        with schedd.transaction() as txn:
-    #            cluster = subm.queue(txn, count=nqueue)
-    #        print(f"jobid: {cluster}@{schedd_name}")
-    #        return True
-
 
 def get_transfer_file_list(f: str) -> List[str]:
     """read submit file, look for needed SCRIPT or JOB files"""
@@ -502,7 +747,7 @@ def submit_dag(
         #    cmd = f"BEARER_TOKEN_FILE={os.environ['BEARER_TOKEN_FILE']} {cmd}"
 
         if vargs["outurl"]:
-            transfer_sandbox(vargs["outdir"], vargs["outurl"])
+            start_transfer_sandbox(vargs["outdir"], vargs["outurl"])
 
         if vargs.get("verbose", 0) > 0:
             print(f"Running: {cmd}")
@@ -569,11 +814,7 @@ class Job:
         return f"{self.seq}.{self.proc}@{self.schedd}"
 
     def _get_schedd(self) -> htcondor.htcondor.Schedd:
-        c = htcondor.Collector(COLLECTOR_HOST)
-        s = c.locate(htcondor.DaemonTypes.Schedd, self.schedd)
-        if s is None:
-            raise NameError(f'unable to find schedd "{self.schedd}" in HTCondor pool')
-        return htcondor.Schedd(s)
+        return get_schedd_handle(self.schedd)
 
     def _constraint(self) -> str:
         q = f"ClusterId=={self.seq}"
@@ -15,7 +15,9 @@
 # limitations under the License.
 """ credential related routines """
 import os
-from typing import Any, Dict, Optional, List
+import threading
+import time
+from typing import Any, Dict, Optional, List, Tuple
 
 import fake_ifdh
 import packages
@@ -66,6 +68,88 @@ SUPPORTED_AUTH_METHODS = list(
 )  # Dynamically populate our SUPPORTED_AUTH_METHODS, and make sure it includes REQUIRED_AUTH_METHODS
 
 
+# credentials get_creds already found in this process, see _cached_creds
+_CredsKey = Tuple[Any, ...]
+_creds_cache: Dict[
+    _CredsKey, Tuple[float, Dict[str, Optional[str]], Dict[str, Any]]
+] = {}
+_creds_cache_lock = threading.Lock()
+
+
+def creds_cache_sec() -> float:
+    """
+    how long get_creds reuses credentials it found, $JOBSUB_CREDS_CACHE_SEC;
+    0 turns that off
+    """
+    return float(os.environ.get("JOBSUB_CREDS_CACHE_SEC", "300"))
+
+
+def clear_creds_cache() -> None:
+    """forget credentials found by earlier get_creds calls"""
+    with _creds_cache_lock:
+        _creds_cache.clear()
+
+
+def _cred_stat(path: Optional[str]) -> Any:
+    if not path:
+        return None
+    try:
+        st = os.stat(path)
+    except OSError:
+        return False
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+
+def _creds_expire(creds: Dict[str, Optional[str]]) -> float:
+    """when to stop reusing creds: our cache time, or near token expiry"""
+    expires = time.time() + creds_cache_sec()
+    if creds.get("token"):
+        try:
+            exp = float(str(fake_ifdh.load_token(creds["token"]).get("exp")))
+        except Exception:  # pylint: disable=broad-except
+            return 0
+        # same margin as fake_ifdh.checkToken_not_expired
+        expires = min(expires, exp - 60)
+    return expires
+
+
+def _creds_key(
+    role: str, auth_methods: List[str], force_proxy: bool, strict_proxy: bool
+) -> _CredsKey:
+    return (
+        role,
+        tuple(auth_methods),
+        fake_ifdh.getExp(),
+        force_proxy,
+        strict_proxy,
+        os.environ.get(CredentialSet.TOKEN_ENV),
+        os.environ.get(CredentialSet.PROXY_ENV),
+    )
+
+
+def _cached_creds(key: _CredsKey) -> Optional[Dict[str, Optional[str]]]:
+    with _creds_cache_lock:
+        entry = _creds_cache.get(key)
+    if entry is None:
+        return None
+    expires, creds, stats = entry
+    if time.time() >= expires or any(
+        _cred_stat(path) != stats[ctype] for ctype, path in creds.items()
+    ):
+        with _creds_cache_lock:
+            _creds_cache.pop(key, None)
+        return None
+    return creds
+
+
+def _remember_creds(key: _CredsKey, creds: Dict[str, Optional[str]]) -> None:
+    if creds_cache_sec() <= 0:
+        return
+    stats = {ctype: _cred_stat(path) for ctype, path in creds.items()}
+    with _creds_cache_lock:
+        _creds_cache[key] = (_creds_expire(creds), creds, stats)
+
+
 # pylint: disable=dangerous-default-value
 @as_span("get_creds")
 def get_creds(args: Dict[str, Any] = {}) -> CredentialSet:
@@ -91,6 +175,15 @@ def get_creds(args: Dict[str, Any] = {}) -> CredentialSet:
     if args.get("verbose", 0) > 0:
         print(f"Requested auth methods are: {auth_methods}")
 
+    # the same request again, in the same environment, can have the same
+    # credentials while they are still good
+    force_proxy = args.get("force_proxy", False)
+    strict_proxy = args.get("strict_proxy", False)
+    key = _creds_key(role, auth_methods, force_proxy, strict_proxy)
+    cached = _cached_creds(key)
+    if cached is not None:
+        return CredentialSet(**cached)
+
     creds_to_return: Dict[str, Optional[str]] = {
         cred_type: None for cred_type in SUPPORTED_AUTH_METHODS
     }
@@ -99,12 +192,13 @@ def get_creds(args: Dict[str, Any] = {}) -> CredentialSet:
         t = t.strip()
         creds_to_return["token"] = t
     if "proxy" in auth_methods:
-        p = fake_ifdh.getProxy(
-            role, args.get("verbose", 0), args.get("force_proxy", False)
-        )
+        p = fake_ifdh.getProxy(role, args.get("verbose", 0), force_proxy, strict_proxy)
         p = p.strip()
         creds_to_return["proxy"] = p
     obtained_creds = CredentialSet(**creds_to_return)
+    # later calls will see the environment CredentialSet just set up
+    for k in {key, _creds_key(role, auth_methods, force_proxy, strict_proxy)}:
+        _remember_creds(k, creds_to_return)
     return obtained_creds
 
 
@@ -14,18 +14,50 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 """ dagnabbit DAG parser """
+import argparse
+import functools
+import hashlib
+import json
 import sys
 import os
 import os.path
 import re
-from typing import Dict, List, Any
-
-import jinja2 as jinja  # type: ignore # pylint: disable=import-error
+from typing import Dict, List, Any, Tuple
 
 import creds
 from get_parser import get_parser
+from render_files import get_jinja_env
 from tarfiles import do_tarballs
-from utils import set_extras_n_fix_units, backslash_escape_layer
+from utils import (
+    set_extras_n_fix_units,
+    backslash_escape_layer,
+    submission_context,
+)
+
+
+@functools.lru_cache(maxsize=1)
+def stage_parser() -> Tuple[argparse.ArgumentParser, Dict[str, Any]]:
+    """
+    the parser for jobsub, prescript and postscript lines, and its
+    defaults, built once; building get_parser() is most of the cost of
+    parsing a stage line
+    """
+    parser = get_parser()
+    dests = {a.dest for a in parser._actions}  # pylint: disable=protected-access
+    return parser, {k: parser.get_default(k) for k in dests}
+
+
+def stage_hash(stage_values: Dict[str, Any]) -> str:
+    """
+    hash of everything that goes into rendering a stage, other than its
+    own file names; stages with the same hash can share .cmd/.sh files
+    """
+    key = {
+        k: v for k, v in stage_values.items() if k not in ("script_name", "cmd_name")
+    }
+    return hashlib.sha256(
+        json.dumps(key, sort_keys=True, default=repr).encode()
+    ).hexdigest()
 
 
 def parse_dagnabbit(
@@ -41,17 +73,22 @@ def parse_dagnabbit(
     along with ones parsed from dagnabbit file
     """
     # pylint: disable=too-many-locals,too-many-branches,too-many-statements
-    jinja_env = jinja.Environment(loader=jinja.FileSystemLoader(srcdir))
-    jinja_env.filters["basename"] = os.path.basename
+    jinja_env = get_jinja_env(srcdir, strict=False)
+    cmd_template = jinja_env.get_template("simple.cmd")
+    sh_template = jinja_env.get_template("simple.sh")
     cred_set = creds.get_creds(values)
-    prev_jobsub_line = "xxx"
-    prev_jobsub_count = 0
+    # what's the same for every stage, looked up once
+    ctx = submission_context(schedd_name, cred_set, values.get("verbose", 0))
+    # stages we have written files for, by jobsub line and by stage_hash(),
+    # with the values for any prescript/postscript lines after them
+    line_stages: Dict[str, Tuple[str, Dict[str, Any], Dict[str, Any]]] = {}
+    hash_stages: Dict[str, str] = {}
     count = 0
     linenum = 0
     pstack: List[List[List[str]]] = []
     dagfile = values["executable"].replace("file://", "")
     with open(dagfile, "r", encoding="UTF-8") as df, open(
-        os.path.join(dest, "dag.dag"), "w", encoding="UTF-8"
+        os.path.join(dest, "dag.dag"), "w", encoding="UTF-8", buffering=1024 * 1024
     ) as of:
         of.write("DOT dag.dot UPDATE\n")
         in_parallel = False
@@ -143,21 +180,18 @@ def parse_dagnabbit(
                 line = re.sub(f"\\b{count-2}\\s*$", "$(CM2)", line)
                 line = re.sub(f"\\b{count-1}\\s*$", "$(CM1)", line)
 
-                if line == prev_jobsub_line:
-                    prevname = f"stage_{prev_jobsub_count}"
-                    # if it is the same as the last jobsub line, just reuse the same cmd file, which
+                if line in line_stages:
+                    # if it is the same as an earlier jobsub line, just reuse the same cmd file, which
                     # uses the same wrapper script, etc.  This considerably trims, for example,the
                     # dag output of project.py which will happily write 1000 identical worker stages..
+                    prevname, thesevalues, update_with = line_stages[line]
                     of.write(f"\nJOB {name} {prevname}.cmd\n")
                     of.write(
                         f'VARS {name} JOBSUBJOBSECTION="{count}" CM2="{count-2}" CM1="{count-1}" nodename="$(JOB)"\n'
                     )
 
                 else:
-                    prev_jobsub_line = line
-                    prev_jobsub_count = count
-
-                    parser = get_parser()
+                    parser, defaults = stage_parser()
                     try:
                         line_argv = line.strip().split()[1:]
                         backslash_escape_layer(line_argv)
@@ -194,10 +228,10 @@ def parse_dagnabbit(
 
                     # we get a bunch of defaults from the command line parser that
                     # we don't want to override from the initial command line
-                    update_with: Dict[str, Any] = vars(res)
+                    update_with = vars(res)
                     kl = list(update_with.keys())
                     for k in kl:
-                        if update_with[k] is parser.get_default(k):
+                        if update_with[k] is defaults.get(k):
                             del update_with[k]
 
                     # the list ones here do  not get cleaned out by the above
@@ -214,22 +248,23 @@ def parse_dagnabbit(
                         else:
                             thesevalues[k] = update_with[k]
 
-                    set_extras_n_fix_units(thesevalues, schedd_name, cred_set)
-                    thesevalues["script_name"] = f"{name}.sh"
-                    thesevalues["cmd_name"] = f"{name}.cmd"
-                    with open(
-                        os.path.join(dest, f"{name}.cmd"), "w", encoding="UTF-8"
-                    ) as cf:
-                        cf.write(
-                            jinja_env.get_template("simple.cmd").render(**thesevalues)
-                        )
-                    with open(
-                        os.path.join(dest, f"{name}.sh"), "w", encoding="UTF-8"
-                    ) as csf:
-                        csf.write(
-                            jinja_env.get_template("simple.sh").render(**thesevalues)
-                        )
-                    of.write(f"\nJOB {name} {name}.cmd\n")
+                    set_extras_n_fix_units(thesevalues, schedd_name, cred_set, ctx)
+                    # a different line can still come out the same as an earlier stage
+                    shash = stage_hash(thesevalues)
+                    cmdname = hash_stages.setdefault(shash, name)
+                    if cmdname == name:
+                        thesevalues["script_name"] = f"{name}.sh"
+                        thesevalues["cmd_name"] = f"{name}.cmd"
+                        with open(
+                            os.path.join(dest, f"{name}.cmd"), "w", encoding="UTF-8"
+                        ) as cf:
+                            cf.write(cmd_template.render(**thesevalues))
+                        with open(
+                            os.path.join(dest, f"{name}.sh"), "w", encoding="UTF-8"
+                        ) as csf:
+                            csf.write(sh_template.render(**thesevalues))
+                    line_stages[line] = (cmdname, thesevalues, update_with)
+                    of.write(f"\nJOB {name} {cmdname}.cmd\n")
                     of.write(
                         f'VARS {name} JOBSUBJOBSECTION="{count}" CM2="{count-2}" CM1="{count-1}" nodename="$(JOB)"\n'
                     )
@@ -257,7 +292,7 @@ def parse_dagnabbit(
                     )
                 in_prescript = True
                 name = f"stage_{count}"
-                parser = get_parser()
+                parser, _ = stage_parser()
                 try:
                     res = parser.parse_args(line.strip().split()[1:])
                 except:
@@ -271,7 +306,7 @@ def parse_dagnabbit(
                 of.write(f"SCRIPT PRE {name} {prescript_base} {prescript_args}\n")
                 thesevalues["prescript"] = prescript
                 thesevalues.update(update_with)
-                set_extras_n_fix_units(thesevalues, schedd_name, cred_set)
+                set_extras_n_fix_units(thesevalues, schedd_name, cred_set, ctx)
 
             elif line.startswith("postscript "):
                 if debug_comments:
@@ -283,7 +318,7 @@ def parse_dagnabbit(
                     )
                 in_postscript = True
                 name = f"stage_{count}"
-                parser = get_parser()
+                parser, _ = stage_parser()
                 try:
                     res = parser.parse_args(line.strip().split()[1:])
                 except:
@@ -297,7 +332,7 @@ def parse_dagnabbit(
                 of.write(f"SCRIPT POST {name} {postscript_base} {postscript_args}\n")
                 thesevalues["postscript"] = postscript
                 thesevalues.update(update_with)
-                set_extras_n_fix_units(thesevalues, schedd_name, cred_set)
+                set_extras_n_fix_units(thesevalues, schedd_name, cred_set, ctx)
 
             elif not line.strip() or line.strip().startswith("#"):
                 # blank lines and comments are fine
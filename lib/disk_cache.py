@@ -0,0 +1,88 @@
+#
+# COPYRIGHT 2024 FERMI NATIONAL ACCELERATOR LABORATORY
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+#
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+""" small on-disk cache shared between jobsub_lite processes """
+from contextlib import contextmanager
+import fcntl
+import json
+import os
+import tempfile
+import time
+from typing import Any, Generator, Optional, Tuple
+
+
+def cache_dir() -> str:
+    """where jobsub_lite keeps scratch and cache files for this user"""
+    return (
+        os.environ.get("XDG_CACHE_HOME", f"{os.environ.get('HOME')}/.cache")
+        + "/jobsub_lite"
+    )
+
+
+def cache_path(name: str) -> str:
+    """full path of cache entry name"""
+    return os.path.join(cache_dir(), name)
+
+
+def load(name: str) -> Optional[Tuple[float, Any]]:
+    """
+    read cache entry name, returning (age in seconds, data), or None
+    if there is no usable entry
+    """
+    path = cache_path(name)
+    try:
+        with open(path, "r", encoding="UTF-8") as f:
+            age = time.time() - os.fstat(f.fileno()).st_mtime
+            return age, json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def store(name: str, data: Any) -> None:
+    """
+    write cache entry name atomically -- readers either see the old
+    entry or the new one, never a partial file
+    """
+    d = cache_dir()
+    os.makedirs(d, exist_ok=True)
+    fd, tmpname = tempfile.mkstemp(dir=d, prefix=f".{name}.")
+    try:
+        with os.fdopen(fd, "w", encoding="UTF-8") as f:
+            json.dump(data, f)
+        os.replace(tmpname, cache_path(name))
+    except BaseException:
+        if os.path.exists(tmpname):
+            os.unlink(tmpname)
+        raise
+
+
+@contextmanager
+def locked(name: str, blocking: bool = False) -> Generator[bool, None, None]:
+    """
+    hold an advisory lock on cache entry name; yields False instead of
+    waiting if someone else holds it and blocking is False
+    """
+    d = cache_dir()
+    os.makedirs(d, exist_ok=True)
+    with open(os.path.join(d, f".{name}.lock"), "a", encoding="UTF-8") as lf:
+        try:
+            fcntl.flock(lf, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lf, fcntl.LOCK_UN)
@@ -20,17 +20,24 @@
 """ifdh replacemnents to remove dependency"""
 
 import argparse
+import datetime
 import os
 import io
 import re
 import shlex
 import subprocess
 import sys
+import threading
 import time
-from typing import Union, Optional, List, Dict, Tuple, Any
+from typing import Union, Optional, List, Dict, Mapping, NamedTuple, Tuple, Any
+import urllib.parse
+import xml.etree.ElementTree as ET
 
 # pylint: disable=import-error
+from cryptography import x509
 import jwt  # type: ignore
+import requests  # type: ignore
+import requests.adapters  # type: ignore
 import scitokens  # type: ignore
 
 # TODO: Do we need this anymore since we're IN lib?  # pylint: disable=fixme
@@ -38,7 +45,11 @@ PREFIX = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.append(os.path.join(PREFIX, "lib"))
 
 import htcondor  # type: ignore # pylint: disable=wrong-import-position
-from tracing import as_span, add_event  # pylint: disable=wrong-import-position
+from tracing import (  # pylint: disable=wrong-import-position
+    as_span,
+    add_event,
+    set_attribute,
+)
 
 VAULT_OPTS = htcondor.param.get("SEC_CREDENTIAL_GETTOKEN_OPTS", "")
 DEFAULT_ROLE = "Analysis"
@@ -145,13 +156,51 @@ def getRole_from_default_role_file() -> Optional[str]:
     return None
 
 
+# tokens we have already deserialized, by file (path, mtime, size, inode),
+# so a new token from htgettoken is read again
+_token_cache: Dict[Tuple[str, int, int, int], scitokens.SciToken] = {}
+_token_cache_lock = threading.Lock()
+
+
+def _token_key(st: os.stat_result, path: str) -> Tuple[str, int, int, int]:
+    return (path, st.st_mtime_ns, st.st_size, st.st_ino)
+
+
+def load_token(tokenfile: Optional[str] = None) -> scitokens.SciToken:
+    """
+    deserialize the token in tokenfile (default $BEARER_TOKEN_FILE), at most
+    once per version of the file.  Errors are raised as from
+    scitokens.SciToken.deserialize, and not remembered.
+    """
+    if tokenfile is None:
+        if os.environ.get("BEARER_TOKEN", None):
+            # discover() would use that ahead of the file
+            return scitokens.SciToken.discover(insecure=True)
+        tokenfile = os.environ["BEARER_TOKEN_FILE"]
+    path = os.path.realpath(tokenfile)
+    with _token_cache_lock:
+        token = _token_cache.get(_token_key(os.stat(path), path))
+    if token is not None:
+        return token
+    with open(path, "r", encoding="UTF-8") as f:
+        serialized = f.read().strip()
+        key = _token_key(os.fstat(f.fileno()), path)
+    token = scitokens.SciToken.deserialize(serialized, insecure=True)
+    with _token_cache_lock:
+        # only keep the latest version of each file
+        for k in [k for k in _token_cache if k[0] == path]:
+            del _token_cache[k]
+        _token_cache[key] = token
+    return token
+
+
 def getRole_from_valid_token() -> Optional[str]:
     # if there's a role in the wlcg.groups of the token, pick that
     if os.environ.get("BEARER_TOKEN_FILE", False) and os.path.exists(
         os.environ["BEARER_TOKEN_FILE"]
     ):
         try:
-            token = scitokens.SciToken.discover(insecure=True)
+            token = load_token()
         except scitokens.utils.errors.InvalidTokenFormat:
             raise scitokens.utils.errors.InvalidTokenFormat(
                 "Token stored in $BEARER_TOKEN_FILE is not in a readable format. "
@@ -198,7 +247,7 @@ def checkToken(group: str, role: str = DEFAULT_ROLE) -> bool:
         return False
 
     try:
-        token = scitokens.SciToken.discover(insecure=True)
+        token = load_token()
     except jwt.ExpiredSignatureError:
         # Token has already expired
         return False
@@ -296,13 +345,104 @@ def getToken(role: str = DEFAULT_ROLE, verbose: int = 0) -> str:
     return tokenfile
 
 
+# the VOMS attribute certificate extension, and the FQANs in it
+VOMS_AC_OID = x509.ObjectIdentifier("1.3.6.1.4.1.8005.100.100.5")
+fqan_re = re.compile(rb"(/[\w.-]+(?:/[\w.-]+)*/Role=[\w.-]+(?:/Capability=[\w.-]+)?)")
+pem_cert_re = re.compile(
+    rb"-----BEGIN CERTIFICATE-----.+?-----END CERTIFICATE-----", re.DOTALL
+)
+
+# what voms-proxy-info -valid 0:10 always asked of a proxy, which is still
+# all we ask outside of submitting jobs
+PROXY_CHECK_LIFETIME = 10 * 60
+
+
+class ProxyInfo(NamedTuple):
+    """what we need to know about an existing proxy"""
+
+    not_after: float
+    fqans: List[str]
+
+
+def proxy_min_lifetime() -> float:
+    """
+    seconds a proxy needs left to be reused, from $JOBSUB_PROXY_MIN_LIFETIME
+    in hours (default 24)
+    """
+    return float(os.environ.get("JOBSUB_PROXY_MIN_LIFETIME", "24")) * 3600
+
+
+def load_pem_certs(data: bytes) -> List[x509.Certificate]:
+    """all the certificates in PEM data, in order"""
+    if hasattr(x509, "load_pem_x509_certificates"):
+        return x509.load_pem_x509_certificates(data)
+    # cryptography < 39 (EL9 has 36) only loads one at a time
+    certs = [x509.load_pem_x509_certificate(m) for m in pem_cert_re.findall(data)]
+    if not certs:
+        raise ValueError("no certificates found")
+    return certs
+
+
+def proxy_info(proxyfile: str) -> Optional[ProxyInfo]:
+    """
+    read proxyfile in-process: when it (or the chain in it) expires, and the
+    VOMS FQANs, primary first.  None if it can't be read, for whatever
+    reason; getProxy then asks voms-proxy-info.
+    """
+    try:
+        with open(proxyfile, "rb") as f:
+            certs = load_pem_certs(f.read())
+        not_after = min(
+            getattr(c, "not_valid_after_utc", None)
+            or c.not_valid_after.replace(tzinfo=datetime.timezone.utc)
+            for c in certs
+        ).timestamp()
+        fqans: List[str] = []
+        try:
+            ac = certs[0].extensions.get_extension_for_oid(VOMS_AC_OID).value
+            if isinstance(ac, x509.UnrecognizedExtension):
+                fqans = [m.decode() for m in fqan_re.findall(ac.value)]
+        except x509.ExtensionNotFound:
+            pass
+    except Exception:  # pylint: disable=broad-except
+        return None
+    return ProxyInfo(not_after, fqans)
+
+
+def proxy_decision(vomsfile: str, igroup: str, role: str, strict: bool = False) -> str:
+    """
+    whether we can reuse the proxy in vomsfile for igroup and role:
+    "reuse", or why not: "missing", "unreadable", "expiring", "fqan".
+    strict is for submitting jobs: the proxy needs proxy_min_lifetime() left
+    and the right primary FQAN.  Otherwise 10 minutes left will do.
+    """
+    if not os.path.exists(vomsfile):
+        return "missing"
+    info = proxy_info(vomsfile)
+    if info is None:
+        return "unreadable"
+    min_lifetime = proxy_min_lifetime() if strict else PROXY_CHECK_LIFETIME
+    if info.not_after - time.time() < min_lifetime:
+        return "expiring"
+    if not strict:
+        return "reuse"
+    want = f"/{igroup}/Role={role}".lower()
+    if not info.fqans or not info.fqans[0].lower().startswith(want):
+        return "fqan"
+    return "reuse"
+
+
 # pylint: disable=too-many-locals
 @as_span("getProxy")
 def getProxy(
-    role: str = DEFAULT_ROLE, verbose: int = 0, force_proxy: bool = False
+    role: str = DEFAULT_ROLE,
+    verbose: int = 0,
+    force_proxy: bool = False,
+    strict: bool = False,
 ) -> str:
     """get path to proxy certificate file and regenerate proxy if needed.
-    Setting force_proxy=True will force regeneration of the proxy"""
+    Setting force_proxy=True will force regeneration of the proxy;
+    strict=True (for submitting) renews it early, see proxy_decision"""
 
     def generate_proxy_command_verbose_args(cmd_str: str) -> Dict[str, Any]:
         # Helper function to handle verbose and regular mode
@@ -342,13 +482,23 @@ def getProxy(
     certfile = os.environ.get("X509_USER_PROXY", f"{tmp}/x509up_u{pid}")
 
     invalid_proxy = False
-    if not force_proxy:
-        chk_cmd_str = f"voms-proxy-info -exists -valid 0:10 -file {vomsfile}"
-        extra_check_args = generate_proxy_command_verbose_args(chk_cmd_str)
-        try:
-            subprocess.run(shlex.split(chk_cmd_str), check=True, **extra_check_args)
-        except subprocess.CalledProcessError:
-            invalid_proxy = True
+    if force_proxy:
+        set_attribute("proxy_decision", "forced")
+    else:
+        decision = proxy_decision(vomsfile, igroup, role, strict)
+        set_attribute("proxy_decision", decision)
+        if verbose > 0:
+            sys.stderr.write(f"proxy {vomsfile}: {decision}\n")
+        if decision == "unreadable":
+            # see if voms-proxy-info can make more sense of it
+            chk_cmd_str = f"voms-proxy-info -exists -valid 0:10 -file {vomsfile}"
+            extra_check_args = generate_proxy_command_verbose_args(chk_cmd_str)
+            try:
+                subprocess.run(shlex.split(chk_cmd_str), check=True, **extra_check_args)
+            except (subprocess.CalledProcessError, FileNotFoundError):
+                invalid_proxy = True
+        else:
+            invalid_proxy = decision != "reuse"
 
     if force_proxy or invalid_proxy:
         cigetcert_cmd_str = f"cigetcert -i 'Fermi National Accelerator Laboratory' -n --proxyhours 168 --minhours 167 -o {certfile}"
@@ -424,16 +574,193 @@ def chmod(dest: str, mode: int) -> None:
         pass
 
 
-def mkdir_p(dest: str) -> None:
-    """make possibly multiple directories"""
+# WebDAV, done in-process for http(s) urls, so we don't start a shell and
+# a gfal process (with its own TLS setup) for every operation.
+# $JOBSUB_WEBDAV_ENGINE=gfal goes back to gfal for everything.
+WEBDAV_TIMEOUT = (30, 300)
+DAV_NS = "{DAV:}"
+
+_webdav_sessions: Dict[str, requests.Session] = {}
+_webdav_sessions_lock = threading.Lock()
+
+
+class WebDAVError(Exception):
+    """
+    the server said no.  The token may not have the storage scope it needs
+    when a proxy would, so callers retry these with gfal.
+    """
+
+    def __init__(self, what: str, url: str, r: requests.Response) -> None:
+        super().__init__(f"Unable to {what} {url}: {r.status_code} {r.reason}")
+        self.status_code = r.status_code
+
+
+def webdav_engine() -> str:
+    """which way to do remote operations: "native" (the default) or "gfal" """
+    return os.environ.get("JOBSUB_WEBDAV_ENGINE", "native")
+
+
+def _bearer_token(env: Optional[Mapping[str, str]] = None) -> Optional[str]:
+    if env is None:
+        env = os.environ
+    tokenfile = env.get("BEARER_TOKEN_FILE", None)
+    if tokenfile and os.path.exists(tokenfile):
+        with open(tokenfile, "r", encoding="UTF-8") as f:
+            return f.read().strip()
+    return env.get("BEARER_TOKEN", None)
+
+
+def _system(cmd: str, env: Optional[Mapping[str, str]] = None) -> int:
+    """os.system, or run cmd with env instead of os.environ if given"""
+    if env is None:
+        return os.system(cmd)
+    return subprocess.run(cmd, shell=True, env=dict(env), check=False).returncode
+
+
+def _use_webdav(*urls: str, env: Optional[Mapping[str, str]] = None) -> bool:
+    """
+    can we do this operation natively: every remote url is http(s) on the
+    same server, and we have a token to do it with
+    """
+    if webdav_engine() == "gfal":
+        return False
+    netlocs = set()
+    for url in urls:
+        u = urllib.parse.urlparse(url)
+        if u.scheme in ("http", "https"):
+            netlocs.add(u.netloc)
+        elif u.scheme not in ("", "file"):
+            return False
+    return len(netlocs) == 1 and _bearer_token(env) is not None
+
+
+def webdav_session(url: str) -> requests.Session:
+    """get the pooled http session for the server in url"""
+    netloc = urllib.parse.urlparse(url).netloc
+    with _webdav_sessions_lock:
+        session = _webdav_sessions.get(netloc)
+        if session is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_maxsize=16)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            certdir = os.environ.get("X509_CERT_DIR", "/etc/grid-security/certificates")
+            if os.path.isdir(certdir):
+                session.verify = certdir
+            _webdav_sessions[netloc] = session
+        return session
+
+
+def _dav_request(
+    method: str, url: str, env: Optional[Mapping[str, str]] = None, **kwargs: Any
+) -> requests.Response:
+    headers = kwargs.pop("headers", {})
+    headers["Authorization"] = f"Bearer {_bearer_token(env)}"
+    return webdav_session(url).request(
+        method, url, headers=headers, timeout=WEBDAV_TIMEOUT, **kwargs
+    )
+
+
+def _local_path(path: str) -> Optional[str]:
+    """the local file path for path, or None if it is remote"""
+    u = urllib.parse.urlparse(path)
+    if u.scheme == "file":
+        return urllib.parse.unquote(u.path)
+    if u.scheme == "":
+        return path
+    return None
+
+
+def dav_mkdir_p(url: str, env: Optional[Mapping[str, str]] = None) -> None:
+    """make url and any missing parent collections with MKCOL"""
+    r = _dav_request("MKCOL", url, env)
+    if r.status_code == 409:
+        # parent is missing
+        parent = url.rstrip("/").rsplit("/", 1)[0]
+        if parent.count("/") > 2:
+            dav_mkdir_p(parent, env)
+            r = _dav_request("MKCOL", url, env)
+    # 405 means it is already there
+    if r.status_code not in (200, 201, 405):
+        raise WebDAVError("make directory", url, r)
+
+
+def dav_ls(url: str) -> List[str]:
+    """
+    list url with PROPFIND, like gfal-ls: names in a collection,
+    or url itself for a file; empty if it isn't there
+    """
+    r = _dav_request(
+        "PROPFIND", url, headers={"Depth": "1", "Content-Type": "application/xml"}
+    )
+    if r.status_code == 404:
+        return []
+    if r.status_code != 207:
+        raise WebDAVError("list", url, r)
+    self_path = urllib.parse.urlparse(url).path.rstrip("/")
+    names = []
+    iscollection = False
+    for resp in ET.fromstring(r.content).iter(f"{DAV_NS}response"):
+        href = resp.findtext(f"{DAV_NS}href", "")
+        path = urllib.parse.unquote(urllib.parse.urlparse(href).path).rstrip("/")
+        if path == urllib.parse.unquote(self_path):
+            iscollection = resp.find(f".//{DAV_NS}collection") is not None
+        else:
+            names.append(os.path.basename(path))
+    if not iscollection and not names:
+        return [url]
+    return names
+
+
+def dav_cp(src: str, dest: str, env: Optional[Mapping[str, str]] = None) -> None:
+    """copy with PUT (upload), GET (download) or COPY (on the server)"""
+    srcpath = _local_path(src)
+    destpath = _local_path(dest)
+    if srcpath is not None:
+        with open(srcpath, "rb") as f:
+            r = _dav_request("PUT", dest, env, data=f)
+    elif destpath is not None:
+        r = _dav_request("GET", src, env, stream=True)
+        if r.ok:
+            with open(destpath, "wb") as f:
+                for chunk in r.iter_content(1024 * 1024):
+                    f.write(chunk)
+    else:
+        r = _dav_request(
+            "COPY", src, env, headers={"Destination": dest, "Overwrite": "F"}
+        )
+    if not r.ok:
+        raise WebDAVError(f"copy {src} to", dest, r)
+
+
+def _gfal_fallback(what: str, e: Exception) -> None:
+    sys.stderr.write(f"Notice: webdav {what} failed ({e}), retrying with gfal\n")
+
+
+def mkdir_p(dest: str, env: Optional[Mapping[str, str]] = None) -> None:
+    """
+    make possibly multiple directories.  env, if given, is used instead of
+    os.environ, for callers in threads that must not see it change.
+    """
     dest = fix_pnfs(dest)
-    if 0 != os.system(f"{gfal_clean_env}; gfal-mkdir -p {dest}"):
+    if _use_webdav(dest, env=env):
+        try:
+            dav_mkdir_p(dest, env)
+            return
+        except (requests.exceptions.RequestException, WebDAVError) as e:
+            _gfal_fallback("mkdir", e)
+    if 0 != _system(f"{gfal_clean_env}; gfal-mkdir -p {dest}", env):
         raise PermissionError(f"Error: Unable to make directory {dest}")
 
 
 def ls(dest: str) -> List[str]:
     """make possibly multiple directories"""
     dest = fix_pnfs(dest)
+    if _use_webdav(dest):
+        try:
+            return dav_ls(dest)
+        except (requests.exceptions.RequestException, WebDAVError, ET.ParseError) as e:
+            _gfal_fallback("ls", e)
     with os.popen(f"{gfal_clean_env}; gfal-ls {dest} 2>/dev/null") as f:
         files = [x.strip() for x in f.readlines()]
     return files
@@ -441,10 +768,24 @@ def ls(dest: str) -> List[str]:
 
 @as_span("cp", arg_attrs=["*"])
 def cp(src: str, dest: str) -> None:
-    """copy a (remote) file with gfal-copy"""
+    """copy a (remote) file with webdav, or gfal-copy"""
+    cp_env(src, dest)
+
+
+def cp_env(src: str, dest: str, env: Optional[Mapping[str, str]] = None) -> None:
+    """
+    cp, with env (if given) used instead of os.environ for the token and
+    gfal.  Kept apart from cp so the environment doesn't go in the trace.
+    """
     src = fix_pnfs(src)
     dest = fix_pnfs(dest)
-    if 0 != os.system(f"{gfal_clean_env}; gfal-copy {src} {dest}"):
+    if _use_webdav(src, dest, env=env):
+        try:
+            dav_cp(src, dest, env)
+            return
+        except (requests.exceptions.RequestException, WebDAVError) as e:
+            _gfal_fallback("copy", e)
+    if 0 != _system(f"{gfal_clean_env}; gfal-copy {src} {dest}", env):
         raise PermissionError(f"Error: Unable to copy {src} to {dest}")
 
 
@@ -87,7 +87,8 @@ class VerifyAndAddSkipCheck(argparse.Action):
                 f'Invalid argument to flag --skip-check: "{values}". Value must '
                 f"be one of the following: {_supported_checks}"
             )
-        checks_to_skip = getattr(namespace, self.dest, [])
+        # copy, so we don't add to the parser's default list
+        checks_to_skip = list(getattr(namespace, self.dest, None) or [])
         if values not in checks_to_skip:
             checks_to_skip.append(values)
             setattr(namespace, self.dest, checks_to_skip)
@@ -0,0 +1,323 @@
+#
+# COPYRIGHT 2024 FERMI NATIONAL ACCELERATOR LABORATORY
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+#
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+job_query:
+    structured jobsub_q results straight from the schedds with the htcondor
+    bindings, instead of scraping condor_q -format output.  JobRow.line()
+    reproduces the default jobsub_q text format.
+"""
+from collections import OrderedDict
+from concurrent.futures import Future, wait
+import math
+import os
+import queue
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import classad  # type: ignore # pylint: disable=import-error
+import htcondor  # type: ignore # pylint: disable=import-error
+
+import condor
+
+# just the attributes the default jobsub_q format needs
+Q_PROJECTION = [
+    "GlobalJobId",
+    "ClusterId",
+    "ProcId",
+    "DAGNodeName",
+    "Owner",
+    "QDate",
+    "JobStatus",
+    "ServerTime",
+    "ShadowBday",
+    "RemoteWallClockTime",
+    "JobPrio",
+    "ImageSize",
+    "JobsubCmd",
+    "Cmd",
+    "Args",
+    "Arguments",
+]
+
+Q_HEADER = (
+    "JOBSUBJOBID                             OWNER       \tSUBMITTED     RUNTIME"
+    "   ST PRIO   SIZE  COMMAND"
+)
+
+# JobStatus letters, as substr("UIRXCHE",JobStatus,1) in condor_q
+STATUS_LETTERS = "UIRXCHE"
+
+# what goes in the totals line, as bin/jobsub_totals does it
+TOTALS_MAP = OrderedDict(
+    [
+        ("T", "total; "),
+        ("C", "completed, "),
+        ("X", "removed, "),
+        ("I", "idle, "),
+        ("R", "running, "),
+        ("H", "held, "),
+        ("S", "suspended"),
+    ]
+)
+
+
+def q_engine() -> str:
+    """
+    which way jobsub_q gets its results: "condor_q" (the default) runs the
+    condor_q command, "bindings" queries the schedds with the htcondor module
+    """
+    return os.environ.get("JOBSUB_Q_ENGINE", "condor_q")
+
+
+class JobRow(NamedTuple):
+    """one job from a jobsub_q style query"""
+
+    jobid: str
+    owner: str
+    qdate: int
+    runtime: int
+    status: int
+    prio: int
+    size: float
+    command: str
+
+    @property
+    def status_letter(self) -> str:
+        if 0 <= self.status < len(STATUS_LETTERS):
+            return STATUS_LETTERS[self.status]
+        return ""
+
+    @property
+    def submitted(self) -> str:
+        return time.strftime("%m/%d %H:%M", time.localtime(self.qdate))
+
+    @property
+    def runtime_str(self) -> str:
+        """runtime in condor's %T format, days+hh:mm:ss"""
+        mins, secs = divmod(self.runtime, 60)
+        hours, mins = divmod(mins, 60)
+        days, hours = divmod(hours, 24)
+        return f"{days}+{hours:02d}:{mins:02d}:{secs:02d}"
+
+    def line(self) -> str:
+        """this job in the default jobsub_q text format"""
+        return (
+            f"{self.jobid:<40}{self.owner:<10}\t{self.submitted:<11} "
+            f"{self.runtime_str}  {self.status_letter}  {self.prio:3d} "
+            f"{self.size:6.1f} {self.command}"
+        )
+
+
+def _get(ad: classad.ClassAd, attr: str, default: Any = None) -> Any:
+    """evaluate attr in ad, with a default if it is missing or undefined"""
+    try:
+        val = ad.eval(attr)
+    except (KeyError, ValueError, TypeError):
+        return default
+    if val is classad.Value.Undefined or val is classad.Value.Error:
+        return default
+    return val
+
+
+def row_from_ad(ad: classad.ClassAd, now: Optional[int] = None) -> JobRow:
+    """make a JobRow from a job ad projected with Q_PROJECTION"""
+    gjid = str(_get(ad, "GlobalJobId", "")).split("#")
+    if len(gjid) > 1:
+        jobid = f"{gjid[1]}@{gjid[0]}"
+    else:
+        jobid = f"{_get(ad, 'ClusterId', 0)}.{_get(ad, 'ProcId', 0)}@"
+
+    dagnode = _get(ad, "DAGNodeName", "")
+    owner = f" |-{dagnode}" if dagnode else str(_get(ad, "Owner", ""))
+
+    status = int(_get(ad, "JobStatus", 0))
+    runtime = float(_get(ad, "RemoteWallClockTime", 0))
+    bday = _get(ad, "ShadowBday", None)
+    if status == 2 and bday is not None:
+        servertime = _get(ad, "ServerTime", now if now is not None else time.time())
+        runtime += servertime - bday
+
+    command = str(_get(ad, "JobsubCmd", "") or _get(ad, "Cmd", ""))
+    for attr in ("Args", "Arguments"):
+        args = _get(ad, attr, None)
+        if args is not None:
+            command = f"{command} {str(args)[:20]}"
+
+    return JobRow(
+        jobid=jobid,
+        owner=owner,
+        qdate=int(_get(ad, "QDate", 0)),
+        runtime=int(runtime),
+        status=status,
+        prio=int(_get(ad, "JobPrio", 0)),
+        size=float(_get(ad, "ImageSize", 0)) / 1024.0,
+        command=command,
+    )
+
+
+def build_constraint(
+    group: Optional[str] = None,
+    user: Optional[str] = None,
+    jobids: Optional[List[str]] = None,
+    constraint: Optional[str] = None,
+) -> str:
+    """
+    combine the usual jobsub_q restrictions into one job constraint:
+    group, owner, any of the cluster[.proc] jobids, and a user constraint
+    """
+    clauses = []
+    if group:
+        clauses.append(f'Jobsub_Group=?="{group}"')
+    if user:
+        clauses.append(f'Owner=="{user}"')
+    if jobids:
+        idclauses = []
+        for jid in jobids:
+            if "." in jid:
+                cluster, proc = jid.split(".", 1)
+                idclauses.append(f"(ClusterId=={cluster} && ProcId=={proc})")
+            else:
+                idclauses.append(f"ClusterId=={jid}")
+        clauses.append(f"({' || '.join(idclauses)})")
+    if constraint:
+        clauses.append(f"({constraint})")
+    return " && ".join(clauses) if clauses else "true"
+
+
+def query_schedd(schedd_name: str, constraint: str) -> List[JobRow]:
+    """query one schedd for jobs matching constraint"""
+    schedd = condor.get_schedd_handle(schedd_name)
+    now = int(time.time())
+    return [row_from_ad(ad, now) for ad in schedd.query(constraint, Q_PROJECTION)]
+
+
+def _bound_query_timeout(timeout: float) -> None:
+    """
+    have the bindings themselves give up on collector and schedd queries
+    after timeout seconds, so a hung schedd doesn't hold its thread forever
+    """
+    secs = str(max(1, math.ceil(timeout)))
+    for knob in ("QUERY_TIMEOUT", "Q_QUERY_TIMEOUT"):
+        htcondor.param[knob] = secs
+
+
+def _daemon_pool(
+    fn: Callable[..., Any], jobs: Dict[str, Tuple[Any, ...]], max_workers: int
+) -> Dict[str, "Future[Any]"]:
+    """
+    run fn(*args) for each of jobs (key -> args) on up to max_workers daemon
+    threads, returning a future for each key.  Unlike ThreadPoolExecutor,
+    nothing waits for these threads at exit, so a query that never returns
+    can just be abandoned.
+    """
+    futures: Dict[str, "Future[Any]"] = {k: Future() for k in jobs}
+    todo: "queue.Queue[str]" = queue.Queue()
+    for k in jobs:
+        todo.put(k)
+
+    def worker() -> None:
+        while True:
+            try:
+                k = todo.get_nowait()
+            except queue.Empty:
+                return
+            future = futures[k]
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(fn(*jobs[k]))
+            except Exception as e:  # pylint: disable=broad-except
+                future.set_exception(e)
+
+    for _ in range(max(1, min(max_workers, len(jobs)))):
+        threading.Thread(target=worker, daemon=True).start()
+    return futures
+
+
+def query_schedds(
+    constraints: Dict[str, str], max_workers: int = 8, timeout: float = 0
+) -> Dict[str, Optional[List[JobRow]]]:
+    """
+    query each schedd in constraints (schedd name -> job constraint)
+    concurrently, returning the rows for each schedd.  With a timeout, all
+    the schedds together get that many seconds to answer.  Schedds that
+    fail or don't answer in time are reported on stderr and have None for
+    their rows.
+    """
+    res: Dict[str, Optional[List[JobRow]]] = {}
+    if not constraints:
+        return res
+    if timeout > 0:
+        _bound_query_timeout(timeout)
+    futures = _daemon_pool(
+        query_schedd,
+        {schedd: (schedd, c) for schedd, c in sorted(constraints.items())},
+        max_workers,
+    )
+    done, _ = wait(futures.values(), timeout=timeout if timeout > 0 else None)
+    for schedd, future in futures.items():
+        if future not in done:
+            future.cancel()
+            sys.stderr.write(
+                f"Error: schedd {schedd} did not answer within {timeout:g} seconds\n"
+            )
+            res[schedd] = None
+            continue
+        try:
+            res[schedd] = future.result()
+        except Exception as e:  # pylint: disable=broad-except
+            sys.stderr.write(f"Error: querying schedd {schedd} failed: {e}\n")
+            res[schedd] = None
+    return res
+
+
+def query_rows(
+    constraints: Dict[str, str], max_workers: int = 8, timeout: float = 0
+) -> List[JobRow]:
+    """
+    query_schedds, but return all the rows together, sorted the way
+    jobsub_q sorts them
+    """
+    rows: List[JobRow] = []
+    for schedd_rows in query_schedds(constraints, max_workers, timeout).values():
+        if schedd_rows:
+            rows.extend(schedd_rows)
+    return sort_rows(rows)
+
+
+def sort_rows(rows: List[JobRow]) -> List[JobRow]:
+    """sort rows by submit time, as "sort -k 3,4" does the text output"""
+    return sorted(rows, key=lambda r: (r.submitted, r.line()))
+
+
+def totals_line(rows: List[JobRow]) -> str:
+    """the jobsub_totals summary line for rows"""
+    totals = {k: 0 for k in TOTALS_MAP}
+    for r in rows:
+        if r.status_letter in totals:
+            totals[r.status_letter] += 1
+            totals["T"] += 1
+    return "".join(f"{totals[k]} {v}" for k, v in TOTALS_MAP.items())
+
+
+def print_rows(rows: List[JobRow]) -> None:
+    """print rows like the default jobsub_q output, with header and totals"""
+    print(Q_HEADER)
+    for r in rows:
+        print(r.line())
+    print(totals_line(rows))
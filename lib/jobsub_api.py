@@ -1,25 +1,37 @@
-from typing import Dict, List, Generator
+from typing import Any, Dict, List, Generator, Iterable, Optional, Tuple
 import os
 import re
 import sys
 import time
 import contextlib
+from collections import defaultdict
 from datetime import datetime, timedelta
 from io import StringIO
-from htcondor import JobStatus  # type: ignore #pylint: disable=import-error
-from mains import jobsub_submit_main, jobsub_fetchlog_main, jobsub_cmd_main
+from htcondor import JobStatus, JobEventLog, JobEventType  # type: ignore #pylint: disable=import-error
+from mains import (
+    jobsub_submit_main,
+    jobsub_fetchlog_main,
+    jobsub_cmd_main,
+    jobsub_q_rows,
+)
 from condor import Job
+import creds
+import job_query
+import pool
 
 __all__ = [
     "JobStatus",
     "Job",
     "SubmittedJob",
+    "JobWatcher",
     "JobsubAPIError",
     "jobsub_call",
+    "jobsub_q_call",
     "jobsub_submit_re",
     "jobsub_q_re",
     "submit",
     "q",
+    "wait_all",
 ]
 
 
@@ -96,6 +108,21 @@ def jobsub_call(argv: List[str], return_output: bool = False) -> str:
     return res
 
 
+def jobsub_q_call(argv: List[str]) -> Optional[List[job_query.JobRow]]:
+    """
+    Low level API call for jobsub_q through the htcondor bindings.
+
+    Returns the structured rows for jobsub_q command line argv, or None
+    if the bindings query engine is not enabled or can't do this query.
+    """
+    if job_query.q_engine() != "bindings":
+        return None
+    try:
+        return jobsub_q_rows(argv)
+    except Exception as e:
+        raise JobsubAPIError(f"Exception in jobsub_q_call({argv})") from e
+
+
 # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=
 
 
@@ -144,7 +171,19 @@ class SubmittedJob(Job):
         self.size = float(size) if size else None
         self.command = command
 
-    def _cmd(self, verbose: int, args: List[str]) -> str:
+    def set_q_row(self, row: job_query.JobRow) -> None:
+        """note values from a structured jobsub_q row"""
+        self.set_q_attrs(
+            row.owner.strip(),
+            str(row.qdate),
+            str(row.runtime),
+            row.status_letter,
+            row.command,
+            str(row.prio),
+            str(row.size),
+        )
+
+    def _args(self, verbose: int, args: List[str]) -> List[str]:
         """code adding common arguments to commands"""
         args.append("-G")
         args.append(self.group)
@@ -161,7 +200,11 @@ class SubmittedJob(Job):
             args.append("--role")
             args.append(self.role)
         args.append(self.id)
-        rs = jobsub_call(args, True)
+        return args
+
+    def _cmd(self, verbose: int, args: List[str]) -> str:
+        """run a command with our common arguments"""
+        rs = jobsub_call(self._args(verbose, args), True)
         return rs
 
     def hold(self, verbose: int = 0) -> str:
@@ -179,6 +222,20 @@ class SubmittedJob(Job):
 
     def q(self, verbose: int = 0) -> None:
         """run 'jobsub_q' on this job and update values, status"""
+        rows = jobsub_q_call(self._args(verbose, ["jobsub_q"]))
+        if rows is not None:
+            for row in rows:
+                if row.jobid == self.id or (
+                    self.cluster
+                    and row.jobid.startswith(f"{self.seq}.")
+                    and row.jobid.endswith(f"@{self.schedd}")
+                ):
+                    self.set_q_row(row)
+                    return
+            # not in the queue any more, see below
+            self.status = JobStatus.COMPLETED
+            return
+
         rs = self._cmd(verbose, ["jobsub_q"])
         if rs.find(self.id) < 0:
             # we saw it previously, and now it is not showing up..
@@ -237,9 +294,66 @@ class SubmittedJob(Job):
         """run jobsub_q --better-analyze on the job and return results"""
         return self._cmd(verbose, ["jobsub_q", "--better-analyze"])
 
-    def wait(self, howoften: int = 300, verbose: int = 0) -> None:
-        """poll with q() every howoften seconds until the job
-        is COMPLETED, HELD, or REMOVED"""
+    # job event log events that change what wait() cares about
+    log_event_status = {
+        JobEventType.SUBMIT: JobStatus.IDLE,
+        JobEventType.EXECUTE: JobStatus.RUNNING,
+        JobEventType.JOB_RELEASED: JobStatus.IDLE,
+        JobEventType.JOB_EVICTED: JobStatus.IDLE,
+        JobEventType.JOB_TERMINATED: JobStatus.COMPLETED,
+        JobEventType.JOB_HELD: JobStatus.HELD,
+        JobEventType.JOB_ABORTED: JobStatus.REMOVED,
+    }
+
+    def wait_log(self, log: str, howoften: int = 300, verbose: int = 0) -> bool:
+        """
+        follow the job event log log until the job (or every job in the
+        cluster) is COMPLETED, HELD, or REMOVED.  If the log is quiet for
+        howoften seconds, we check the queue in case we missed something.
+        Returns False if the log can't be read, so the caller can poll instead.
+        """
+        done = (JobStatus.COMPLETED, JobStatus.HELD, JobStatus.REMOVED)
+        procs: Dict[int, JobStatus] = {}
+        try:
+            jel = JobEventLog(log)
+        except (OSError, RuntimeError):
+            return False
+        try:
+            while True:
+                for event in jel.events(stop_after=howoften):
+                    if event.cluster != self.seq:
+                        continue
+                    if not self.cluster and event.proc != self.proc:
+                        continue
+                    if event.type not in self.log_event_status:
+                        continue
+                    procs[event.proc] = self.log_event_status[event.type]
+                    self.status = procs[event.proc]
+                    if verbose:
+                        print(f"{self.id}: {event.type.name}", end="\r")
+                    if all(st in done for st in procs.values()):
+                        return True
+                # quiet for a while, make sure the job is still there
+                self.q()
+                if self.status in done:
+                    return True
+        except (OSError, RuntimeError):
+            return False
+        finally:
+            jel.close()
+
+    def wait(
+        self, howoften: int = 300, verbose: int = 0, log: Optional[str] = None
+    ) -> None:
+        """wait until the job is COMPLETED, HELD, or REMOVED.
+        If given a job event log we can read, we follow that; otherwise
+        poll with q() every howoften seconds.  (Our jobs are spooled, so
+        their UserLog lives on the schedd, not here.)"""
+        if log and os.access(log, os.R_OK) and self.wait_log(log, howoften, verbose):
+            if verbose:
+                print("", end="\r")
+            return
+
         self.q()
         while self.status not in (
             JobStatus.COMPLETED,
@@ -279,6 +393,106 @@ class SubmittedJob(Job):
         return f"{self.id:40} {self.owner:10.10} {str(self.submitted):19.19} {str(self.runtime):17} {str(self.status)[10:]:9} {self.prio:6.1f} {self.size:6.1f} {self.command}"
 
 
+class JobWatcher:
+    """
+    Watch many SubmittedJobs at once.  Each poll makes one projected query
+    per schedd for all the jobs we are still waiting on there, rather than
+    a whole jobsub_q per job.
+    """
+
+    done_states = (JobStatus.COMPLETED, JobStatus.HELD, JobStatus.REMOVED)
+
+    def __init__(
+        self, jobs: Iterable[SubmittedJob], howoften: int = 300, verbose: int = 0
+    ) -> None:
+        self.pending: List[SubmittedJob] = list(jobs)
+        self.howoften = howoften
+        self.verbose = verbose
+
+    def _get_creds(self, group: str, role: str, auth_methods: str) -> None:
+        """credentials to query the schedds, as jobsub_q would get them"""
+        os.environ["GROUP"] = group
+        args: Dict[str, Any] = {"verbose": self.verbose}
+        if role:
+            args["role"] = role
+        if auth_methods:
+            args["auth_methods"] = auth_methods
+        creds.get_creds(args)
+
+    def poll(self) -> List[SubmittedJob]:
+        """
+        query the schedds once, update the status of our jobs, and
+        return (and stop watching) the ones that are done
+        """
+        bykey: Dict[Tuple[str, str, str, str], List[SubmittedJob]] = defaultdict(list)
+        for job in self.pending:
+            bykey[(job.group, job.role, job.auth_methods, job.pool)].append(job)
+
+        finished: List[SubmittedJob] = []
+        for (group, role, auth_methods, poolname), jobs in bykey.items():
+            if poolname:
+                pool.set_pool(poolname)
+            self._get_creds(group, role, auth_methods)
+
+            byschedd: Dict[str, List[SubmittedJob]] = defaultdict(list)
+            for job in jobs:
+                byschedd[job.schedd].append(job)
+            constraints = {
+                schedd: job_query.build_constraint(
+                    jobids=[
+                        str(j.seq) if j.cluster else f"{j.seq}.{j.proc}" for j in sjobs
+                    ]
+                )
+                for schedd, sjobs in byschedd.items()
+            }
+            results = job_query.query_schedds(constraints)
+
+            for schedd, sjobs in byschedd.items():
+                rows = results.get(schedd)
+                if rows is None:
+                    # couldn't ask this time, try again next poll
+                    continue
+                for job in sjobs:
+                    self._update(job, rows)
+                    if job.status in self.done_states:
+                        finished.append(job)
+
+        self.pending = [j for j in self.pending if j not in finished]
+        return finished
+
+    @staticmethod
+    def _update(job: SubmittedJob, rows: List[job_query.JobRow]) -> None:
+        """update job from its row in rows"""
+        for row in rows:
+            seq, _, proc = row.jobid.split("@")[0].partition(".")
+            if int(seq) == job.seq and (job.cluster or int(proc) == job.proc):
+                job.set_q_row(row)
+                return
+        # not in the queue any more; we assume it completed, but it could
+        # have been removed, as in SubmittedJob.q()
+        job.status = JobStatus.COMPLETED
+
+    def watch(self) -> Generator[SubmittedJob, None, None]:
+        """poll every howoften seconds, yielding jobs as they finish"""
+        while self.pending:
+            for job in self.poll():
+                yield job
+            if self.pending:
+                if self.verbose:
+                    print(f"waiting on {len(self.pending)} jobs", end="\r")
+                time.sleep(self.howoften)
+
+
+def wait_all(
+    jobs: Iterable[SubmittedJob], howoften: int = 300, verbose: int = 0
+) -> Generator[SubmittedJob, None, None]:
+    """
+    wait for all of jobs to be COMPLETED, HELD, or REMOVED, yielding
+    each one as it gets there
+    """
+    yield from JobWatcher(jobs, howoften, verbose).watch()
+
+
 # could we generate this from the option parser?
 jobsub_flags = {
     "dag": "--dag",
@@ -603,8 +817,23 @@ def q(
             args.append(kwargs[k])
     for j in jobids:
         args.append(j)
-    rs = jobsub_call(args, True)
     res: List[SubmittedJob] = []
+
+    rows = jobsub_q_call(args)
+    if rows is not None:
+        for row in rows:
+            job = SubmittedJob(
+                group,
+                row.jobid,
+                kwargs.get("pool", ""),
+                kwargs.get("auth_methods", ""),
+                kwargs.get("role", ""),
+            )
+            job.set_q_row(row)
+            res.append(job)
+        return res
+
+    rs = jobsub_call(args, True)
     for line in rs.split("\n")[1:]:
         m = jobsub_q_re.search(line)
         if m:
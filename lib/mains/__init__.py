@@ -1,5 +1,5 @@
 from .common import VERBOSE
-from .cmd import jobsub_cmd_parser, jobsub_cmd_main, jobsub_cmd_args
+from .cmd import jobsub_cmd_parser, jobsub_cmd_main, jobsub_cmd_args, jobsub_q_rows
 from .fetchlog import jobsub_fetchlog_parser, jobsub_fetchlog_main, jobsub_fetchlog_args
 from .submit import jobsub_submit_main, jobsub_submit_args
 
@@ -8,6 +8,7 @@ __all__ = [
     "jobsub_cmd_parser",
     "jobsub_cmd_main",
     "jobsub_cmd_args",
+    "jobsub_q_rows",
     "jobsub_fetchlog_parser",
     "jobsub_fetchlog_main",
     "jobsub_fetchlog_args",
@@ -7,13 +7,15 @@
 """python command  apis for jobsub"""
 # pylint: disable=wrong-import-position,wrong-import-order,import-error
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 import io
 import os
 import os.path
 import sys
 import subprocess
-from typing import Optional, List
+from typing import Optional, List, Dict, Set, Tuple, Union
 import condor
+import job_query
 
 # bits that go in each file:
 if os.environ.get("LD_LIBRARY_PATH", ""):
@@ -33,6 +35,11 @@ import re
 from collections import defaultdict
 from .common import VERBOSE
 
+# how many schedds we talk to at once, and how long (in seconds) we give
+# each one; a timeout of 0 means wait as long as it takes
+MAX_SCHEDD_WORKERS = int(os.environ.get("JOBSUB_CMD_MAX_WORKERS", 8))
+SCHEDD_TIMEOUT = float(os.environ.get("JOBSUB_CMD_TIMEOUT", 0))
+
 
 class StoreGroupinEnvironment(argparse.Action):
     """Action to store the given group in the GROUP environment variable"""
@@ -72,27 +79,65 @@ def jobsub_cmd_main(argv: List[str] = sys.argv) -> None:
     jobsub_cmd_args(arglist, passthru)
 
 
-# pylint: disable=too-many-locals,too-many-branches,too-many-statements
-def jobsub_cmd_args(arglist: argparse.Namespace, passthru: List[str]) -> None:
-    global VERBOSE  # pylint: disable=invalid-name,global-statement
-
-    VERBOSE = getattr(arglist, "verbose", 0)
-
-    log_host_time(VERBOSE)
-    totalsf = None
-
-    # If called from jobsub or jobsub_* commands, this is redundant. However, we keep it in there
-    # for the case where the user imports this module and calls jobsub_cmd_args directly.
-    if getattr(arglist, "version", False):
-        version.print_version()
-        return
+def _partial_output(output: Union[str, bytes, None]) -> str:
+    """what a timed out command printed so far, as text"""
+    if isinstance(output, bytes):
+        return output.decode("utf8", "replace")
+    return output or ""
+
+
+def run_for_schedd(
+    these_args: List[str], schedd: str, timeout: float
+) -> subprocess.CompletedProcess:  # type: ignore
+    """
+    run a condor command against one schedd, collecting its output.  Failures
+    are returned as a non-zero returncode with a message in stderr rather than
+    raised, so one bad schedd doesn't stop the others.
+    """
+    env: Dict[str, str] = os.environ.copy()
+    env["_condor_CREDD_HOST"] = schedd
+    try:
+        res = subprocess.run(
+            these_args,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            encoding="utf8",
+            env=env,
+            timeout=timeout if timeout > 0 else None,
+            check=False,
+        )
+        if res.returncode < 0:
+            res.stderr += f"Error: {os.path.basename(these_args[0])} was terminated by signal {-res.returncode} on schedd {schedd}\n"
+        return res
+    except subprocess.TimeoutExpired as e:
+        out = _partial_output(e.stdout)
+        err = _partial_output(e.stderr)
+        return subprocess.CompletedProcess(
+            these_args,
+            -1,
+            out,
+            f"{err}Error: {os.path.basename(these_args[0])} timed out after {timeout:g} seconds on schedd {schedd}\n",
+        )
+    except OSError as e:
+        return subprocess.CompletedProcess(
+            these_args,
+            -1,
+            "",
+            f"Error: running {these_args[0]} for schedd {schedd} failed: {e}\n",
+        )
 
-    if getattr(arglist, "support_email", False):
-        version.print_support_email()
-        return
 
+def condor_cmd_args(
+    arglist: argparse.Namespace, passthru: List[str]
+) -> Tuple[List[str], Set[str], Dict[str, List[str]], bool, bool]:
+    """
+    sort out the arguments for the condor command from our options and
+    the passthru arguments.  Returns the arguments, the schedds named, any
+    job ids for particular schedds, and whether we want the default jobsub_q
+    formatting and constraint.
+    """
     # Re-insert --debug/--VERBOSE if it was given
-    if VERBOSE:
+    if getattr(arglist, "verbose", 0):
         passthru.append("-debug")
     # if they gave us --jobid or --user put in the value plain, condor figures it out
     if getattr(arglist, "jobid", None):
@@ -104,17 +149,14 @@ def jobsub_cmd_args(arglist: argparse.Namespace, passthru: List[str]) -> None:
     if getattr(arglist, "constraint", None):
         passthru.extend(["-constraint", arglist.constraint])
 
-    if os.environ.get("GROUP", None) is None:
-        raise NameError(f"{sys.argv[0]} needs -G group or $GROUP in the environment.")
-
     # make list of arguments to pass to condor command:
     # - the passthru arguments from above, except if we have
     #   any 234@schedd style arguments, pick out the schedd and
     #   keep the 234, and pass --name schedd as well
-    execargs = []
-    schedd_list = set()
+    execargs: List[str] = []
+    schedd_list: Set[str] = set()
     # save beginning of 1234@schedd in list of args for that schedd
-    args_for_schedd = defaultdict(list)
+    args_for_schedd: Dict[str, List[str]] = defaultdict(list)
 
     if getattr(arglist, "name", None):
         schedd_list.add(arglist.name)
@@ -168,12 +210,120 @@ def jobsub_cmd_args(arglist: argparse.Namespace, passthru: List[str]) -> None:
 
         execargs.append(i)
 
+    return (
+        execargs,
+        schedd_list,
+        args_for_schedd,
+        default_formatting,
+        default_constraint,
+    )
+
+
+# pylint: disable=too-many-arguments
+def jobsub_q_native_rows(
+    arglist: argparse.Namespace,
+    execargs: List[str],
+    schedd_list: Set[str],
+    args_for_schedd: Dict[str, List[str]],
+    default_constraint: bool,
+) -> Optional[List[job_query.JobRow]]:
+    """
+    do a default-format jobsub_q with the htcondor bindings, returning the
+    rows.  Returns None if the query has condor_q options we don't handle
+    here, so the caller should run condor_q instead.
+    """
+    constraint = getattr(arglist, "constraint", None)
+    user = getattr(arglist, "user", None)
+    jobids = []
+    for arg in execargs:
+        if re.fullmatch(r"\d+(\.\d+)?", arg):
+            jobids.append(arg)
+        elif arg not in ("-debug", "-constraint", constraint, user):
+            return None
+
+    if not schedd_list:
+        schedd_list = set(condor.get_schedd_names(vars(arglist)))
+
+    group = os.environ["GROUP"] if default_constraint else None
+    constraints = {
+        schedd: job_query.build_constraint(
+            group, user, jobids + args_for_schedd.get(schedd, []), constraint
+        )
+        for schedd in schedd_list
+    }
+    if VERBOSE:
+        print("querying schedds:", constraints)
+    return job_query.query_rows(constraints, MAX_SCHEDD_WORKERS, SCHEDD_TIMEOUT)
+
+
+def jobsub_q_rows(argv: List[str]) -> Optional[List[job_query.JobRow]]:
+    """
+    structured results of the jobsub_q command line argv through the
+    htcondor bindings, or None if that query needs condor_q
+    """
+    parser = jobsub_cmd_parser(True)
+    arglist, passthru = parser.parse_known_args(argv[1:])
+    if os.environ.get("GROUP", None) is None:
+        raise NameError(f"{argv[0]} needs -G group or $GROUP in the environment.")
+    (
+        execargs,
+        schedd_list,
+        args_for_schedd,
+        default_formatting,
+        default_constraint,
+    ) = condor_cmd_args(arglist, passthru)
+    if not default_formatting:
+        return None
+    _ = creds.get_creds(vars(arglist))
+    return jobsub_q_native_rows(
+        arglist, execargs, schedd_list, args_for_schedd, default_constraint
+    )
+
+
+# pylint: disable=too-many-locals,too-many-branches,too-many-statements
+def jobsub_cmd_args(arglist: argparse.Namespace, passthru: List[str]) -> None:
+    global VERBOSE  # pylint: disable=invalid-name,global-statement
+
+    VERBOSE = getattr(arglist, "verbose", 0)
+
+    log_host_time(VERBOSE)
+    totalsf = None
+
+    # If called from jobsub or jobsub_* commands, this is redundant. However, we keep it in there
+    # for the case where the user imports this module and calls jobsub_cmd_args directly.
+    if getattr(arglist, "version", False):
+        version.print_version()
+        return
+
+    if getattr(arglist, "support_email", False):
+        version.print_support_email()
+        return
+
+    if os.environ.get("GROUP", None) is None:
+        raise NameError(f"{sys.argv[0]} needs -G group or $GROUP in the environment.")
+
+    (
+        execargs,
+        schedd_list,
+        args_for_schedd,
+        default_formatting,
+        default_constraint,
+    ) = condor_cmd_args(arglist, passthru)
+
     # also make sure we have suitable credentials...
     _ = creds.get_creds(vars(arglist))
 
     # and find the wrapped command name
     cmd = arglist.command
 
+    if cmd == "jobsub_q" and default_formatting and job_query.q_engine() == "bindings":
+        rows = jobsub_q_native_rows(
+            arglist, execargs, schedd_list, args_for_schedd, default_constraint
+        )
+        if rows is not None:
+            job_query.print_rows(rows)
+            return
+
     # TODO:  This patch is to fix a small bug when condor_q is used directly. #pylint: disable=fixme
     # We're trying to combine totals because of the clause at the end of this
     # function that calculates totals.  So this is a patch until we can figure
@@ -265,27 +415,30 @@ def jobsub_cmd_args(arglist: argparse.Namespace, passthru: List[str]) -> None:
         print("schedd list:", schedd_list)
 
     cmd = f"/usr/bin/{cmd}"
-    for schedd in schedd_list:
-        os.environ["_condor_CREDD_HOST"] = schedd
-        these_args = [cmd, "-name", schedd] + execargs + args_for_schedd.get(schedd, [])
-        if VERBOSE:
-            print("running:", these_args)
-
-        sys.stderr.flush()
-        sys.stdout.flush()
-        # pylint: disable=consider-using-with
-        p = subprocess.Popen(
-            these_args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, encoding="utf8"
-        )
-        if p.stdout:
-            for line in p.stdout.readlines():
-                sys.stdout.write(line)
-            p.stdout.close()
-        if p.stderr:
-            for line in p.stderr.readlines():
-                sys.stderr.write(line)
-            p.stderr.close()
-        p.wait()
+    # query schedds concurrently, but report them in a fixed (sorted) order
+    schedds = sorted(schedd_list)
+    sys.stderr.flush()
+    sys.stdout.flush()
+    with ThreadPoolExecutor(
+        max_workers=max(1, min(MAX_SCHEDD_WORKERS, len(schedds)))
+    ) as executor:
+        futures = []
+        for schedd in schedds:
+            these_args = (
+                [cmd, "-name", schedd] + execargs + args_for_schedd.get(schedd, [])
+            )
+            if VERBOSE:
+                print("running:", these_args)
+            futures.append(
+                executor.submit(run_for_schedd, these_args, schedd, SCHEDD_TIMEOUT)
+            )
+
+        for future in futures:
+            res = future.result()
+            sys.stdout.write(res.stdout)
+            sys.stderr.write(res.stderr)
+            sys.stderr.flush()
+            sys.stdout.flush()
 
     if totalsf:
         os.close(1)
@@ -159,9 +159,11 @@ def jobsub_submit_args(
     if os.environ.get("GROUP", None) is None:
         raise NameError(f"{sys.argv[0]} needs -G group or $GROUP in the environment.")
 
-    # While we're running in hybrid proxy/token mode, force us to get a new proxy every time we submit
-    # Eventually, this arg and its support in the underlying libraries should be removed
-    setattr(args, "force_proxy", True)
+    # An existing proxy is reused if it has enough lifetime left for the right
+    # group and role (see fake_ifdh.proxy_decision); JOBSUB_FORCE_PROXY=1 gets a
+    # new one every time, as we used to
+    setattr(args, "force_proxy", os.environ.get("JOBSUB_FORCE_PROXY", "0") == "1")
+    setattr(args, "strict_proxy", True)
 
     tarfiles.do_tarballs(args)
 
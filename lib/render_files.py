@@ -2,18 +2,61 @@
 
 # pylint: disable=wrong-import-position,wrong-import-order,import-error
 import errno
+import functools
 import glob
 import os
 import os.path
 import sys
-from typing import Union, List, Dict, Any
+from typing import Union, List, Dict, Any, Optional
 from tracing import as_span
 
 import jinja2 as jinja  # type: ignore
 
+import disk_cache
+import version
+
 PREFIX = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
 
+class QuietBytecodeCache(jinja.FileSystemBytecodeCache):  # type: ignore
+    """bytecode cache that just skips saving if it can't write the cache"""
+
+    def dump_bytecode(self, bucket: Any) -> None:
+        try:
+            super().dump_bytecode(bucket)
+        except OSError:
+            pass
+
+
+def jinja_bytecode_cache() -> Optional[QuietBytecodeCache]:
+    """
+    where compiled templates are kept between runs.  Jinja checks each
+    entry against the template source; the jobsub version is in the
+    name so an upgrade starts fresh.
+    """
+    cachedir = os.path.join(disk_cache.cache_dir(), "jinja_bytecode")
+    try:
+        os.makedirs(cachedir, mode=0o700, exist_ok=True)
+    except OSError:
+        return None
+    return QuietBytecodeCache(cachedir, f"__jinja2_%s_{version.__version__}.cache")
+
+
+@functools.lru_cache(maxsize=None)
+def get_jinja_env(srcdir: str, strict: bool = True) -> jinja.Environment:
+    """
+    the jinja Environment for templates in srcdir, made once per process;
+    strict makes undefined template variables an error
+    """
+    jinja_env = jinja.Environment(
+        loader=jinja.FileSystemLoader(srcdir),
+        undefined=jinja.StrictUndefined if strict else jinja.Undefined,
+        bytecode_cache=jinja_bytecode_cache(),
+    )
+    jinja_env.filters["basename"] = os.path.basename
+    return jinja_env
+
+
 def get_basefiles(dlist: List[str]) -> List[str]:
     """get basename of files in directory"""
     res = []
@@ -56,10 +99,7 @@ def _render_files(  # pylint: disable=too-many-branches
             "transfer_files", []
         )
 
-    jinja_env = jinja.Environment(
-        loader=jinja.FileSystemLoader(srcdir), undefined=jinja.StrictUndefined
-    )
-    jinja_env.filters["basename"] = os.path.basename
+    jinja_env = get_jinja_env(srcdir)
     flist = glob.glob(f"{srcdir}/*")
 
     # add destination dir to values for template
@@ -7,7 +7,7 @@ from typing import List, Dict, Any
 from condor import submit, submit_dag
 from dagnabbit import parse_dagnabbit
 from render_files import render_files
-from transfer_sandbox import transfer_sandbox
+from transfer_sandbox import start_transfer_sandbox
 
 PREFIX = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
@@ -77,7 +77,7 @@ def jobsub_submit_dag(varg: Dict[str, Any], schedd_name: str) -> None:
     render_files(d2, varg, submitdir, dlist=[d2, submitdir])
     if not varg.get("no_submit", False):
         if varg["outurl"]:
-            transfer_sandbox(submitdir, varg["outurl"])
+            start_transfer_sandbox(submitdir, varg["outurl"])
         os.chdir(varg["submitdir"])
         submit_dag(os.path.join(submitdir, "dag.dag"), varg, schedd_name)
 
@@ -99,7 +99,7 @@ def jobsub_submit_dataset_definition(varg: Dict[str, Any], schedd_name: str) ->
     render_files(d1, varg, submitdir, dlist=[d1, d2, submitdir])
     if not varg.get("no_submit", False):
         if varg["outurl"]:
-            transfer_sandbox(submitdir, varg["outurl"])
+            start_transfer_sandbox(submitdir, varg["outurl"])
         os.chdir(varg["submitdir"])
         submit_dag(os.path.join(submitdir, "dataset.dag"), varg, schedd_name)
 
@@ -118,7 +118,7 @@ def jobsub_submit_maxconcurrent(varg: Dict[str, Any], schedd_name: str) -> None:
     render_files(d1, varg, submitdir, dlist=[d1, d2, submitdir])
     if not varg.get("no_submit", False):
         if varg["outurl"]:
-            transfer_sandbox(submitdir, varg["outurl"])
+            start_transfer_sandbox(submitdir, varg["outurl"])
         os.chdir(varg["submitdir"])
         submit_dag(os.path.join(submitdir, "maxconcurrent.dag"), varg, schedd_name)
 
@@ -132,5 +132,5 @@ def jobsub_submit_simple(varg: Dict[str, Any], schedd_name: str) -> None:
     if not varg.get("no_submit", False):
         os.chdir(varg["submitdir"])
         if varg["outurl"]:
-            transfer_sandbox(submitdir, varg["outurl"])
+            start_transfer_sandbox(submitdir, varg["outurl"])
         submit(os.path.join(submitdir, "simple.cmd"), varg, schedd_name)
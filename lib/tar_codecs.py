@@ -0,0 +1,198 @@
+#
+# COPYRIGHT 2024 FERMI NATIONAL ACCELERATOR LABORATORY
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+#
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+tar_codecs:
+    compression for the dropbox tarballs.  The codec is picked with
+    $JOBSUB_TARBALL_CODEC and shows up in the tarball extension, which is
+    how the job wrapper knows what to unpack it with.  With
+    $JOBSUB_TARBALL_THREADS > 1 the data is compressed in independent
+    blocks on several threads and the compressed streams concatenated, the
+    way pbzip2 and pigz do it; the usual decompressors all handle that.
+"""
+import bz2
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+import lzma
+import os
+import sys
+from typing import Any, BinaryIO, Callable, Deque, Dict, NamedTuple, Optional
+import zlib
+
+try:
+    import zstandard  # type: ignore # pylint: disable=import-error
+except ImportError:
+    zstandard = None
+
+# uncompressed bytes per independently compressed block
+BLOCK_SIZE = 8 * 1024 * 1024
+
+
+class Codec(NamedTuple):
+    """a tarball compression format"""
+
+    name: str
+    ext: str
+    compressor: Callable[[int], Any]
+
+
+def _zstd_compressor(threads: int) -> Any:
+    # zstandard does its own multithreading, in a single frame
+    return zstandard.ZstdCompressor(
+        level=3, threads=threads if threads > 1 else 0
+    ).compressobj()
+
+
+CODECS: Dict[str, Codec] = {
+    "bz2": Codec("bz2", ".tbz2", lambda threads: bz2.BZ2Compressor(9)),
+    # wbits=31 gives a gzip header with no name or time stamp, like gzip -n
+    "gz": Codec("gz", ".tgz", lambda threads: zlib.compressobj(9, zlib.DEFLATED, 31)),
+    "xz": Codec(
+        "xz", ".txz", lambda threads: lzma.LZMACompressor(format=lzma.FORMAT_XZ)
+    ),
+    "zstd": Codec("zstd", ".tzst", _zstd_compressor),
+}
+
+DEFAULT_CODEC = "bz2"
+
+
+def tarball_codec(use_dropbox: Optional[str] = None) -> Codec:
+    """
+    the codec to use for tarballs going to use_dropbox.  RCDS unpacks
+    tarballs itself, so those are always bz2.
+    """
+    name = os.environ.get("JOBSUB_TARBALL_CODEC", DEFAULT_CODEC)
+    if name not in CODECS:
+        raise ValueError(
+            f"JOBSUB_TARBALL_CODEC {name} is not one of {', '.join(CODECS)}"
+        )
+    if name != DEFAULT_CODEC and use_dropbox in ("cvmfs", None):
+        sys.stderr.write(
+            f"Notice: RCDS only takes {DEFAULT_CODEC} tarballs, "
+            f"ignoring JOBSUB_TARBALL_CODEC={name}\n"
+        )
+        name = DEFAULT_CODEC
+    if name == "zstd" and zstandard is None:
+        sys.stderr.write(
+            "Notice: zstandard module not available, "
+            f"using {DEFAULT_CODEC} for tarballs\n"
+        )
+        name = DEFAULT_CODEC
+    return CODECS[name]
+
+
+def tarball_threads() -> int:
+    """
+    how many threads to compress tarballs with, from
+    $JOBSUB_TARBALL_THREADS; 0 means one per cpu
+    """
+    try:
+        threads = int(os.environ.get("JOBSUB_TARBALL_THREADS", "1"))
+    except ValueError:
+        print("JOBSUB_TARBALL_THREADS must be either unset or an integer")
+        raise
+    if threads <= 0:
+        threads = os.cpu_count() or 1
+    return threads
+
+
+def _compress_block(codec: Codec, data: bytes) -> bytes:
+    c = codec.compressor(1)
+    return bytes(c.compress(data)) + bytes(c.flush())
+
+
+class CompressingWriter:
+    """
+    write-only file object that compresses what is written to it with
+    codec into f.  Use it as a context manager, or call close() when done;
+    closing does not close f.
+    """
+
+    def __init__(
+        self,
+        f: BinaryIO,
+        codec: Codec,
+        threads: int = 1,
+        block_size: int = BLOCK_SIZE,
+    ) -> None:
+        self.f = f
+        self.codec = codec
+        self.block_size = block_size
+        self.closed = False
+        self.buf = bytearray()
+        self.pending: Deque["Future[bytes]"] = deque()
+        self.executor: Optional[ThreadPoolExecutor] = None
+        if threads > 1 and codec.name != "zstd":
+            self.threads = threads
+            self.executor = ThreadPoolExecutor(max_workers=threads)
+        else:
+            self.threads = 1
+            self.comp = codec.compressor(threads)
+
+    def write(self, data: bytes) -> int:
+        if self.executor is None:
+            self.f.write(self.comp.compress(data))
+            return len(data)
+        self.buf += data
+        while len(self.buf) >= self.block_size:
+            self._submit(bytes(self.buf[: self.block_size]))
+            del self.buf[: self.block_size]
+        return len(data)
+
+    def _submit(self, block: bytes) -> None:
+        assert self.executor is not None
+        self.pending.append(self.executor.submit(_compress_block, self.codec, block))
+        # keep the output in order, and don't buffer too much
+        while len(self.pending) > 2 * self.threads:
+            self.f.write(self.pending.popleft().result())
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        if self.executor is None:
+            self.f.write(self.comp.flush())
+            return
+        try:
+            if self.buf or not self.pending:
+                self._submit(bytes(self.buf))
+                self.buf = bytearray()
+            while self.pending:
+                self.f.write(self.pending.popleft().result())
+        finally:
+            self._shutdown()
+
+    def abort(self) -> None:
+        """stop without writing anything more"""
+        self.closed = True
+        if self.executor is not None:
+            self._shutdown()
+
+    def _shutdown(self) -> None:
+        # shutdown(cancel_futures=True) is python 3.9+, so do it ourselves
+        assert self.executor is not None
+        for future in self.pending:
+            future.cancel()
+        self.pending.clear()
+        self.executor.shutdown(wait=True)
+
+    def __enter__(self) -> "CompressingWriter":
+        return self
+
+    def __exit__(self, exc_type: Any, *args: Any) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
@@ -19,24 +19,49 @@
 import argparse
 import errno
 import hashlib
+import http
 import http.client
 import itertools
+import multiprocessing
 import os
 import os.path
 import random
 import re
+import stat
 import sys
 import tarfile as tarfile_mod
+import threading
 import time
 import traceback as tb
-from typing import Dict, Callable, List, Any, Iterator, Optional
+import uuid
+from concurrent.futures import (
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    as_completed,
+)
+from typing import (
+    Any,
+    BinaryIO,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Pattern,
+    Tuple,
+)
 from urllib.parse import quote as _quote
 
 
 import requests  # type: ignore # pylint: disable=import-error
+import requests.adapters  # type: ignore # pylint: disable=import-error
 from requests.auth import AuthBase  # type: ignore # pylint: disable=import-error
 
+import disk_cache
 import fake_ifdh
+import tar_codecs
 from creds import get_creds, CredentialSet
 from tracing import as_span, add_event
 
@@ -45,15 +70,48 @@ try:
     NUM_RETRIES = int(_NUM_RETRIES_ENV)
     _RETRY_INTERVAL_SEC_ENV = os.getenv("JOBSUB_UPLOAD_RETRY_INTERVAL_SEC", "30")
     RETRY_INTERVAL_SEC = int(_RETRY_INTERVAL_SEC_ENV)
+    # upload tarballs in resumable chunks of this many bytes, if the
+    # server can do that; 0 sends the whole tarball in one request
+    _UPLOAD_CHUNK_SIZE_ENV = os.getenv("JOBSUB_UPLOAD_CHUNK_SIZE", "0")
+    UPLOAD_CHUNK_SIZE = int(_UPLOAD_CHUNK_SIZE_ENV)
+    # first wait when checking for a published tarball; it doubles from
+    # here up to RETRY_INTERVAL_SEC
+    _PUBLISH_POLL_START_SEC_ENV = os.getenv("JOBSUB_PUBLISH_POLL_START_SEC", "0.5")
+    PUBLISH_POLL_START_SEC = float(_PUBLISH_POLL_START_SEC_ENV)
 except ValueError:
     print(
-        "Retry variables JOBSUB_UPLOAD_NUM_RETRIES and "
-        "JOBSUB_UPLOAD_RETRY_INTERVAL_SEC must be either unset or integers"
+        "Retry variables JOBSUB_UPLOAD_NUM_RETRIES, "
+        "JOBSUB_UPLOAD_RETRY_INTERVAL_SEC and JOBSUB_UPLOAD_CHUNK_SIZE must "
+        "be either unset or integers, and JOBSUB_PUBLISH_POLL_START_SEC "
+        "unset or a number"
     )
     raise
 
 RCDS_MAX_FILE_SIZE = 1073741824
 
+# remember digests of tardir: tarballs, so unchanged directories skip the
+# tar step entirely
+TARDIR_INDEX = os.getenv("JOBSUB_TARDIR_INDEX", "1") != "0"
+
+
+# one keep-alive session per PubAPI server, shared by all the
+# TarfilePublisherHandlers in this process
+_pubapi_sessions: Dict[str, requests.Session] = {}
+_pubapi_sessions_lock = threading.Lock()
+
+
+def pubapi_session(server: str) -> requests.Session:
+    """get the pooled http session for PubAPI server"""
+    with _pubapi_sessions_lock:
+        session = _pubapi_sessions.get(server)
+        if session is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_maxsize=16)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _pubapi_sessions[server] = session
+        return session
+
 
 class TokenAuth(AuthBase):  # type: ignore
     # auth class for token authentication
@@ -79,19 +137,36 @@ def check_we_can_write() -> None:
         )
 
 
+def staging_name(base: str, ext: str) -> str:
+    """
+    name for a tarball we make in the current directory.  Several get made
+    at once, by threads of one process or by reused pool workers, so the
+    pid alone does not keep them apart.
+    """
+    return os.path.basename(f"{base}{os.getpid()}_{uuid.uuid4().hex[:8]}{ext}")
+
+
 # pylint: disable=unused-argument
-def tarchmod(tfn: str, verbose: int = 0) -> str:
+def tarchmod(
+    tfn: str, verbose: int = 0, codec: Optional[tar_codecs.Codec] = None
+) -> str:
     """
     copy a tarfile to a compressed tarfile, while:
     * changing modes of contents to 755
     * bailing if tarfile has files too large for RCDS
     """
-    ofn = os.path.basename(f"{tfn}{os.getpid()}.tbz2")
+    if codec is None:
+        codec = tar_codecs.CODECS[tar_codecs.DEFAULT_CODEC]
+    ofn = staging_name(tfn, codec.ext)
     check_we_can_write()
 
     try:
-        with tarfile_mod.open(tfn, "r|*") as fin, tarfile_mod.open(
-            ofn, "w|bz2"
+        with tarfile_mod.open(tfn, "r|*") as fin, open(
+            ofn, "wb"
+        ) as f, tar_codecs.CompressingWriter(
+            f, codec, tar_codecs.tarball_threads()
+        ) as cw, tarfile_mod.open(
+            fileobj=cw, mode="w|"  # type: ignore
         ) as fout:
             ti = fin.next()
             while ti:
@@ -143,7 +218,7 @@ def tar_up(
     else:
         mtime = ""
 
-    tarfile = os.path.basename(f"{directory}{os.getpid()}.tgz")
+    tarfile = staging_name(directory, ".tgz")
     check_we_can_write()
 
     if not excludes:
@@ -182,18 +257,347 @@ def tar_up(
     return tarfile
 
 
+def read_excludes(excludes: Optional[str]) -> List[Pattern[str]]:
+    """
+    read a tar --exclude-from file into compiled patterns, treating them
+    the way GNU tar does: shell wildcards where backslash quotes the next
+    character, matched against whole names (so "\\.git/" or "\\.log$"
+    only match names that really end in "/" or "$")
+    """
+    if not excludes:
+        excludes = os.path.dirname(__file__) + "/../etc/excludes"
+    res: List[Pattern[str]] = []
+    with open(excludes, "r", encoding="UTF-8") as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if not line:
+                continue
+            res.append(re.compile(exclude_to_re(line)))
+    return res
+
+
+def exclude_to_re(pat: str) -> str:
+    """convert one tar exclude wildcard pattern to a regular expression"""
+    out = []
+    i = 0
+    while i < len(pat):
+        c = pat[i]
+        if c == "\\" and i + 1 < len(pat):
+            i += 1
+            out.append(re.escape(pat[i]))
+        elif c == "*":
+            out.append(".*")
+        elif c == "?":
+            out.append(".")
+        elif c == "[":
+            j = pat.find("]", i + 2)
+            if j < 0:
+                out.append(re.escape(c))
+            else:
+                body = pat[i + 1 : j]
+                if body.startswith("!"):
+                    body = "^" + body[1:]
+                out.append(f"[{body}]")
+                i = j
+        else:
+            out.append(re.escape(c))
+        i += 1
+    return "".join(out) + r"\Z"
+
+
+def is_excluded(relpath: str, patterns: List[Pattern[str]]) -> bool:
+    """
+    tar exclude patterns are unanchored: they can match the path
+    starting at any component
+    """
+    parts = relpath.split("/")
+    for i in range(len(parts)):
+        tail = "/".join(parts[i:])
+        for p in patterns:
+            if p.match(tail):
+                return True
+    return False
+
+
+class _DigestWriter:
+    """file wrapper that computes the sha256 of everything written to it"""
+
+    def __init__(self, f: BinaryIO) -> None:
+        self.f = f
+        self.hash = hashlib.sha256()
+
+    def write(self, data: bytes) -> int:
+        self.hash.update(data)
+        return self.f.write(data)
+
+    def hexdigest(self) -> str:
+        return self.hash.hexdigest()
+
+
+def walk_tardir(directory: str, patterns: List[Pattern[str]]) -> Iterator[str]:
+    """
+    list the paths under directory (relative to it, starting with "."
+    itself) that are not excluded, in a stable order
+    """
+    yield "."
+    for dirpath, dirnames, filenames in os.walk(directory):
+        reldir = os.path.relpath(dirpath, directory)
+        dirnames[:] = [
+            d
+            for d in sorted(dirnames)
+            if not is_excluded(os.path.normpath(os.path.join(reldir, d)), patterns)
+        ]
+        # symlinks to directories are listed in dirnames, but os.walk doesn't
+        # follow them; tar stores them as links, so that is fine.
+        for name in dirnames + sorted(filenames):
+            rel = os.path.normpath(os.path.join(reldir, name))
+            if not is_excluded(rel, patterns):
+                yield rel
+
+
+@as_span("build_tarball", arg_attrs=["*"])
+def build_tarball(
+    directory: str,
+    excludes: Optional[str],
+    verbose: int = 0,
+    codec: Optional[tar_codecs.Codec] = None,
+) -> Tuple[str, str]:
+    """
+    build the dropbox tarball for directory in one pass, returning the
+    tarball name and its sha256 digest.  This does what tar_up, tarchmod
+    and checksum_file do together:
+    * skips files matching the exclusion file patterns
+    * changes modes of contents to 755
+    * bails if there are files too large for RCDS
+    """
+    if not directory:
+        directory = "."
+    if codec is None:
+        codec = tar_codecs.CODECS[tar_codecs.DEFAULT_CODEC]
+    ofn = staging_name(os.path.normpath(directory), codec.ext)
+    check_we_can_write()
+    patterns = read_excludes(excludes)
+
+    # don't tar up the tarball we are writing if it is in directory
+    outpath = os.path.realpath(ofn)
+
+    try:
+        with open(ofn, "wb") as f:
+            dw = _DigestWriter(f)
+            with tar_codecs.CompressingWriter(
+                dw, codec, tar_codecs.tarball_threads()  # type: ignore
+            ) as cw, tarfile_mod.open(
+                fileobj=cw, mode="w|"  # type: ignore
+            ) as fout:
+                for rel in walk_tardir(directory, patterns):
+                    path = os.path.join(directory, rel)
+                    if os.path.realpath(path) == outpath:
+                        continue
+                    arcname = "." if rel == "." else f"./{rel}"
+                    ti = fout.gettarinfo(path, arcname)
+                    ti.mode = ti.mode | 0o755
+                    if ti.size > RCDS_MAX_FILE_SIZE:
+                        raise ValueError(
+                            f"file '{ti.name}' in your directory {directory}\n"
+                            f"  size {ti.size/1024}k is over RCDS 1G limit\n"
+                        )
+                    if verbose:
+                        print(ti.name)
+                    if ti.isreg():
+                        with open(path, "rb") as st:
+                            fout.addfile(ti, st)
+                    else:
+                        fout.addfile(ti)
+    except OSError:
+        print(
+            f"There was an error tarring up the requested directory {directory}. "
+            "This is most likely because there is not enough disk space in the the staging directory "
+            f"{os.path.dirname(outpath)}"
+        )
+        if os.path.exists(ofn):
+            os.unlink(ofn)
+        raise
+    except BaseException:
+        if os.path.exists(ofn):
+            os.unlink(ofn)
+        raise
+
+    digest = dw.hexdigest()
+    add_event("computed digest", {"digest": digest})
+    remember_digest(ofn, digest)
+    return ofn, digest
+
+
+def tardir_manifest(
+    directory: str, excludes: Optional[str], codec: tar_codecs.Codec
+) -> Tuple[str, str]:
+    """
+    summarize what build_tarball would put in a tarball of directory,
+    without reading any file contents: the names, sizes, times, inodes
+    and modes of everything not excluded, plus the exclusion rules and
+    how it gets compressed.  Returns (index entry name, manifest hash).
+    """
+    if not directory:
+        directory = "."
+    if not excludes:
+        excludes = os.path.dirname(__file__) + "/../etc/excludes"
+    threads = tar_codecs.tarball_threads()
+    packing = "blocks" if threads > 1 and codec.name != "zstd" else "stream"
+
+    key = f"{os.path.realpath(directory)}\0{os.path.realpath(excludes)}\0{codec.name}"
+    name = f"tardir_{hashlib.sha256(key.encode()).hexdigest()[:16]}.json"
+
+    h = hashlib.sha256()
+    h.update(f"{codec.name}\0{packing}\0".encode())
+    with open(excludes, "rb") as f:
+        h.update(f.read())
+    for rel in walk_tardir(directory, read_excludes(excludes)):
+        st = os.lstat(os.path.join(directory, rel))
+        # directory times and sizes change whenever something (like our own
+        # tarball) comes and goes in them; the names in the list cover that
+        if stat.S_ISDIR(st.st_mode):
+            size, mtime = 0, 0
+        else:
+            size, mtime = st.st_size, st.st_mtime_ns
+        h.update(
+            f"\0{rel}\0{size}\0{mtime}\0{st.st_ino}\0"
+            f"{st.st_mode}\0{st.st_uid}\0{st.st_gid}".encode()
+        )
+    return name, h.hexdigest()
+
+
+def tardir_index_lookup(name: str, manifest: str) -> Optional[str]:
+    """digest we built for this manifest last time, if any"""
+    entry = disk_cache.load(name)
+    if entry is None:
+        return None
+    data = entry[1]
+    if not isinstance(data, dict) or data.get("manifest") != manifest:
+        return None
+    digest = data.get("digest")
+    return str(digest) if digest else None
+
+
+def tardir_index_store(name: str, manifest: str, digest: str) -> None:
+    """remember the digest of the tarball we built for manifest"""
+    try:
+        disk_cache.store(name, {"manifest": manifest, "digest": digest})
+    except OSError as e:
+        sys.stderr.write(f"Notice: unable to save tardir index {name}: {e}\n")
+
+
+@as_span("tardir_from_index", arg_attrs=["*"])
+def tardir_from_index(
+    args: argparse.Namespace,
+    name: str,
+    manifest: str,
+    cred_set: Optional[CredentialSet] = None,
+) -> Optional[str]:
+    """
+    if we have published a tarball of this exact directory before and
+    RCDS still has it, mark it used and return its location.  cred_set
+    defaults to get_creds(vars(args)).
+    """
+    digest = tardir_index_lookup(name, manifest)
+    if digest is None or not args.group:
+        return None
+    add_event("tardir index hit", {"digest": digest})
+    publisher = TarfilePublisherHandler(
+        cid=f"{args.group}/{digest}",
+        cred_set=cred_set if cred_set is not None else get_creds(vars(args)),
+        fixed_server=True,
+        verbose=args.verbose,
+    )
+    # update_cid also tags it so it stays around
+    location: Optional[str] = publisher.update_cid()
+    if location is not None and args.verbose:
+        print("Directory unchanged since last upload, found tarball on RCDS.")
+    return location
+
+
+# sha256 digests of files we have already read, keyed by
+# digest_key(); see checksum_file
+_digests: Dict[str, str] = {}
+_digests_lock = threading.Lock()
+_digests_loaded = False
+DIGEST_CACHE_NAME = "file_digests.json"
+DIGEST_CACHE_MAX = 1000
+
+
+def digest_key(fname: str) -> str:
+    """
+    identify the current contents of fname by its path, size, mtime and
+    inode -- if those haven't changed, neither has its digest
+    """
+    st = os.stat(fname)
+    return f"{os.path.realpath(fname)}\0{st.st_size}\0{st.st_mtime_ns}\0{st.st_ino}"
+
+
+def remember_digest(fname: str, digest: str) -> None:
+    """record a digest we computed some other way, e.g. while writing fname"""
+    key = digest_key(fname)
+    with _digests_lock:
+        _digests[key] = digest
+
+
+def _load_persisted_digests() -> None:
+    """merge in digests saved by earlier jobsub processes (lock held)"""
+    global _digests_loaded  # pylint: disable=global-statement
+    if _digests_loaded:
+        return
+    _digests_loaded = True
+    entry = disk_cache.load(DIGEST_CACHE_NAME)
+    if entry is not None and isinstance(entry[1], dict):
+        for k, v in entry[1].items():
+            _digests.setdefault(k, v)
+
+
+def _persist_digest(key: str, digest: str) -> None:
+    """add one digest to the saved ones, keeping the newest DIGEST_CACHE_MAX"""
+    try:
+        with disk_cache.locked(DIGEST_CACHE_NAME, blocking=True):
+            entry = disk_cache.load(DIGEST_CACHE_NAME)
+            saved = entry[1] if entry is not None and isinstance(entry[1], dict) else {}
+            saved.pop(key, None)
+            saved[key] = digest
+            while len(saved) > DIGEST_CACHE_MAX:
+                del saved[next(iter(saved))]
+            disk_cache.store(DIGEST_CACHE_NAME, saved)
+    except OSError as e:
+        sys.stderr.write(f"Notice: unable to save file digest: {e}\n")
+
+
 @as_span("checksum_file", arg_attrs=["*"], return_attr=False)
-def checksum_file(fname: str) -> str:
-    """pull in a tarfile while computing its hash"""
+def checksum_file(fname: str, persist: bool = False) -> str:
+    """
+    pull in a file while computing its hash.  We only do this once per
+    process for a given file (see digest_key); with persist and
+    $JOBSUB_DIGEST_CACHE=1 the digest is also kept in the jobsub cache
+    dir for later submissions.
+    """
+    key = digest_key(fname)
+    persist = persist and os.environ.get("JOBSUB_DIGEST_CACHE", "0") == "1"
+    with _digests_lock:
+        if persist:
+            _load_persisted_digests()
+        digest = _digests.get(key)
+    if digest is not None:
+        add_event("reused digest", {"digest": digest})
+        return digest
+
     h = hashlib.sha256()
     with open(fname, "rb") as f:
-        tff = f.read(4096)
-        h.update(tff)
+        tff = f.read(1048576)
         while tff:
-            tff = f.read(4096)
             h.update(tff)
-    add_event("computed digest", {"digest": h.hexdigest()})
-    return h.hexdigest()
+            tff = f.read(1048576)
+    digest = h.hexdigest()
+    add_event("computed digest", {"digest": digest})
+    with _digests_lock:
+        _digests[key] = digest
+    if persist:
+        _persist_digest(key, digest)
+    return digest
 
 
 @as_span("dcache_persistent_path", arg_attrs=["*"])
@@ -201,8 +605,7 @@ def dcache_persistent_path(exp: str, filename: str) -> str:
     """pick the reslient dcache path for a tarfile"""
     bf = os.path.basename(filename)
 
-    with os.popen(f"sha256sum {filename}", "r") as f:
-        sha256_hash = f.read().strip().split(" ")[0]
+    sha256_hash = checksum_file(filename, persist=True)
 
     # gm2 has upper cased the experiment name in DCache for some reason...
     if exp == "gm2":
@@ -219,9 +622,269 @@ def dcache_persistent_path(exp: str, filename: str) -> str:
     return res
 
 
-# TODO:  I've disabled too-many-statements, but it's a good indicator that this could be
-# cleaned up in the future
-# pylint: disable=too-many-statements
+class PendingPublish(NamedTuple):
+    """a tarball uploaded to RCDS that we are waiting to see published"""
+
+    cid: str
+    publisher: "TarfilePublisherHandler"
+    started: float
+
+
+def pending_location(cid: str) -> str:
+    """placeholder for where cid will be, until it is published"""
+    return f"{{pending:{cid}}}"
+
+
+def _confirm_publish(pp: PendingPublish, stop: threading.Event, verbose: int) -> str:
+    """
+    poll RCDS for pp.cid with jittered exponential backoff, starting at
+    PUBLISH_POLL_START_SEC and topping out at RETRY_INTERVAL_SEC.  We give
+    up after NUM_RETRIES tries and as long as the old fixed interval
+    polling would have waited.
+    """
+    delay = PUBLISH_POLL_START_SEC
+    deadline = pp.started + max(NUM_RETRIES - 1, 1) * RETRY_INTERVAL_SEC
+    for tries in itertools.count(1):
+        location: Optional[str] = pp.publisher.cid_exists()
+        if location is not None:
+            latency = time.time() - pp.started
+            add_event(
+                "rcds publish confirmed", {"cid": pp.cid, "latency": f"{latency:.2f}"}
+            )
+            if verbose:
+                print(
+                    f"Found uploaded file on RCDS for CID {pp.cid} in {latency:.1f}s."
+                )
+            else:
+                print("Found uploaded file on RCDS.")
+            return location
+        if tries >= NUM_RETRIES and time.time() >= deadline:
+            break
+        wait = random.uniform(0.5, 1.0) * min(delay, RETRY_INTERVAL_SEC)
+        if verbose:
+            print(
+                f"Could not locate uploaded file for CID {pp.cid} on RCDS.  Will retry in {wait:.1f} seconds."
+            )
+        if stop.wait(wait):
+            break
+        delay *= 2
+    raise RuntimeError(
+        f"Max retries {NUM_RETRIES} to find RCDS tarball at {pp.cid} exceeded.  Exiting now."
+    )
+
+
+@as_span("wait_for_publish")
+def wait_for_publish(pending: List[PendingPublish], verbose: int = 0) -> Dict[str, str]:
+    """
+    wait for RCDS to publish all the pending tarballs, checking on them
+    concurrently.  Returns a dict of cid -> location once they are all
+    there, or raises if any of them doesn't show up.
+    """
+    res: Dict[str, str] = {}
+    todo = {pp.cid: pp for pp in pending}
+    if not todo:
+        return res
+    msg = "Checking to see if uploaded file is published on RCDS"
+    if verbose:
+        msg = msg + f" for CID {', '.join(todo)}"
+    print(msg)
+
+    stop = threading.Event()
+    with ThreadPoolExecutor(max_workers=len(todo)) as executor:
+        futures = {
+            executor.submit(_confirm_publish, pp, stop, verbose): cid
+            for cid, pp in todo.items()
+        }
+        try:
+            for future in as_completed(futures):
+                res[futures[future]] = future.result()
+        except BaseException:
+            # no point waiting on the rest
+            stop.set()
+            raise
+    return res
+
+
+def tarball_workers() -> int:
+    """
+    how many dropbox files and tarballs to package and upload at once,
+    from $JOBSUB_TARBALL_WORKERS
+    """
+    try:
+        workers = int(os.environ.get("JOBSUB_TARBALL_WORKERS", "4"))
+    except ValueError:
+        print("JOBSUB_TARBALL_WORKERS must be either unset or an integer")
+        raise
+    return max(1, workers)
+
+
+def _package(
+    kind: str, src: str, excludes: Optional[str], verbose: int, codec_name: str
+) -> Tuple[str, str, List[str]]:
+    """
+    make the compressed tarball we upload for src, returning its name,
+    its digest and the files we made that need cleaning up.  kind is
+    "file" for a -f dropbox: file, "tardir" for a directory, or "tarfile"
+    for a user tarball.  This is the cpu heavy part of do_tarballs, so it
+    runs in a separate process when there is more than one to do.
+    """
+    codec = tar_codecs.CODECS[codec_name]
+    made: List[str] = []
+    try:
+        if kind == "tardir":
+            tfn, digest = build_tarball(src, excludes, verbose=verbose, codec=codec)
+            made.append(tfn)
+            return tfn, digest, made
+        if kind == "file":
+            # make sure they'll be able to read it, etc.
+            savemode = os.stat(src).st_mode
+            try:
+                os.chmod(src, 0o755)
+            except OSError:
+                pass
+            try:
+                tarfile = tar_up(
+                    os.path.dirname(src),
+                    "/dev/null",
+                    os.path.basename(src),
+                    verbose=verbose,
+                )
+            finally:
+                try:
+                    os.chmod(src, savemode)
+                except OSError:
+                    pass
+            made.append(tarfile)
+            src = tarfile
+        tfn = tarchmod(src, verbose, codec)
+        made.append(tfn)
+        return tfn, checksum_file(tfn), made
+    except BaseException:
+        for f in made:
+            if os.path.exists(f):
+                os.unlink(f)
+        raise
+
+
+Packager = Callable[[str, str, Optional[str], int, str], Tuple[str, str, List[str]]]
+
+
+def _dropbox_input_file(
+    args: argparse.Namespace,
+    fn: str,
+    codec: Optional[tar_codecs.Codec],
+    packager: Packager,
+    clean_up: List[str],
+    pending: List[PendingPublish],
+    cred_set: Optional[CredentialSet] = None,
+) -> Tuple[str, Optional[str]]:
+    """
+    handle one -f file for do_tarballs, returning what to replace it with
+    and the entry for +PNFS_INPUT_FILES, if any
+    """
+    if not fn.startswith("dropbox:"):
+        return fn, None
+
+    if fn.startswith("dropbox://"):
+        fn = fn.replace("//", "", 1)
+    pfn = fn.replace("dropbox:", "", 1)
+
+    # backwards incompatability warning
+    if tarfile_mod.is_tarfile(pfn):
+        sys.stderr.write(
+            "Notice: with jobsub_lite, -f dropbox:... "
+            "does not unpack tarfiles, use --tar_file_name instead\n"
+        )
+
+    if args.use_dropbox == "cvmfs" or args.use_dropbox is None:
+        assert codec is not None
+        tarfile, digest, made = packager(
+            "file", pfn, None, getattr(args, "verbose", 0), codec.name
+        )
+        clean_up.extend(made)
+        path = tarfile_in_dropbox(args, tarfile, digest, codec, pending, cred_set)
+        if path:
+            return os.path.join(path, os.path.basename(pfn)), None
+        return pfn, None
+
+    if args.use_dropbox == "pnfs":
+        location = dcache_persistent_path(args.group, pfn)
+        existing = fake_ifdh.ls(location)
+        if existing:
+            print(f"file {pfn} already copied to resilient area")
+        else:
+            fake_ifdh.mkdir_p(os.path.dirname(location))
+            fake_ifdh.chmod(os.path.dirname(location), 0o775)
+            fake_ifdh.cp(pfn, location)
+            fake_ifdh.chmod(location, 0o775)
+            existing = fake_ifdh.ls(location)
+            if not existing:
+                raise PermissionError(f"Error: Unable to create {location}")
+        return location, location
+
+    return pfn, None
+
+
+def _dropbox_tar_file(
+    args: argparse.Namespace,
+    tfn: str,
+    codec: Optional[tar_codecs.Codec],
+    packager: Packager,
+    clean_up: List[str],
+    pending: List[PendingPublish],
+    cred_set: Optional[CredentialSet] = None,
+) -> Tuple[str, Optional[str]]:
+    """
+    handle one --tar_file_name for do_tarballs, returning what to replace
+    it with and the entry for +PNFS_INPUT_FILES, if any
+    """
+    if tfn.startswith("tardir://"):
+        tfn = tfn.replace("//", "", 1)
+
+    digest = None
+    index: Optional[Tuple[str, str]] = None
+    if tfn.startswith("tardir:"):
+        assert codec is not None
+        path = None
+        if TARDIR_INDEX and args.use_dropbox in ("cvmfs", None):
+            index = tardir_manifest(tfn[7:], args.tarball_exclusion_file, codec)
+            path = tardir_from_index(args, *index, cred_set)
+        if path:
+            return path, None
+        # tar it up, pretend they gave us dropbox:
+        tarfile, digest, made = packager(
+            "tardir",
+            tfn[7:],
+            args.tarball_exclusion_file,
+            getattr(args, "verbose", 0),
+            codec.name,
+        )
+        clean_up.extend(made)
+        tfn = f"dropbox:{tarfile}"
+
+    if not tfn.startswith("dropbox:"):
+        return tfn, None
+
+    # move it to dropbox area, pretend they gave us plain path
+    if tfn.startswith("dropbox://"):
+        tfn = tfn.replace("//", "", 1)
+    tfn = tfn[8:]
+    if digest is None and codec is not None:
+        tfn, digest, made = packager(
+            "tarfile", tfn, None, getattr(args, "verbose", 0), codec.name
+        )
+        clean_up.extend(made)
+    path = tarfile_in_dropbox(args, tfn, digest, codec, pending, cred_set)
+    if path:
+        tfn = path
+        if index is not None and digest is not None:
+            tardir_index_store(index[0], index[1], digest)
+
+    if args.use_dropbox == "pnfs":
+        return tfn, tfn
+    return tfn, None
+
+
 @as_span("do_tarballs", arg_attrs=["*"])
 def do_tarballs(args: argparse.Namespace) -> None:
     """handle tarfile argument;  we could have:
@@ -229,118 +892,108 @@ def do_tarballs(args: argparse.Namespace) -> None:
        a tarfile with dropbox: or drobpox:// prefix to upload
        a plain path to just use
     we convert the argument to the next type as we go...
+
+    Several of these are handled at once: the packaging (tar, compress,
+    checksum) in a pool of processes, and the uploads in threads.  The
+    results, and +PNFS_INPUT_FILES, stay in the order we were given.
     """
-    # pylint: disable=too-many-nested-blocks,too-many-branches
     clean_up: List[str] = []
-    res: List[str] = []
-    path: Optional[str] = None
+    pending: List[PendingPublish] = []
 
     args.orig_input_file = args.input_file.copy()
     args.orig_tar_file_name = args.tar_file_name.copy()
 
-    pnfs_classad_line: List[str] = []
-
-    try:
-        for fn in args.input_file:
-            if fn.startswith("dropbox:"):
-                if fn.startswith("dropbox://"):
-                    fn = fn.replace("//", "", 1)
-
-                pfn = fn.replace("dropbox:", "", 1)
-
-                # backwards incompatability warning
-                if tarfile_mod.is_tarfile(pfn):
-                    sys.stderr.write(
-                        "Notice: with jobsub_lite, -f dropbox:... "
-                        "does not unpack tarfiles, use --tar_file_name instead\n"
-                    )
+    codec: Optional[tar_codecs.Codec] = None
+    cred_set: Optional[CredentialSet] = None
+    n_dropbox = len(args.tar_file_name) + len(
+        [fn for fn in args.input_file if fn.startswith("dropbox:")]
+    )
+    if n_dropbox:
+        codec = tar_codecs.tarball_codec(args.use_dropbox)
+        # get credentials once up front, rather than in every upload thread
+        if args.use_dropbox in ("cvmfs", "pnfs", None):
+            cred_set = get_creds(vars(args))
+
+    workers = max(1, min(tarball_workers(), n_dropbox))
+    nprocs = min(workers, os.cpu_count() or 1)
+    procs: Optional[ProcessPoolExecutor] = None
+    proc_futures: List["Future[Tuple[str, str, List[str]]]"] = []
+    packager: Packager = _package
+    if nprocs > 1:
+        # forkserver, since forking a process with threads running is unsafe
+        procs = ProcessPoolExecutor(
+            max_workers=nprocs, mp_context=multiprocessing.get_context("forkserver")
+        )
 
-                if args.use_dropbox == "cvmfs" or args.use_dropbox is None:
-                    # make sure they'll be able to read it, etc.
-                    savemode = os.stat(pfn).st_mode
-                    try:
-                        os.chmod(pfn, 0o755)
-                    except OSError:
-                        pass
-                    tarfile = tar_up(
-                        os.path.dirname(pfn),
-                        "/dev/null",
-                        os.path.basename(pfn),
-                        verbose=getattr(args, "verbose", 0),
-                    )
-                    try:
-                        os.chmod(pfn, savemode)
-                    except OSError:
-                        pass
-                    clean_up.append(tarfile)
-                    path = tarfile_in_dropbox(args, tarfile)
-                    if path:
-                        res.append(os.path.join(path, os.path.basename(pfn)))
-                    else:
-                        res.append(pfn)
-
-                elif args.use_dropbox == "pnfs":
-                    get_creds(vars(args))
-                    location = dcache_persistent_path(args.group, pfn)
-                    existing = fake_ifdh.ls(location)
-                    if existing:
-                        print(f"file {pfn} already copied to resilient area")
-                    else:
-                        fake_ifdh.mkdir_p(os.path.dirname(location))
-                        fake_ifdh.chmod(os.path.dirname(location), 0o775)
-                        fake_ifdh.cp(pfn, location)
-                        fake_ifdh.chmod(location, 0o775)
-                        existing = fake_ifdh.ls(location)
-                        if not existing:
-                            raise PermissionError(f"Error: Unable to create {location}")
-                    res.append(location)
-                    pnfs_classad_line.append(location)
-                else:
-                    res.append(pfn)
-            else:
-                res.append(fn)
-
-        args.input_file = res
-
-        res = []
-        orig_basenames = []
-        for tfn in args.tar_file_name:
-            orig_basenames.append(
-                os.path.basename(tfn)
-                .replace(".tbz2", "")
-                .replace(".tar", "")
-                .replace(".tgz", "")
-            )
+        def pool_packager(*pargs: Any) -> Tuple[str, str, List[str]]:
+            assert procs is not None
+            future = procs.submit(_package, *pargs)
+            proc_futures.append(future)
+            return future.result()
 
-            if tfn.startswith("tardir://"):
-                tfn = tfn.replace("//", "", 1)
+        packager = pool_packager
 
-            if tfn.startswith("tardir:"):
-                # tar it up, pretend they gave us dropbox:
-                tarfile = tar_up(
-                    tfn[7:],
-                    args.tarball_exclusion_file,
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            input_futures = [
+                executor.submit(
+                    _dropbox_input_file,
+                    args,
+                    fn,
+                    codec,
+                    packager,
+                    clean_up,
+                    pending,
+                    cred_set,
                 )
-                tfn = f"dropbox:{tarfile}"
-                clean_up.append(tarfile)
-
-            if tfn.startswith("dropbox:"):
-                # move it to dropbox area, pretend they gave us plain path
-                if tfn.startswith("dropbox://"):
-                    tfn = tfn.replace("//", "", 1)
-                path = tarfile_in_dropbox(args, tfn[8:])
-                if path:
-                    tfn = path
-                else:
-                    tfn = tfn.replace("dropbox:", "", 1)
-
-                if args.use_dropbox == "pnfs":
-                    pnfs_classad_line.append(tfn)
-
-            res.append(tfn)
-        args.tar_file_name = res
-        args.tar_file_orig_basenames = orig_basenames
+                for fn in args.input_file
+            ]
+            tar_futures = [
+                executor.submit(
+                    _dropbox_tar_file,
+                    args,
+                    tfn,
+                    codec,
+                    packager,
+                    clean_up,
+                    pending,
+                    cred_set,
+                )
+                for tfn in args.tar_file_name
+            ]
+            input_res = [f.result() for f in input_futures]
+            tar_res = [f.result() for f in tar_futures]
+
+        args.input_file = [r[0] for r in input_res]
+        args.tar_file_name = [r[0] for r in tar_res]
+        args.tar_file_orig_basenames = [
+            os.path.basename(tfn)
+            .replace(".tbz2", "")
+            .replace(".tar", "")
+            .replace(".tgz", "")
+            .replace(".txz", "")
+            .replace(".tzst", "")
+            for tfn in args.orig_tar_file_name
+        ]
+        pnfs_classad_line = [r[1] for r in input_res + tar_res if r[1]]
+
+        # now wait for RCDS to publish everything we uploaded, all together
+        if pending:
+            locations = wait_for_publish(pending, args.verbose)
+            for cid, location in locations.items():
+                placeholder = pending_location(cid)
+                args.input_file = [
+                    f.replace(placeholder, location) for f in args.input_file
+                ]
+                args.tar_file_name = [
+                    f.replace(placeholder, location) for f in args.tar_file_name
+                ]
     finally:
+        if procs is not None:
+            # shutdown(cancel_futures=True) is python 3.9+, so do it ourselves
+            for future in proc_futures:
+                future.cancel()
+            procs.shutdown(wait=True)
         # clean up any tarfiles we made...
         for tarfile in clean_up:
             try:
@@ -355,23 +1008,45 @@ def do_tarballs(args: argparse.Namespace) -> None:
 # TODO:  I've disabled too-many-statements and too-many-branches, but it's a good indicator that this could be
 # cleaned up in the future
 # pylint: disable=too-many-statements,too-many-branches
-def tarfile_in_dropbox(args: argparse.Namespace, origtfn: str) -> Optional[str]:
+def tarfile_in_dropbox(
+    args: argparse.Namespace,
+    origtfn: str,
+    digest: Optional[str] = None,
+    codec: Optional[tar_codecs.Codec] = None,
+    pending: Optional[List["PendingPublish"]] = None,
+    cred_set: Optional[CredentialSet] = None,
+) -> Optional[str]:
     """
-    upload a tarfile to the dropbox, return its path there
+    upload a tarfile to the dropbox, return its path there.  If we are
+    given its digest, origtfn came from build_tarball and is ready to go
+    as is.  If we are given a pending list, we don't wait for RCDS to
+    publish the tarball; we add it to the list and return a
+    pending_location() placeholder for wait_for_publish to fill in.
+    cred_set defaults to get_creds(vars(args)).
     """
 
     if args.verbose > 3:
         # if we're *really* debugging, dump the http connections...
         http.client.HTTPConnection.debuglevel = 5
 
-    # redo tarfile to have contents with world read perms before publishing
-    tfn = tarchmod(origtfn, getattr(args, "verbose", 0))
+    if digest is None:
+        # redo tarfile to have contents with world read perms before publishing
+        if codec is None:
+            codec = tar_codecs.tarball_codec(args.use_dropbox)
+        tfn = tarchmod(origtfn, getattr(args, "verbose", 0), codec)
+    else:
+        tfn = origtfn
 
-    cred_set = get_creds(vars(args))
+    if cred_set is None:
+        cred_set = get_creds(vars(args))
+
+    if digest is None:
+        digest = checksum_file(tfn)
+    else:
+        remember_digest(tfn, digest)
 
     location: Optional[str] = ""
     if args.use_dropbox == "cvmfs" or args.use_dropbox is None:
-        digest = checksum_file(tfn)
 
         if not args.group:
             raise ValueError("No --group specified!")
@@ -386,30 +1061,19 @@ def tarfile_in_dropbox(args: argparse.Namespace, origtfn: str) -> Optional[str]:
         if location is None:
             if args.verbose:
                 print(f"\n\nUsing RCDS to publish tarball\ncid: {cid}")
-            publisher.publish(tfn)
+            if UPLOAD_CHUNK_SIZE > 0:
+                publisher.publish_chunked(tfn, UPLOAD_CHUNK_SIZE)
+            else:
+                publisher.publish(tfn)
             publisher.activate_server_switcher()
             if not getattr(args, "skip_check_rcds", False):
-                msg = "Checking to see if uploaded file is published on RCDS"
-                if args.verbose:
-                    msg = msg + f" for CID {cid}"
-                print(msg)
-
-                # pylint: disable-next=unused-variable
-                for i in range(NUM_RETRIES):
-                    location = publisher.cid_exists()
-                    if location is not None:
-                        print("Found uploaded file on RCDS.")
-                        break
-                    if i < (NUM_RETRIES - 1):
-                        _retry_interval_sec = 0 if i == 0 else RETRY_INTERVAL_SEC
-                        print(
-                            f"Could not locate uploaded file on RCDS.  Will retry in {_retry_interval_sec} seconds."
-                        )
-                        time.sleep(_retry_interval_sec)
+                pp = PendingPublish(cid, publisher, time.time())
+                if pending is not None:
+                    # caller will wait for it along with any others
+                    pending.append(pp)
+                    location = pending_location(cid)
                 else:
-                    raise RuntimeError(
-                        f"Max retries {NUM_RETRIES} to find RCDS tarball at {cid} exceeded.  Exiting now."
-                    )
+                    location = wait_for_publish([pp], args.verbose)[cid]
             else:
                 # Here, we don't wait for publish to happen, so we don't know the exact location of the tarball.
                 # We instead set the location to a glob that the wrapper has to handle later
@@ -444,7 +1108,8 @@ def tarfile_in_dropbox(args: argparse.Namespace, origtfn: str) -> Optional[str]:
         raise (
             NotImplementedError(f"unknown tar distribution method: {args.use_dropbox}")
         )
-    os.unlink(tfn)
+    if tfn != origtfn:
+        os.unlink(tfn)
     return location
 
 
@@ -638,7 +1303,7 @@ class TarfilePublisherHandler:
         url = self.pubapi_cid_url_formatter.format(endpoint="update")
         if self.verbose:
             print(f"Calling URL {url}")
-        return requests.get(url, **self.__auth_kwargs)
+        return self._session().get(url, **self.__auth_kwargs)
 
     # pylint: disable=redundant-keyword-arg
     @cid_operation
@@ -660,7 +1325,134 @@ class TarfilePublisherHandler:
             print(f"Calling URL {url}")
 
         with open(tarfilename, "rb") as tarfile:
-            return requests.post(url, data=tarfile, **self.__auth_kwargs)
+            return self._session().post(url, data=tarfile, **self.__auth_kwargs)
+
+    @as_span("publish_chunked", arg_attrs=["*"])
+    def publish_chunked(self, tarfilename: str, chunk_size: int) -> Optional[str]:
+        """Upload this tarfile in chunks of chunk_size bytes, each with its
+        sha256, to a single PubAPI server.  If a chunk fails, we ask the
+        server how much it has and carry on from there, rather than sending
+        the whole tarball again.  Falls back to publish() if the server
+        doesn't do chunked uploads.
+
+        Args:
+            tarfilename: filename to open for tarfile
+            chunk_size: bytes per chunk
+
+        Returns:
+            location of the tarball if the server says it is present
+        """
+        try:
+            offset = self._upload_offset()
+        except requests.RequestException:
+            # publish() has the retries and server switching we lack here
+            tb.print_exc()
+            print("Unable to start a chunked upload, sending whole file")
+            offset = None
+        else:
+            if offset is None and self.verbose:
+                print("PubAPI server does not take chunked uploads, sending whole file")
+        if offset is None:
+            result: Optional[str] = self.publish(tarfilename)
+            return result
+
+        size = os.path.getsize(tarfilename)
+        failures = 0
+        start = time.time()
+        sent = 0
+        with open(tarfilename, "rb") as tarfile:
+            while offset < size:
+                tarfile.seek(offset)
+                chunk = tarfile.read(chunk_size)
+                url = self._chunk_url("upload_chunk", offset=offset)
+                try:
+                    response = self._session().post(
+                        url,
+                        data=chunk,
+                        headers={
+                            "Content-Range": f"bytes {offset}-{offset + len(chunk) - 1}/{size}",
+                            "X-Chunk-Sha256": hashlib.sha256(chunk).hexdigest(),
+                        },
+                        **self.__auth_kwargs,
+                    )
+                    response.raise_for_status()
+                    new_offset = self._parse_offset(response.text)
+                    if new_offset is None:
+                        raise ValueError(
+                            f"unexpected upload_chunk response: {response.text}"
+                        )
+                except Exception:  # pylint: disable=broad-except
+                    tb.print_exc()
+                    failures += 1
+                    if failures >= NUM_RETRIES:
+                        print(f"Max retries {NUM_RETRIES} exceeded.  Exiting now.")
+                        raise
+                    print(f"Will resume upload in {RETRY_INTERVAL_SEC} seconds")
+                    time.sleep(RETRY_INTERVAL_SEC)
+                    try:
+                        new_offset = self._upload_offset()
+                    except Exception:  # pylint: disable=broad-except
+                        tb.print_exc()
+                        continue
+                    if new_offset is None:
+                        raise
+                else:
+                    sent += len(chunk)
+                elapsed = max(time.time() - start, 1e-6)
+                add_event(
+                    "upload progress",
+                    {
+                        "offset": str(new_offset),
+                        "size": str(size),
+                        "bytes_per_sec": f"{sent / elapsed:.0f}",
+                    },
+                )
+                if self.verbose:
+                    print(
+                        f"Uploaded {new_offset} of {size} bytes "
+                        f"({sent / elapsed / 1048576:.1f} MB/s)"
+                    )
+                offset = new_offset
+
+        url = self._chunk_url("upload_done", size=size)
+        if self.verbose:
+            print(f"Calling URL {url}")
+        response = self._session().post(url, **self.__auth_kwargs)
+        response.raise_for_status()
+        _match = self.check_tarball_present_re.match(response.text)
+        return str(_match.group(1)) if _match is not None else None
+
+    def _chunk_url(self, endpoint: str, **params: Any) -> str:
+        """url for a chunked upload call on the server we are using"""
+        url = self.pubapi_base_url_formatter_full.format(
+            dropbox_server=self.__last_server, endpoint=endpoint
+        )
+        url += f"?cid={self.cid_url}"
+        for k, v in params.items():
+            url += f"&{k}={v}"
+        return url
+
+    upload_offset_re = re.compile("^OFFSET:([0-9]+)$")
+
+    def _parse_offset(self, text: str) -> Optional[int]:
+        _match = self.upload_offset_re.match(text.strip())
+        return int(_match.group(1)) if _match is not None else None
+
+    def _upload_offset(self) -> Optional[int]:
+        """ask the server how much of our chunked upload it has; None
+        means it doesn't do chunked uploads"""
+        url = self._chunk_url("upload_offset")
+        if self.verbose:
+            print(f"Calling URL {url}")
+        response = self._session().get(url, **self.__auth_kwargs)
+        if response.status_code in (
+            http.HTTPStatus.NOT_FOUND,
+            http.HTTPStatus.METHOD_NOT_ALLOWED,
+            http.HTTPStatus.NOT_IMPLEMENTED,
+        ):
+            return None
+        response.raise_for_status()
+        return self._parse_offset(response.text)
 
     @cid_operation
     @as_span("cid_exists")
@@ -675,7 +1467,7 @@ class TarfilePublisherHandler:
         url = self.pubapi_cid_url_formatter.format(endpoint="exists")
         if self.verbose:
             print(f"Calling URL {url}")
-        return requests.get(url, **self.__auth_kwargs)
+        return self._session().get(url, **self.__auth_kwargs)
 
     def get_glob_path_for_cid(self) -> Optional[str]:
         """Return a glob path where a tarball given by self.cid can be found"""
@@ -698,7 +1490,11 @@ class TarfilePublisherHandler:
     @pubapi_operation()
     def _get_configured_pubapi_repos(self) -> requests.Response:
         url = self.pubapi_base_url_formatter.format(endpoint="config")
-        return requests.get(url, **self.__auth_kwargs)
+        return self._session().get(url, **self.__auth_kwargs)
+
+    def _session(self) -> requests.Session:
+        """pooled http session for the server we are currently talking to"""
+        return pubapi_session(self.__last_server)
 
     def __setup_dropbox_server_selector(self) -> Iterator[str]:
         """Return an infinite iterator of dropbox servers for client to upload tarball to"""
@@ -11,7 +11,7 @@ import shutil
 import sys
 from typing import List, Set
 
-import scitokens  # type: ignore # pylint: disable=import-error
+import fake_ifdh
 import packages
 
 
@@ -68,10 +68,8 @@ def is_copied_token(tokenfile: str) -> bool:
 def get_token_scope(tokenfilename: str) -> List[str]:
     """get the list of scopes from our token file"""
 
-    with open(tokenfilename) as f:  # pylint: disable=unspecified-encoding
-        token_encoded = f.read().strip()
-        token = scitokens.SciToken.deserialize(token_encoded, insecure=True)
-        scopelist = str(token.get("scope")).split(" ")
+    token = fake_ifdh.load_token(tokenfilename)
+    scopelist = str(token.get("scope")).split(" ")
 
     return scopelist
 
@@ -107,6 +107,10 @@ except:  # pylint: disable=bare-except
         ) -> None:
             return
 
+        # pylint: disable=unused-argument,no-self-use
+        def set_attribute(self, key: str, value: Any) -> None:
+            return
+
     def get_current_span():  # type: ignore
         return Tracer()
 
@@ -126,6 +130,11 @@ def add_event(
     span.add_event(name, attributes)
 
 
+def set_attribute(key: str, value: Any) -> None:
+    span = get_current_span()  # type: ignore
+    span.set_attribute(key, value)
+
+
 def start_as_current_span(name: str) -> Context:
     return tracer.start_as_current_span(name)
 
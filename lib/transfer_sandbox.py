@@ -1,32 +1,147 @@
 # pylint: disable=wrong-import-position,wrong-import-order,import-error
+import atexit
+from concurrent.futures import ThreadPoolExecutor
 import os
 import os.path
+import tarfile
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional
 
-from fake_ifdh import mkdir_p, cp
-from tracing import as_span
+from fake_ifdh import mkdir_p, cp_env
+from tracing import as_span, start_as_current_span
 
 PREFIX = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
+# name of the single object uploaded with JOBSUB_SANDBOX_MODE=archive
+SANDBOX_ARCHIVE = "sandbox.tgz"
+
+# transfers started in the background by start_transfer_sandbox
+_background: List[threading.Thread] = []
+
+
+def sandbox_workers() -> int:
+    """how many files to copy to the sandbox at once, $JOBSUB_SANDBOX_WORKERS"""
+    try:
+        return max(1, int(os.environ.get("JOBSUB_SANDBOX_WORKERS", "8")))
+    except ValueError:
+        print("JOBSUB_SANDBOX_WORKERS must be either unset or an integer")
+        raise
+
+
+def sandbox_mode() -> str:
+    """
+    how to upload the sandbox, from $JOBSUB_SANDBOX_MODE: "files" (the
+    default) copies each file, "archive" uploads one tarball of them all
+    """
+    return os.environ.get("JOBSUB_SANDBOX_MODE", "files")
+
+
+def _copy_one(
+    src_dir: str, dest_url: str, f: str, env: Optional[Dict[str, str]] = None
+) -> None:
+    src, dest = os.path.join(src_dir, f), os.path.join(dest_url, f)
+    try:
+        # the same span fake_ifdh.cp gives, but without env in it
+        with start_as_current_span("cp") as scope:
+            if scope:
+                scope.set_attribute("args", repr((src, dest)))
+            cp_env(src, dest, env)
+    except Exception as e:  # pylint: disable=broad-except
+        print(
+            f"warning: error copying {f} to sandbox, will not be available through web logs: {e}"
+        )
+
+
+def _copy_archive(
+    src_dir: str, dest_url: str, files: List[str], env: Optional[Dict[str, str]]
+) -> None:
+    with tempfile.TemporaryDirectory() as tmpdir:
+        tfn = os.path.join(tmpdir, SANDBOX_ARCHIVE)
+        try:
+            with tarfile.open(tfn, "w:gz") as tf:
+                for f in files:
+                    tf.add(os.path.join(src_dir, f), arcname=f)
+        except OSError as e:
+            print(
+                f"warning: error packing sandbox, web logs will not be available for this submission: {e}"
+            )
+            return
+        _copy_one(tmpdir, dest_url, SANDBOX_ARCHIVE, env)
+
 
 @as_span("transfer_sandbox")
-def transfer_sandbox(src_dir: str, dest_url: str) -> None:
+def transfer_sandbox(
+    src_dir: str, dest_url: str, env: Optional[Dict[str, str]] = None
+) -> None:
     """Transfer files from src_dir to sandbox with fake_ifdh (gfal-copy).
     Nothing failing here is considered fatal, since it doesn't affect the job
-    itself, just log availability.
+    itself, just log availability.  The files are copied several at a time,
+    or as one archive with JOBSUB_SANDBOX_MODE=archive.  If env is given,
+    the copies use it rather than os.environ.
 
     """
     print("Transferring files to web sandbox...")
     try:
-        mkdir_p(dest_url)
+        mkdir_p(dest_url, env)
     except Exception as e:  # pylint: disable=broad-except
         print(
             f"warning: error creating sandbox, web logs will not be available for this submission: {e}"
         )
         return
-    for f in os.listdir(src_dir):
-        try:
-            cp(os.path.join(src_dir, f), os.path.join(dest_url, f))
-        except Exception as e:  # pylint: disable=broad-except
+    files = sorted(os.listdir(src_dir))
+    if sandbox_mode() == "archive":
+        _copy_archive(src_dir, dest_url, files, env)
+        return
+    with ThreadPoolExecutor(max_workers=sandbox_workers()) as executor:
+        for f in files:
+            executor.submit(_copy_one, src_dir, dest_url, f, env)
+
+
+def sandbox_async() -> bool:
+    """whether to upload the sandbox in the background, $JOBSUB_SANDBOX_ASYNC"""
+    return os.environ.get("JOBSUB_SANDBOX_ASYNC", "0") == "1"
+
+
+def start_transfer_sandbox(src_dir: str, dest_url: str) -> None:
+    """
+    transfer_sandbox, but with JOBSUB_SANDBOX_ASYNC=1 do it in the
+    background while we submit; wait_for_sandbox() waits for it to finish.
+    Submitting resets os.environ (packages.orig_env), so the background
+    copies get their own copy of it, token settings and all, from now.
+    We also wait for them at exit, so one isn't lost if submission fails.
+    """
+    if not sandbox_async():
+        transfer_sandbox(src_dir, dest_url)
+        return
+    t = threading.Thread(
+        target=transfer_sandbox,
+        args=(src_dir, dest_url, dict(os.environ)),
+        daemon=True,
+    )
+    t.start()
+    _background.append(t)
+
+
+def wait_for_sandbox(timeout: Optional[float] = None) -> None:
+    """
+    wait for background sandbox transfers, up to timeout seconds in all
+    ($JOBSUB_SANDBOX_TIMEOUT, default 300).  Ones still going after that are
+    left behind with a warning.
+    """
+    if timeout is None:
+        timeout = float(os.environ.get("JOBSUB_SANDBOX_TIMEOUT", "300"))
+    deadline = time.time() + timeout
+    while _background:
+        t = _background.pop(0)
+        t.join(max(0.0, deadline - time.time()))
+        if t.is_alive():
             print(
-                f"warning: error copying {f} to sandbox, will not be available through web logs: {e}"
+                "warning: timed out transferring files to web sandbox, "
+                "web logs may be incomplete for this submission"
             )
+
+
+# however we exit, don't drop a sandbox upload that is still going
+atexit.register(wait_for_sandbox)
@@ -23,17 +23,22 @@ import os.path
 import re
 import shutil
 import socket
+import struct
 import subprocess
 import sys
+import threading
 import time
-from typing import Union, Dict, Any, NamedTuple, Tuple, List, Optional
+from typing import Union, Dict, Any, Callable, NamedTuple, Tuple, List, Optional
 import uuid
 
 import classad  # type: ignore # pylint: disable=import-error
+from cryptography import x509  # pylint: disable=import-error
 from tracing import get_propagator_carrier
 import token_mods
+from transfer_sandbox import wait_for_sandbox
 
 from creds import CredentialSet
+import disk_cache
 import version
 
 ONSITE_SITE_NAME = "FermiGrid"
@@ -59,6 +64,8 @@ def cleandir(d: str, verbose: int) -> None:
 
 def cleanup(varg: Dict[str, Any]) -> None:
     """cleanup submit directory etc."""
+    # don't pull the submit directory out from under a sandbox upload
+    wait_for_sandbox()
     os.chdir(os.path.dirname(f'{varg["submitdir"]}'))
     try:
         cleandir(
@@ -124,28 +131,90 @@ def backslash_escape_layer(argv: List[str]) -> None:
         argv[i] = re.sub(r"\\(.)", "\\1", argv[i])
 
 
+class SubmissionContext(NamedTuple):
+    """
+    the template values that are the same for every job (or DAG stage) in
+    a submission, worked out once by submission_context()
+    """
+
+    prefix: str
+    outbase: str
+    user: str
+    schedd: str
+    ipaddr: str
+    jobsub_version: str
+    kerberos_principal: str
+    uid: str
+    traceparent: str
+    creds: Tuple[Tuple[str, Optional[str]], ...]
+    clientdn: Optional[str]
+
+
+def _dag_context(schedd_name: str) -> Dict[str, str]:
+    """
+    the SubmissionContext values set_some_extras uses, without the proxy DN
+    and traceparent lookups it doesn't need
+    """
+    ai = socket.getaddrinfo(socket.gethostname(), 80)
+    return {
+        "prefix": os.path.dirname(os.path.dirname(__file__)),
+        "outbase": disk_cache.cache_dir(),
+        "user": os.environ["USER"],
+        "schedd": schedd_name,
+        "ipaddr": str(ai[-1][-1][0]) if ai else "unknown",
+        "jobsub_version": f"{version.__title__}-v{version.__version__}",
+        "kerberos_principal": get_principal(),
+    }
+
+
+def submission_context(
+    schedd_name: str, cred_set: CredentialSet, verbose: int = 0
+) -> SubmissionContext:
+    """look up the per-submission values for set_extras_n_fix_units"""
+    dag_ctx = _dag_context(schedd_name)
+    #
+    # get tracing propagator traceparent id so we can use it in templates, etc.
+    #
+    carrier = get_propagator_carrier()
+    if carrier and "traceparent" in carrier:
+        traceparent = carrier["traceparent"]
+    else:
+        traceparent = ""
+    if verbose > 0:
+        sys.stderr.write(f"Setting traceparent: {traceparent}\n")
+    proxy = getattr(cred_set, "proxy", None)
+    return SubmissionContext(
+        prefix=dag_ctx["prefix"],
+        outbase=dag_ctx["outbase"],
+        user=dag_ctx["user"],
+        schedd=dag_ctx["schedd"],
+        ipaddr=dag_ctx["ipaddr"],
+        jobsub_version=dag_ctx["jobsub_version"],
+        kerberos_principal=dag_ctx["kerberos_principal"],
+        uid=str(os.getuid()),
+        traceparent=traceparent,
+        creds=tuple(vars(cred_set).items()),
+        clientdn=get_client_dn(proxy) if proxy is not None else None,
+    )
+
+
 # pylint: disable=unused-argument
 def set_some_extras(
     args: Dict[str, Any],
     schedd_name: str,
     cred_set: CredentialSet,
+    ctx: Optional[SubmissionContext] = None,
 ) -> None:
     """common items needed for condor_submit_dag to make the dagman file"""
+    dag_ctx = ctx._asdict() if ctx is not None else _dag_context(schedd_name)
     #
     # outbase needs to be where we make scratch files
     #
-    args["prefix"] = os.path.dirname(os.path.dirname(__file__))
-    args["outbase"] = (
-        os.environ.get("XDG_CACHE_HOME", f"{os.environ.get('HOME')}/.cache")
-        + "/jobsub_lite"
-    )
-    args["user"] = os.environ["USER"]
-    args["schedd"] = schedd_name
-    ai = socket.getaddrinfo(socket.gethostname(), 80)
-    if ai:
-        args["ipaddr"] = ai[-1][-1][0]
-    else:
-        args["ipaddr"] = "unknown"
+    args["prefix"] = dag_ctx["prefix"]
+    args["outbase"] = dag_ctx["outbase"]
+    args["user"] = dag_ctx["user"]
+    args["schedd"] = dag_ctx["schedd"]
+    args["ipaddr"] = dag_ctx["ipaddr"]
 
     if not "uuid" in args:
         args["uuid"] = str(uuid.uuid4())
@@ -161,8 +230,8 @@ def set_some_extras(
     if not os.path.exists(args["outdir"]):
         os.makedirs(args["outdir"])
 
-    args["jobsub_version"] = f"{version.__title__}-v{version.__version__}"
-    args["kerberos_principal"] = get_principal()
+    args["jobsub_version"] = dag_ctx["jobsub_version"]
+    args["kerberos_principal"] = dag_ctx["kerberos_principal"]
 
     if not "outurl" in args:
         args["outurl"] = ""
@@ -184,12 +253,15 @@ def set_extras_n_fix_units(
     args: Dict[str, Any],
     schedd_name: str,
     cred_set: CredentialSet,
+    ctx: Optional[SubmissionContext] = None,
 ) -> None:
     """
     add items to our args dictionary that are not given on the
     command line, but that are needed to render the condor submit
     file templates.
     Also convert units on memory, disk, and times
+    Pass ctx from submission_context() when doing this for several
+    stages of one submission.
     Note: this has gotten excessively long, probably should be split up?
     """
     # pylint: disable=too-many-branches,too-many-statements
@@ -197,29 +269,19 @@ def set_extras_n_fix_units(
     if args["verbose"] > 1:
         sys.stderr.write(f"entering set_extras... args: {repr(args)}\n")
 
-    set_some_extras(args, schedd_name, cred_set)
+    if ctx is None:
+        ctx = submission_context(schedd_name, cred_set, args["verbose"])
+    set_some_extras(args, schedd_name, cred_set, ctx)
 
-    #
-    # get tracing propagator traceparent id so we can use it in templates, etc.
-    #
-    carrier = get_propagator_carrier()
-    if carrier and "traceparent" in carrier:
-        args["traceparent"] = carrier["traceparent"]
-    else:
-        args["traceparent"] = ""
-
-    if args["verbose"] > 0:
-        sys.stderr.write(f"Setting traceparent: {args['traceparent']}\n")
+    args["traceparent"] = ctx.traceparent
 
     # Read in credentials
-    for cred_type, cred_path in vars(cred_set).items():
+    for cred_type, cred_path in ctx.creds:
         args[cred_type] = cred_path
-    if getattr(cred_set, "proxy", None) is not None:
-        args["clientdn"] = get_client_dn(cred_set.proxy)
+    if ctx.clientdn is not None:
+        args["clientdn"] = ctx.clientdn
 
-    args["jobsub_version"] = f"{version.__title__}-v{version.__version__}"
-    args["kerberos_principal"] = get_principal()
-    args["uid"] = str(os.getuid())
+    args["uid"] = ctx.uid
 
     if args["verbose"] > 1:
         sys.stderr.write(
@@ -428,9 +490,88 @@ def fix_unit(
             )
 
 
+# things we have read from credential files, one per (what, path), along
+# with the (mtime, size, inode) they were read at, so we notice when kinit
+# or getProxy replace them
+_cred_file_memo: Dict[Tuple[str, str], Tuple[Tuple[int, int, int], str]] = {}
+_cred_file_memo_lock = threading.Lock()
+
+
+def _memo_cred_file(
+    what: str, path: str, reader: Callable[[str], Optional[str]]
+) -> Optional[str]:
+    """reader(path), remembered until the file at path changes"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    key = (what, os.path.realpath(path))
+    stamp = (st.st_mtime_ns, st.st_size, st.st_ino)
+    with _cred_file_memo_lock:
+        memo = _cred_file_memo.get(key)
+        if memo is not None and memo[0] == stamp:
+            return memo[1]
+        res = reader(path)
+        if not res:
+            _cred_file_memo.pop(key, None)
+            return None
+        _cred_file_memo[key] = (stamp, res)
+        return res
+
+
+def _ccache_file() -> Optional[str]:
+    """
+    our kerberos credential cache file, if $KRB5CCNAME names a FILE: one.
+    Otherwise the default cache may well be KCM or KEYRING, with a stale
+    /tmp/krb5cc_<uid> lying around, so leave it to klist.
+    """
+    ccname = os.environ.get("KRB5CCNAME", "")
+    if ccname.startswith("FILE:"):
+        return ccname[5:]
+    return None
+
+
+def read_ccache_principal(path: str) -> Optional[str]:
+    """
+    the default principal from an MIT FILE: credential cache, see
+    https://web.mit.edu/kerberos/krb5-latest/doc/formats/ccache_file_format.html
+    """
+    try:
+        with open(path, "rb") as f:
+            data = f.read(4096)
+        version = struct.unpack(">H", data[:2])[0]
+        if version not in (0x0501, 0x0502, 0x0503, 0x0504):
+            return None
+        pos = 2
+        if version == 0x0504:
+            pos += 2 + struct.unpack(">H", data[pos : pos + 2])[0]
+        if version != 0x0501:
+            pos += 4  # name type
+        count = struct.unpack(">I", data[pos : pos + 4])[0]
+        pos += 4
+        if version == 0x0501:
+            count -= 1  # which included the realm
+        strings = []
+        for _ in range(count + 1):
+            slen = struct.unpack(">I", data[pos : pos + 4])[0]
+            pos += 4
+            if pos + slen > len(data):
+                return None
+            strings.append(data[pos : pos + slen].decode())
+            pos += slen
+    except (OSError, struct.error, UnicodeDecodeError):
+        return None
+    realm, components = strings[0], strings[1:]
+    return f"{'/'.join(components)}@{realm}"
+
+
 def get_principal() -> str:
     """get our kerberos principal name"""
-    princ = None
+    ccfile = _ccache_file()
+    if ccfile:
+        princ = _memo_cred_file("principal", ccfile, read_ccache_principal)
+        if princ:
+            return princ
     with subprocess.Popen(
         ["/usr/bin/klist"], stdout=subprocess.PIPE, encoding="UTF-8"
     ) as p:
@@ -440,6 +581,45 @@ def get_principal() -> str:
     return princ
 
 
+# subject attribute names as voms-proxy-info and openssl print them;
+# others come out as dotted OIDs, as openssl does
+SUBJECT_ATTR_NAMES = {
+    "2.5.4.3": "CN",
+    "2.5.4.4": "SN",
+    "2.5.4.5": "serialNumber",
+    "2.5.4.6": "C",
+    "2.5.4.7": "L",
+    "2.5.4.8": "ST",
+    "2.5.4.9": "street",
+    "2.5.4.10": "O",
+    "2.5.4.11": "OU",
+    "2.5.4.12": "title",
+    "2.5.4.42": "GN",
+    "0.9.2342.19200300.100.1.1": "UID",
+    "0.9.2342.19200300.100.1.25": "DC",
+    "1.2.840.113549.1.9.1": "emailAddress",
+}
+
+
+def read_proxy_subject(path: str) -> Optional[str]:
+    """
+    the subject of the (first) certificate in path, in /A=b/C=d form, or
+    None if we can't read it here, so get_client_dn asks voms-proxy-info
+    """
+    try:
+        with open(path, "rb") as f:
+            cert = x509.load_pem_x509_certificate(f.read())
+        parts = []
+        for rdn in cert.subject.rdns:
+            for attr in rdn:
+                oid = attr.oid.dotted_string
+                parts.append(f"/{SUBJECT_ATTR_NAMES.get(oid, oid)}={attr.value!s}")
+        return "".join(parts)
+    # older cryptography versions fail in all sorts of ways, so be broad
+    except Exception:  # pylint: disable=broad-except
+        return None
+
+
 def get_client_dn(proxy: Union[None, str] = None) -> Union[str, Any]:
     """Get our proxy's DN if the proxy exists"""
     if proxy is None:
@@ -448,6 +628,10 @@ def get_client_dn(proxy: Union[None, str] = None) -> Union[str, Any]:
             uid = str(os.getuid())
             proxy = f"/tmp/x509up_u{uid}"
 
+    subject = _memo_cred_file("subject", proxy, read_proxy_subject)
+    if subject:
+        return subject
+
     # pylint: disable=unsubscriptable-object
     executables: OrderedDict[str, Dict[str, Any]] = OrderedDict(
         (
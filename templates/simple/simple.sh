@@ -116,6 +116,20 @@ jobsub:---- resumed for last $JOBSUB_MAX_JOBLOG_TAIL_SIZE bytes--
 }
 
 
+untar_input(){
+    # unpack tarball $2 into directory $1, using the fastest decompressor
+    # we have for the codec jobsub packed it with (see lib/tar_codecs.py)
+    case "$2" in
+    *.tzst)          jsb_unzip="zstd -d" ;;
+    *.txz|*.tar.xz)  jsb_unzip="xz -d -T0" ;;
+    *.tgz|*.tar.gz)  if type pigz > /dev/null 2>&1; then jsb_unzip="pigz -d"; else jsb_unzip="gzip -d"; fi ;;
+    *)               if type lbzip2 > /dev/null 2>&1; then jsb_unzip="lbzip2 -d"
+                     elif type pbzip2 > /dev/null 2>&1; then jsb_unzip="pbzip2 -d"
+                     else jsb_unzip="bzip2 -d"; fi ;;
+    esac
+    tar --directory "$1" --use-compress-program="$jsb_unzip" -xvf "$2"
+}
+
 redirect_output_start(){
     exec 7>&1
     exec >${JSB_TMP}/JOBSUB_LOG_FILE
@@ -307,7 +321,7 @@ export PATH="${PATH}:."
     mkdir .unwind_{{loop.index0}}
     {%set tflocal = '.unwind_%d/%s' % (loop.index0, tfname|basename) %}
     ${JSB_TMP}/ifdh.sh cp {{tfname}} {{tflocal}}
-    tar --directory .unwind_{{loop.index0}} -xjvf {{tflocal}}
+    untar_input .unwind_{{loop.index0}} {{tflocal}}
     {%if loop.first%}
       INPUT_TAR_DIR_LOCAL=`pwd`/.unwind_{{loop.index0}}
       export INPUT_TAR_DIR_LOCAL
@@ -0,0 +1,89 @@
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+#
+# we assume everwhere our current directory is in the package
+# test area, so go ahead and cd there
+#
+os.chdir(os.path.dirname(__file__))
+
+#
+# import modules we need to test, since we chdir()ed, can use relative path
+# unless we're testing installed, then use /opt/jobsub_lite/...
+#
+if os.environ.get("JOBSUB_TEST_INSTALLED", "0") == "1":
+    sys.path.append("/opt/jobsub_lite/lib")
+else:
+    sys.path.append("../lib")
+
+import mains.cmd as cmd
+
+
+@pytest.mark.unit
+def test_run_for_schedd_ok():
+    res = cmd.run_for_schedd(["/bin/echo", "-name", "s1"], "s1", 0)
+    assert res.returncode == 0
+    assert res.stdout == "-name s1\n"
+
+
+@pytest.mark.unit
+def test_run_for_schedd_credd_host():
+    res = cmd.run_for_schedd(["/bin/sh", "-c", "echo $_condor_CREDD_HOST"], "s1", 0)
+    assert res.stdout == "s1\n"
+
+
+@pytest.mark.unit
+def test_run_for_schedd_timeout():
+    start = time.time()
+    res = cmd.run_for_schedd(["/bin/sleep", "10"], "slow.example.com", 0.5)
+    assert time.time() - start < 5
+    assert res.returncode != 0
+    assert "timed out" in res.stderr and "slow.example.com" in res.stderr
+
+
+@pytest.mark.unit
+def test_run_for_schedd_timeout_keeps_output(monkeypatch):
+    """partial output survives a timeout, whether it came back as str or bytes"""
+    for out in ("partial\n", b"partial\n"):
+
+        def fake_run(args, **kwargs):
+            raise subprocess.TimeoutExpired(args, 1, output=out, stderr=None)
+
+        monkeypatch.setattr(cmd.subprocess, "run", fake_run)
+        res = cmd.run_for_schedd(["condor_q"], "s1", 1)
+        assert res.stdout == "partial\n"
+        assert "timed out" in res.stderr
+
+
+@pytest.mark.unit
+def test_run_for_schedd_missing_command():
+    res = cmd.run_for_schedd(["/no/such/condor_q"], "s1", 0)
+    assert res.returncode != 0
+    assert "s1" in res.stderr
+
+
+@pytest.mark.unit
+def test_jobsub_cmd_args_fanout(monkeypatch, capsys):
+    """schedds run concurrently, but output comes back in a fixed order"""
+    schedds = ["a.example.com", "b.example.com", "c.example.com"]
+    delays = {"a.example.com": 0.6, "b.example.com": 0.3, "c.example.com": 0}
+
+    def fake_run(these_args, schedd, timeout):
+        time.sleep(delays[schedd])
+        return subprocess.CompletedProcess(these_args, 0, f"{schedd}\n", "")
+
+    monkeypatch.setenv("GROUP", "fermilab")
+    monkeypatch.setattr(cmd, "run_for_schedd", fake_run)
+    monkeypatch.setattr(cmd.creds, "get_creds", lambda args: None)
+    monkeypatch.setattr(cmd.condor, "get_schedd_names", lambda args: schedds)
+
+    arglist = argparse.Namespace(command="jobsub_rm", verbose=0)
+    start = time.time()
+    cmd.jobsub_cmd_args(arglist, [])
+    assert time.time() - start < 0.9
+    assert capsys.readouterr().out == "".join(f"{s}\n" for s in schedds)
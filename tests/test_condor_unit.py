@@ -2,6 +2,7 @@
 import copy
 import os
 import sys
+import time
 import pytest
 
 #
@@ -20,6 +21,7 @@ if os.environ.get("JOBSUB_TEST_INSTALLED", "0") == "1":
 else:
     sys.path.append("../lib")
 import condor
+import disk_cache
 
 from test_unit import TestUnit
 
@@ -255,6 +257,232 @@ class TestCondorUnit:
         assert not res
 
 
+class FakeCollector:
+    """stand-in for htcondor.Collector that counts queries"""
+
+    queries = 0
+
+    def __init__(self, host=None):
+        pass
+
+    def query(self, adtype, constraint=""):
+        FakeCollector.queries += 1
+        return [
+            condor.classad.ClassAd(
+                {"Name": "fake01.example.com", "RecentDaemonCoreDutyCycle": 0.5}
+            )
+        ]
+
+
+@pytest.fixture
+def schedd_disk_cache(monkeypatch, tmp_path):
+    """point the schedd ad cache at a temp dir, and use FakeCollector"""
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    monkeypatch.setattr(condor, "__schedd_ads", {})
+    monkeypatch.setattr(condor, "SCHEDD_CACHE_TTL", 300)
+    monkeypatch.setattr(condor, "SCHEDD_CACHE_MAX_STALE", 3600)
+    monkeypatch.setattr(condor.htcondor, "Collector", FakeCollector)
+    FakeCollector.queries = 0
+    yield tmp_path
+
+
+class TestScheddDiskCache:
+    vargs = {"group": "fermilab", "verbose": 0}
+
+    @pytest.mark.unit
+    def test_disk_cache_shared(self, schedd_disk_cache, monkeypatch):
+        """a second "process" should get the ads from disk, not the collector"""
+        res = condor.get_schedd_list(self.vargs)
+        assert res[0].eval("Name") == "fake01.example.com"
+        assert FakeCollector.queries == 1
+
+        monkeypatch.setattr(condor, "__schedd_ads", {})
+        res = condor.get_schedd_list(self.vargs)
+        assert res[0].eval("Name") == "fake01.example.com"
+        assert FakeCollector.queries == 1
+
+    @pytest.mark.unit
+    def test_disk_cache_keyed_by_group(self, schedd_disk_cache, monkeypatch):
+        """different groups should not share cache entries"""
+        condor.get_schedd_list(self.vargs)
+        monkeypatch.setattr(condor, "__schedd_ads", {})
+        condor.get_schedd_list({"group": "dune", "verbose": 0})
+        assert FakeCollector.queries == 2
+
+    @pytest.mark.unit
+    def test_disk_cache_refresh_flag(self, schedd_disk_cache):
+        """refresh_schedd_ads should always query the collector"""
+        condor.get_schedd_list(self.vargs)
+        condor.get_schedd_list(self.vargs, refresh_schedd_ads=True)
+        assert FakeCollector.queries == 2
+
+    @pytest.mark.unit
+    def test_disk_cache_stale(self, schedd_disk_cache, monkeypatch):
+        """stale entries are used, but refreshed in the background"""
+        condor.get_schedd_list(self.vargs)
+        monkeypatch.setattr(condor, "__schedd_ads", {})
+        monkeypatch.setattr(condor, "SCHEDD_CACHE_TTL", 1)
+        (fname,) = [
+            f for f in os.listdir(disk_cache.cache_dir()) if f.startswith("schedd_ads")
+        ]
+        fpath = os.path.join(disk_cache.cache_dir(), fname)
+        old = time.time() - 60
+        os.utime(fpath, (old, old))
+
+        res = condor.get_schedd_list(self.vargs)
+        assert res[0].eval("Name") == "fake01.example.com"
+        for t in condor.threading.enumerate():
+            if t.name == "refresh_schedd_ads":
+                t.join()
+        assert FakeCollector.queries == 2
+        assert os.stat(fpath).st_mtime > old
+
+    @pytest.mark.unit
+    def test_disk_cache_too_stale(self, schedd_disk_cache, monkeypatch):
+        """entries older than the stale window are ignored"""
+        condor.get_schedd_list(self.vargs)
+        monkeypatch.setattr(condor, "__schedd_ads", {})
+        monkeypatch.setattr(condor, "SCHEDD_CACHE_MAX_STALE", 0)
+        monkeypatch.setattr(condor, "SCHEDD_CACHE_TTL", 1)
+        for fname in os.listdir(disk_cache.cache_dir()):
+            old = time.time() - 60
+            os.utime(os.path.join(disk_cache.cache_dir(), fname), (old, old))
+        condor.get_schedd_list(self.vargs)
+        assert FakeCollector.queries == 2
+
+
+class FakeSubmitResult:
+    def __init__(self, cluster):
+        self._cluster = cluster
+
+    def cluster(self):
+        return self._cluster
+
+
+class FakeSchedd:
+    """stand-in for htcondor.Schedd that remembers what was submitted"""
+
+    submitted = []
+    spooled = []
+
+    def __init__(self, ad=None):
+        pass
+
+    def submit(self, subm, count=1, spool=False):
+        FakeSchedd.submitted.append((subm, count, spool))
+        return FakeSubmitResult(1234)
+
+    def spool(self, ads):
+        FakeSchedd.spooled.append(ads)
+
+
+@pytest.fixture
+def bindings_engine(monkeypatch, tmp_path):
+    """use the bindings submit engine against FakeSchedd"""
+    monkeypatch.setenv("JOBSUB_SUBMIT_ENGINE", "bindings")
+    monkeypatch.setenv("TMPDIR", str(tmp_path))
+    monkeypatch.setattr(
+        condor,
+        "__schedd_ads",
+        {"fake01.example.com": condor.classad.ClassAd({"Name": "fake01.example.com"})},
+    )
+    monkeypatch.setattr(condor, "__schedd_handles", {})
+    monkeypatch.setattr(condor.htcondor, "Schedd", FakeSchedd)
+    FakeSchedd.submitted = []
+    FakeSchedd.spooled = []
+    storer_calls = []
+
+    def fake_run(cmd, **kwargs):
+        storer_calls.append((cmd, kwargs["env"]))
+        return condor.subprocess.CompletedProcess(cmd, 0)
+
+    monkeypatch.setattr(condor.subprocess, "run", fake_run)
+    yield storer_calls
+
+
+class TestBindingsSubmit:
+    vargs = {
+        "group": TestUnit.test_group,
+        "role": "Analysis",
+        "verbose": 0,
+        "outbase": "/tmp",
+    }
+
+    @pytest.mark.unit
+    def test_submit_bindings_unreadable_file(
+        self, get_submit_file, bindings_engine, monkeypatch
+    ):
+        """item-list queue statements fall back to condor_submit"""
+        with open(get_submit_file, "a") as f:
+            f.write("\nqueue 1 Item in (a b)\n")
+        ran = []
+
+        def fake_run(cmd, **kwargs):
+            ran.append(cmd)
+            return condor.subprocess.CompletedProcess(
+                cmd, 0, stdout="2 job(s) submitted to cluster 5678.\n", stderr=""
+            )
+
+        monkeypatch.setattr(condor.subprocess, "run", fake_run)
+        res = condor.submit(get_submit_file, self.vargs, "fake01.example.com")
+        assert res == 5678
+        assert not FakeSchedd.submitted
+        assert any("condor_submit" in str(c) for c in ran)
+
+    @pytest.mark.unit
+    def test_load_submit_file_bare_queue(self, get_submit_file):
+        """a bare queue statement means one job"""
+        with open(get_submit_file, "a") as f:
+            f.write("\nqueue\n")
+        _, nqueue = condor.load_submit_file(get_submit_file)
+        assert nqueue == 1
+
+    @pytest.mark.unit
+    def test_oauth_service_requests(self):
+        """we build storer requests like condor_submit does"""
+        subm = condor.htcondor.Submit(
+            {
+                "executable": "/bin/true",
+                "use_oauth_services": "fermilab_production",
+                "fermilab_production_oauth_permissions_abc": '" compute.read storage.read:/x "',
+            }
+        )
+        assert condor.oauth_service_requests(subm) == [
+            "fermilab_production&handle=abc&scopes=compute.read,storage.read:/x"
+        ]
+
+    @pytest.mark.unit
+    def test_submit_with_bindings(self, get_submit_file, bindings_engine, capsys):
+        """submit through the bindings, get the cluster id back"""
+        res = condor.submit(get_submit_file, self.vargs, "fake01.example.com")
+        assert res == 1234
+        assert len(FakeSchedd.submitted) == 1
+        _, count, spool = FakeSchedd.submitted[0]
+        assert count == 1 and spool
+        assert len(FakeSchedd.spooled[0]) == 1
+        # credentials stored for the group, on the right credd
+        ((cmd, env),) = bindings_engine
+        assert cmd[0].endswith("bin/condor_vault_storer")
+        assert cmd[1:] == [TestUnit.test_group]
+        assert env["_condor_CREDD_HOST"] == "fake01.example.com"
+        captured = capsys.readouterr()
+        assert "Use job id 1234.0@fake01.example.com to retrieve output" in captured.out
+
+    @pytest.mark.unit
+    def test_submit_with_bindings_reuses_schedd(
+        self, get_submit_file, bindings_engine, monkeypatch
+    ):
+        """the Schedd handle is only made once per schedd"""
+        made = []
+        monkeypatch.setattr(
+            condor.htcondor, "Schedd", lambda ad: made.append(ad) or FakeSchedd(ad)
+        )
+        condor.submit(get_submit_file, self.vargs, "fake01.example.com")
+        condor.submit(get_submit_file, self.vargs, "fake01.example.com")
+        assert len(made) == 1
+        assert len(FakeSchedd.submitted) == 2
+
+
 class TestJob:
     @pytest.mark.unit
     def test_job(self):
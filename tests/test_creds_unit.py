@@ -1,5 +1,7 @@
 import os
 import sys
+import time
+
 import pytest
 
 #
@@ -91,3 +93,71 @@ class TestCredUnit:
             "token location: tokenlocation\n" "proxy location: proxylocation\n"
         )
         del os.environ["X509_USER_PROXY"]
+
+
+@pytest.fixture
+def fake_cred_files(tmp_path, monkeypatch):
+    token = tmp_path / "bt_token"
+    proxy = tmp_path / "x509up"
+    token.write_text("token")
+    proxy.write_text("proxy")
+    calls = []
+
+    def getToken(role, verbose=0):
+        calls.append("token")
+        return str(token)
+
+    def getProxy(role, verbose=0, force_proxy=False, strict=False):
+        calls.append("proxy")
+        return str(proxy)
+
+    monkeypatch.setenv("GROUP", "fermilab")
+    monkeypatch.delenv("BEARER_TOKEN_FILE", raising=False)
+    monkeypatch.delenv("X509_USER_PROXY", raising=False)
+    monkeypatch.delenv("JOBSUB_CREDS_CACHE_SEC", raising=False)
+    monkeypatch.setattr(creds.fake_ifdh, "getRole", lambda r=None: r or "Analysis")
+    monkeypatch.setattr(creds.fake_ifdh, "getToken", getToken)
+    monkeypatch.setattr(creds.fake_ifdh, "getProxy", getProxy)
+    monkeypatch.setattr(
+        creds.fake_ifdh, "load_token", lambda f: {"exp": time.time() + 3600}
+    )
+    creds.clear_creds_cache()
+    yield token, proxy, calls
+    creds.clear_creds_cache()
+
+
+@pytest.mark.unit
+def test_get_creds_cached(fake_cred_files):
+    token, proxy, calls = fake_cred_files
+    args = {"auth_methods": "token,proxy", "force_proxy": True}
+    first = creds.get_creds(args)
+    again = creds.get_creds(dict(args))
+    assert calls == ["token", "proxy"]
+    assert vars(first) == vars(again) and first is not again
+    assert args["role"] == "Analysis"
+    # a different role is a different request
+    creds.get_creds({"auth_methods": "token,proxy", "role": "Production"})
+    assert len(calls) == 4
+    # new credential files mean we look again
+    proxy.write_text("new proxy")
+    creds.get_creds(dict(args))
+    assert len(calls) == 6
+
+
+@pytest.mark.unit
+def test_get_creds_cache_expiry(fake_cred_files, monkeypatch):
+    _, _, calls = fake_cred_files
+    monkeypatch.setattr(
+        creds.fake_ifdh, "load_token", lambda f: {"exp": time.time() + 30}
+    )
+    creds.get_creds({"auth_methods": "token"})
+    creds.get_creds({"auth_methods": "token"})
+    # token is about to expire, so don't reuse it
+    assert calls == ["token", "token"]
+    monkeypatch.setenv("JOBSUB_CREDS_CACHE_SEC", "0")
+    monkeypatch.setattr(
+        creds.fake_ifdh, "load_token", lambda f: {"exp": time.time() + 3600}
+    )
+    creds.get_creds({"auth_methods": "token"})
+    creds.get_creds({"auth_methods": "token"})
+    assert len(calls) == 4
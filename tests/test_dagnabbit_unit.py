@@ -23,6 +23,8 @@ else:
     _old_path = os.environ["PATH"]
     os.environ["PATH"] = f"../bin:{_old_path}"
 import dagnabbit
+from creds import CredentialSet
+import utils
 
 from test_unit import TestUnit
 
@@ -237,3 +239,49 @@ class TestDagnabbitUnit:
                 assert re.search(regexp, data)
 
         os.system("rm -rf %s" % dest)
+
+
+@pytest.mark.unit
+def test_stage_parser_reused():
+    """the stage parser is built once, and one stage can't change another"""
+    parser, defaults = dagnabbit.stage_parser()
+    assert dagnabbit.stage_parser()[0] is parser
+    res = parser.parse_args(["--skip-check", "rcds", "file:///bin/true"])
+    assert res.skip_check == ["rcds"]
+    res = parser.parse_args(["file:///bin/true"])
+    assert res.skip_check == [] and res.skip_check is defaults["skip_check"]
+    assert defaults["append_condor_requirements"] == []
+
+
+@pytest.mark.unit
+def test_parse_dagnabbit_reuses_any_same_stage(tmp_path, monkeypatch):
+    """stages the same as any earlier stage share its .cmd/.sh files"""
+    monkeypatch.setattr(dagnabbit.creds, "get_creds", lambda v: CredentialSet())
+    monkeypatch.setattr(utils, "get_principal", lambda: "someuser@FNAL.GOV")
+    monkeypatch.setenv("GROUP", TestUnit.test_group)
+    dagfile = tmp_path / "dagRepeat"
+    dagfile.write_text(
+        "<serial>\n"
+        "jobsub_submit file://jobA.sh one\n"
+        "jobsub_submit file://jobB.sh\n"
+        "jobsub_submit file://jobA.sh one\n"
+        "jobsub_submit file://jobA.sh    one\n"
+        "jobsub_submit file://jobA.sh two\n"
+        "</serial>\n"
+    )
+    dest = tmp_path / "out"
+    dest.mkdir()
+    varg = TestUnit.test_vargs.copy()
+    varg["outdir"] = varg["submitdir"] = str(dest)
+    varg["dag"] = 1
+    varg["executable"] = f"file://{dagfile}"
+    monkeypatch.chdir(os.path.join(os.path.dirname(__file__), "dagnabbit"))
+    d1 = os.path.join(os.path.dirname(os.path.dirname(__file__)), "templates", "simple")
+    dagnabbit.parse_dagnabbit(d1, varg, str(dest), TestUnit.test_schedd)
+
+    dag = (dest / "dag.dag").read_text()
+    assert "JOB stage_3 stage_1.cmd" in dag
+    assert "JOB stage_4 stage_1.cmd" in dag
+    assert "JOB stage_5 stage_5.cmd" in dag
+    cmds = sorted(f for f in os.listdir(dest) if f.endswith(".cmd"))
+    assert cmds == ["stage_1.cmd", "stage_2.cmd", "stage_5.cmd"]
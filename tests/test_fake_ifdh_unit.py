@@ -1,13 +1,21 @@
 from collections import namedtuple
+import datetime
 import grp
+import http.server
 import os
 import pathlib
 import pwd
 import shutil
 import sys
 import tempfile
+import threading
+import time
+import urllib.parse
 
 import pytest
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
 import jwt
 import scitokens
 
@@ -464,6 +472,292 @@ def test_cp():
     os.unlink(dest)
 
 
+@pytest.mark.unit
+def test_load_token_cached(tmp_path, monkeypatch):
+    calls = []
+
+    def fake_deserialize(serialized, insecure=False):
+        calls.append(serialized)
+        return {"scope": serialized}
+
+    monkeypatch.setattr(scitokens.SciToken, "deserialize", fake_deserialize)
+    monkeypatch.delenv("BEARER_TOKEN", raising=False)
+    tokenfile = tmp_path / "bt_token"
+    tokenfile.write_text("first\n")
+    monkeypatch.setenv("BEARER_TOKEN_FILE", str(tokenfile))
+    assert fake_ifdh.load_token()["scope"] == "first"
+    assert fake_ifdh.load_token(str(tokenfile))["scope"] == "first"
+    assert calls == ["first"]
+    # htgettoken writes a new one
+    tokenfile.write_text("second token\n")
+    assert fake_ifdh.load_token()["scope"] == "second token"
+    assert calls == ["first", "second token"]
+
+
+def make_proxy(path, hours, fqans):
+    """write a self-signed stand-in for a VOMS proxy"""
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(x509.oid.NameOID.COMMON_NAME, "proxy")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    builder = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(1)
+        .not_valid_before(now - datetime.timedelta(hours=1))
+        .not_valid_after(now + datetime.timedelta(hours=hours))
+    )
+    if fqans:
+        ac = b"".join(b"\x04" + bytes([len(f)]) + f.encode() for f in fqans)
+        builder = builder.add_extension(
+            x509.UnrecognizedExtension(fake_ifdh.VOMS_AC_OID, ac), critical=False
+        )
+    cert = builder.sign(key, hashes.SHA256())
+    path.write_bytes(
+        cert.public_bytes(serialization.Encoding.PEM)
+        + key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.TraditionalOpenSSL,
+            serialization.NoEncryption(),
+        )
+    )
+    return str(path)
+
+
+@pytest.mark.unit
+def test_proxy_decision(tmp_path, monkeypatch):
+    monkeypatch.delenv("JOBSUB_PROXY_MIN_LIFETIME", raising=False)
+    fqans = ["/fermilab/nova/Role=Analysis/Capability=NULL", "/fermilab/Role=NULL"]
+    good = make_proxy(tmp_path / "good", 100, fqans)
+    info = fake_ifdh.proxy_info(good)
+    assert info.fqans == fqans
+    assert 99 * 3600 < info.not_after - time.time() < 100 * 3600
+
+    def decision(proxy, igroup, role, strict=True):
+        return fake_ifdh.proxy_decision(proxy, igroup, role, strict)
+
+    assert decision(good, "fermilab/nova", "Analysis") == "reuse"
+    assert decision(good, "fermilab/nova", "Production") == "fqan"
+    assert decision(good, "dune", "Analysis") == "fqan"
+    short = make_proxy(tmp_path / "short", 2, fqans)
+    assert decision(short, "fermilab/nova", "Analysis") == "expiring"
+    monkeypatch.setenv("JOBSUB_PROXY_MIN_LIFETIME", "1")
+    assert decision(short, "fermilab/nova", "Analysis") == "reuse"
+    nofqan = make_proxy(tmp_path / "novoms", 100, [])
+    assert decision(nofqan, "fermilab/nova", "Analysis") == "fqan"
+    (tmp_path / "junk").write_text("not a proxy")
+    assert decision(str(tmp_path / "junk"), "dune", "x") == "unreadable"
+    assert decision(str(tmp_path / "nope"), "dune", "x") == "missing"
+
+    # outside of submit, any proxy with 10 minutes left does, as it always did
+    monkeypatch.delenv("JOBSUB_PROXY_MIN_LIFETIME")
+    assert decision(short, "dune", "Production", strict=False) == "reuse"
+    assert decision(nofqan, "fermilab/nova", "Analysis", strict=False) == "reuse"
+    nearly = make_proxy(tmp_path / "nearly", 0.1, fqans)
+    assert decision(nearly, "fermilab/nova", "Analysis", strict=False) == "expiring"
+
+
+@pytest.mark.unit
+def test_proxy_info_old_cryptography(tmp_path, monkeypatch):
+    """cryptography < 39 has no load_pem_x509_certificates"""
+    first = make_proxy(tmp_path / "first", 100, ["/fermilab/Role=Analysis"])
+    second = make_proxy(tmp_path / "second", 50, [])
+    chain = tmp_path / "chain"
+    chain.write_bytes(
+        (tmp_path / "first").read_bytes() + (tmp_path / "second").read_bytes()
+    )
+    monkeypatch.delattr(fake_ifdh.x509, "load_pem_x509_certificates")
+    info = fake_ifdh.proxy_info(str(chain))
+    assert info.fqans == ["/fermilab/Role=Analysis"]
+    assert 49 * 3600 < info.not_after - time.time() < 50 * 3600
+    (tmp_path / "junk").write_text("not a proxy")
+    assert fake_ifdh.proxy_info(str(tmp_path / "junk")) is None
+    # and whatever else goes wrong, we just can't read it
+    monkeypatch.setattr(fake_ifdh, "load_pem_certs", lambda data: 1 / 0)
+    assert fake_ifdh.proxy_decision(first, "fermilab", "Analysis") == "unreadable"
+
+
+@pytest.mark.unit
+def test_getProxy_reuses_good_proxy(tmp_path, monkeypatch):
+    proxy = make_proxy(
+        tmp_path / "x509up", 100, ["/fermilab/nova/Role=Analysis/Capability=NULL"]
+    )
+    monkeypatch.setenv("GROUP", "nova")
+    monkeypatch.setenv("X509_USER_PROXY", proxy)
+    monkeypatch.setattr(
+        fake_ifdh.subprocess, "run", lambda *a, **k: pytest.fail(f"ran {a}")
+    )
+    assert fake_ifdh.getProxy("Analysis") == proxy
+
+
+class FakeWebDAV(http.server.BaseHTTPRequestHandler):
+    """just enough of a WebDAV server, over a local directory"""
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, code, body=b""):
+        self.send_response(code)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def local(self, url):
+        path = urllib.parse.unquote(urllib.parse.urlparse(url).path)
+        return os.path.join(self.server.root, path.lstrip("/"))
+
+    def check_auth(self):
+        self.server.auth.append(self.headers.get("Authorization"))
+        self.server.methods.append(self.command)
+
+    def do_MKCOL(self):
+        self.check_auth()
+        path = self.local(self.path)
+        if os.path.exists(path):
+            self.reply(405)
+        elif not os.path.isdir(os.path.dirname(path.rstrip("/"))):
+            self.reply(409)
+        else:
+            os.mkdir(path)
+            self.reply(201)
+
+    def do_PROPFIND(self):
+        self.check_auth()
+        path = self.local(self.path)
+        if not os.path.exists(path):
+            self.reply(404)
+            return
+        entries = [(self.path, path)]
+        if os.path.isdir(path) and self.headers.get("Depth") == "1":
+            for f in sorted(os.listdir(path)):
+                entries.append((self.path.rstrip("/") + "/" + f, os.path.join(path, f)))
+        body = '<?xml version="1.0"?><d:multistatus xmlns:d="DAV:">'
+        for href, p in entries:
+            rtype = "<d:collection/>" if os.path.isdir(p) else ""
+            body += (
+                f"<d:response><d:href>{href}</d:href><d:propstat><d:prop>"
+                f"<d:resourcetype>{rtype}</d:resourcetype></d:prop>"
+                "<d:status>HTTP/1.1 200 OK</d:status></d:propstat></d:response>"
+            )
+        self.reply(207, (body + "</d:multistatus>").encode())
+
+    def do_PUT(self):
+        self.check_auth()
+        path = self.local(self.path)
+        data = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if not os.path.isdir(os.path.dirname(path)):
+            self.reply(409)
+            return
+        with open(path, "wb") as f:
+            f.write(data)
+        self.reply(201)
+
+    def do_GET(self):
+        self.check_auth()
+        path = self.local(self.path)
+        if not os.path.isfile(path):
+            self.reply(404)
+            return
+        with open(path, "rb") as f:
+            self.reply(200, f.read())
+
+    def do_COPY(self):
+        self.check_auth()
+        src = self.local(self.path)
+        dest = self.local(self.headers["Destination"])
+        shutil.copyfile(src, dest)
+        self.reply(201)
+
+
+@pytest.fixture
+def fake_webdav(monkeypatch, tmp_path):
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), FakeWebDAV)
+    server.root = str(tmp_path / "dav")
+    server.auth = []
+    server.methods = []
+    os.mkdir(server.root)
+    t = threading.Thread(target=server.serve_forever, daemon=True)
+    t.start()
+    token = tmp_path / "token"
+    token.write_text("abc123\n")
+    monkeypatch.setenv("BEARER_TOKEN_FILE", str(token))
+    monkeypatch.delenv("JOBSUB_WEBDAV_ENGINE", raising=False)
+    monkeypatch.setattr(
+        fake_ifdh.os, "system", lambda cmd: pytest.fail(f"should not run {cmd}")
+    )
+    server.url = f"http://127.0.0.1:{server.server_address[1]}"
+    yield server
+    server.shutdown()
+
+
+@pytest.mark.unit
+def test_webdav_mkdir_cp_ls(fake_webdav, tmp_path):
+    base = f"{fake_webdav.url}/pnfs/fermilab/sandbox"
+    fake_ifdh.mkdir_p(f"{base}/a/b")
+    assert os.path.isdir(os.path.join(fake_webdav.root, "pnfs/fermilab/sandbox/a/b"))
+    # already there is fine
+    fake_ifdh.mkdir_p(f"{base}/a")
+
+    src = tmp_path / "job.sh"
+    src.write_text("#!/bin/sh\necho hi\n")
+    fake_ifdh.cp(str(src), f"{base}/a/b/job.sh")
+    fake_ifdh.cp(f"{base}/a/b/job.sh", f"{base}/a/job2.sh")
+    fake_ifdh.cp(f"{base}/a/job2.sh", str(tmp_path / "back.sh"))
+    assert (tmp_path / "back.sh").read_text() == src.read_text()
+
+    assert fake_ifdh.ls(f"{base}/a") == ["b", "job2.sh"]
+    assert fake_ifdh.ls(f"{base}/a/job2.sh") == [f"{base}/a/job2.sh"]
+    assert fake_ifdh.ls(f"{base}/nothere") == []
+    assert set(fake_webdav.auth) == {"Bearer abc123"}
+    assert "COPY" in fake_webdav.methods
+
+
+@pytest.mark.unit
+def test_webdav_refused_tries_gfal(fake_webdav, tmp_path, monkeypatch):
+    """when the server says no to our token, gfal gets a go"""
+    cmds = []
+    monkeypatch.setattr(fake_ifdh.os, "system", lambda cmd: cmds.append(cmd) or 1)
+    base = f"{fake_webdav.url}/pnfs/fermilab/sandbox"
+    with pytest.raises(PermissionError):
+        fake_ifdh.cp(f"{base}/nothere", str(tmp_path / "x"))
+    assert "gfal-copy" in cmds[-1]
+
+    monkeypatch.setattr(
+        FakeWebDAV, "do_MKCOL", lambda self: self.check_auth() or self.reply(403)
+    )
+    with pytest.raises(PermissionError):
+        fake_ifdh.mkdir_p(f"{base}/a")
+    assert "gfal-mkdir" in cmds[-1]
+    assert fake_webdav.methods == ["GET", "MKCOL"]
+
+
+@pytest.mark.unit
+def test_webdav_explicit_env(fake_webdav, tmp_path, monkeypatch):
+    """with an env given, its token is used, not os.environ's"""
+    token = tmp_path / "other_token"
+    token.write_text("xyz789\n")
+    env = dict(os.environ, BEARER_TOKEN_FILE=str(token))
+    monkeypatch.delenv("BEARER_TOKEN_FILE")
+    base = f"{fake_webdav.url}/pnfs/fermilab/sandbox"
+    fake_ifdh.mkdir_p(base, env)
+    fake_ifdh.cp_env(__file__, f"{base}/x.py", env)
+    assert set(fake_webdav.auth) == {"Bearer xyz789"}
+
+
+@pytest.mark.unit
+def test_webdav_gfal_fallback(fake_webdav, monkeypatch):
+    cmds = []
+    monkeypatch.setattr(fake_ifdh.os, "system", lambda cmd: cmds.append(cmd) or 0)
+    monkeypatch.setenv("JOBSUB_WEBDAV_ENGINE", "gfal")
+    fake_ifdh.mkdir_p(f"{fake_webdav.url}/pnfs/x")
+    monkeypatch.delenv("JOBSUB_WEBDAV_ENGINE")
+    # nothing listening there
+    fake_ifdh.mkdir_p("http://127.0.0.1:1/pnfs/x")
+    assert len(cmds) == 2 and all("gfal-mkdir" in c for c in cmds)
+    assert fake_webdav.methods == []
+
+
 @pytest.mark.parametrize(
     "input, expected, raised_error, match_expr",
     [
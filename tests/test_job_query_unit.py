@@ -0,0 +1,198 @@
+import argparse
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+#
+# we assume everwhere our current directory is in the package
+# test area, so go ahead and cd there
+#
+os.chdir(os.path.dirname(__file__))
+
+#
+# import modules we need to test, since we chdir()ed, can use relative path
+# unless we're testing installed, then use /opt/jobsub_lite/...
+#
+if os.environ.get("JOBSUB_TEST_INSTALLED", "0") == "1":
+    sys.path.append("/opt/jobsub_lite/lib")
+else:
+    sys.path.append("../lib")
+
+import classad
+import job_query
+import mains.cmd as cmd
+from jobsub_api import JobStatus, jobsub_q_re, q
+
+
+def job_ad(cluster, proc, status=1, **kwargs):
+    ad = {
+        "GlobalJobId": f"fake01.example.com#{cluster}.{proc}#1700000000",
+        "ClusterId": cluster,
+        "ProcId": proc,
+        "Owner": "someuser",
+        "QDate": 1700000000 + cluster,
+        "JobStatus": status,
+        "RemoteWallClockTime": 3725.0,
+        "JobPrio": 0,
+        "ImageSize": 2048,
+        "JobsubCmd": "myscript.sh",
+        "Cmd": "/some/path/simple.sh",
+        "Args": "arg1 arg2",
+    }
+    ad.update(kwargs)
+    return classad.ClassAd(ad)
+
+
+class FakeSchedd:
+    def __init__(self, ads, fail=False, hang=None):
+        self.ads = ads
+        self.fail = fail
+        self.hang = hang
+        self.queries = []
+
+    def query(self, constraint, projection):
+        self.queries.append((constraint, projection))
+        if self.hang is not None:
+            self.hang.wait()
+        if self.fail:
+            raise RuntimeError("schedd is down")
+        return self.ads
+
+
+@pytest.fixture
+def fake_schedds(monkeypatch):
+    schedds = {
+        "fake01.example.com": FakeSchedd([job_ad(12, 0), job_ad(11, 1, status=2)]),
+        "fake02.example.com": FakeSchedd([], fail=True),
+    }
+    monkeypatch.setattr(job_query.condor, "get_schedd_handle", schedds.get)
+    yield schedds
+
+
+@pytest.mark.unit
+def test_row_line_format():
+    """rows print the same way condor_q -format did for jobsub_q"""
+    row = job_query.row_from_ad(job_ad(12, 0))
+    submitted = time.strftime("%m/%d %H:%M", time.localtime(1700000012))
+    assert row.line() == (
+        f"{'12.0@fake01.example.com':<40}someuser  \t{submitted} "
+        "0+01:02:05  I    0    2.0 myscript.sh arg1 arg2"
+    )
+    m = jobsub_q_re.search(row.line())
+    assert m.group("jobid") == "12.0@fake01.example.com"
+    assert m.group("status") == "I"
+    assert m.group("runtime") == "0+01:02:05"
+
+
+@pytest.mark.unit
+def test_row_running_and_dag():
+    ad = job_ad(
+        12, 0, status=2, ShadowBday=1000, ServerTime=1100, DAGNodeName="stage_1"
+    )
+    row = job_query.row_from_ad(ad)
+    assert row.runtime == 3725 + 100
+    assert row.owner == " |-stage_1"
+    assert row.status_letter == "R"
+
+
+@pytest.mark.unit
+def test_totals_line():
+    rows = [
+        job_query.row_from_ad(job_ad(1, 0, status=1)),
+        job_query.row_from_ad(job_ad(1, 1, status=2)),
+        job_query.row_from_ad(job_ad(1, 2, status=5)),
+    ]
+    assert job_query.totals_line(rows) == (
+        "3 total; 0 completed, 0 removed, 1 idle, 1 running, 1 held, 0 suspended"
+    )
+
+
+@pytest.mark.unit
+def test_build_constraint():
+    assert job_query.build_constraint() == "true"
+    assert (
+        job_query.build_constraint("fermilab", "someuser", ["12", "13.4"], "JobPrio>0")
+        == 'Jobsub_Group=?="fermilab" && Owner=="someuser" && '
+        "(ClusterId==12 || (ClusterId==13 && ProcId==4)) && (JobPrio>0)"
+    )
+
+
+@pytest.mark.unit
+def test_query_rows(fake_schedds, capsys):
+    """one bad schedd is reported, the rest come back sorted by submit time"""
+    rows = job_query.query_rows(
+        {"fake01.example.com": "true", "fake02.example.com": "true"}
+    )
+    assert [r.jobid for r in rows] == [
+        "11.1@fake01.example.com",
+        "12.0@fake01.example.com",
+    ]
+    _, projection = fake_schedds["fake01.example.com"].queries[0]
+    assert projection == job_query.Q_PROJECTION
+    assert "fake02.example.com" in capsys.readouterr().err
+
+
+@pytest.mark.unit
+def test_query_schedds_hung_schedd(fake_schedds, monkeypatch, capsys):
+    """a schedd that never answers costs one timeout, not a hang"""
+    hang = threading.Event()
+    fake_schedds["fake03.example.com"] = FakeSchedd([job_ad(13, 0)], hang=hang)
+    monkeypatch.setattr(job_query.htcondor, "param", {})
+    try:
+        start = time.time()
+        res = job_query.query_schedds(
+            {s: "true" for s in fake_schedds}, max_workers=1, timeout=0.5
+        )
+        assert time.time() - start < 2
+    finally:
+        hang.set()
+    assert len(res["fake01.example.com"]) == 2
+    assert res["fake02.example.com"] is None
+    assert res["fake03.example.com"] is None
+    assert "fake03.example.com did not answer" in capsys.readouterr().err
+    assert job_query.htcondor.param["Q_QUERY_TIMEOUT"] == "1"
+
+
+@pytest.mark.unit
+def test_jobsub_q_bindings_engine(fake_schedds, monkeypatch, capsys):
+    monkeypatch.setenv("GROUP", "fermilab")
+    monkeypatch.setenv("JOBSUB_Q_ENGINE", "bindings")
+    monkeypatch.setattr(cmd.creds, "get_creds", lambda args: None)
+    monkeypatch.setattr(
+        cmd.condor, "get_schedd_names", lambda args: ["fake01.example.com"]
+    )
+    arglist = argparse.Namespace(command="jobsub_q", verbose=0)
+    cmd.jobsub_cmd_args(arglist, [])
+    out = capsys.readouterr().out.split("\n")
+    assert out[0] == job_query.Q_HEADER
+    assert out[1].startswith("11.1@fake01.example.com")
+    assert out[2].startswith("12.0@fake01.example.com")
+    assert out[3].startswith("2 total; ")
+    ((constraint, _),) = fake_schedds["fake01.example.com"].queries
+    assert constraint == 'Jobsub_Group=?="fermilab"'
+
+
+@pytest.mark.unit
+def test_jobsub_q_bindings_fallback(monkeypatch):
+    """options the bindings engine doesn't do mean we run condor_q"""
+    arglist = argparse.Namespace(command="jobsub_q", verbose=0)
+    assert cmd.jobsub_q_native_rows(arglist, ["-nobatch"], set(), {}, True) is None
+
+
+@pytest.mark.unit
+def test_api_q_bindings_engine(fake_schedds, monkeypatch):
+    monkeypatch.setenv("GROUP", "fermilab")
+    monkeypatch.setenv("JOBSUB_Q_ENGINE", "bindings")
+    monkeypatch.setattr(cmd.creds, "get_creds", lambda args: None)
+    jobs = q("12@fake01.example.com", group="fermilab")
+    assert [j.id for j in jobs] == [
+        "11.1@fake01.example.com",
+        "12.0@fake01.example.com",
+    ]
+    assert jobs[1].status == JobStatus.IDLE
+    assert jobs[1].owner == "someuser"
+    ((constraint, _),) = fake_schedds["fake01.example.com"].queries
+    assert constraint == 'Jobsub_Group=?="fermilab" && (ClusterId==12)'
@@ -0,0 +1,206 @@
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+#
+# we assume everwhere our current directory is in the package
+# test area, so go ahead and cd there
+#
+os.chdir(os.path.dirname(__file__))
+
+#
+# import modules we need to test, since we chdir()ed, can use relative path
+# unless we're testing installed, then use /opt/jobsub_lite/...
+#
+if os.environ.get("JOBSUB_TEST_INSTALLED", "0") == "1":
+    sys.path.append("/opt/jobsub_lite/lib")
+else:
+    sys.path.append("../lib")
+
+import classad
+import jobsub_api
+from jobsub_api import JobStatus, JobWatcher, SubmittedJob, wait_all
+
+
+def job_ad(cluster, proc, status):
+    return classad.ClassAd(
+        {
+            "GlobalJobId": f"fake01.example.com#{cluster}.{proc}#1700000000",
+            "ClusterId": cluster,
+            "ProcId": proc,
+            "Owner": "someuser",
+            "QDate": 1700000000,
+            "JobStatus": status,
+            "JobsubCmd": "myscript.sh",
+        }
+    )
+
+
+class FakeSchedd:
+    """schedd whose queue moves on one step each time it is queried"""
+
+    def __init__(self, steps):
+        self.steps = steps
+        self.queries = []
+
+    def query(self, constraint, projection):
+        self.queries.append(constraint)
+        return self.steps[min(len(self.queries), len(self.steps)) - 1]
+
+
+@pytest.fixture
+def fake_queue(monkeypatch):
+    schedd = FakeSchedd(
+        [
+            [job_ad(11, 1, 2), job_ad(13, 0, 1)],
+            [job_ad(11, 1, 5), job_ad(13, 0, 2)],
+            [job_ad(13, 0, 4)],
+        ]
+    )
+    monkeypatch.setenv("GROUP", "fermilab")
+    monkeypatch.setattr(
+        jobsub_api.job_query.condor, "get_schedd_handle", lambda name: schedd
+    )
+    creds_calls = []
+    monkeypatch.setattr(
+        jobsub_api.creds, "get_creds", lambda args: creds_calls.append(args)
+    )
+    monkeypatch.setattr(jobsub_api.time, "sleep", lambda t: None)
+    yield schedd, creds_calls
+
+
+@pytest.mark.unit
+def test_watcher_one_query_per_schedd(fake_queue):
+    schedd, creds_calls = fake_queue
+    jobs = [
+        SubmittedJob("fermilab", "11.1@fake01.example.com"),
+        SubmittedJob("fermilab", "12.0@fake01.example.com"),
+        SubmittedJob("fermilab", "13@fake01.example.com"),
+    ]
+    watcher = JobWatcher(jobs)
+    finished = watcher.poll()
+    # 12.0 is not in the queue, so it's done
+    assert [j.id for j in finished] == ["12.0@fake01.example.com"]
+    assert finished[0].status == JobStatus.COMPLETED
+    assert jobs[0].status == JobStatus.RUNNING
+    assert jobs[2].status == JobStatus.IDLE
+    assert schedd.queries == [
+        "((ClusterId==11 && ProcId==1) || (ClusterId==12 && ProcId==0) || ClusterId==13)"
+    ]
+    assert len(creds_calls) == 1
+
+
+@pytest.mark.unit
+def test_wait_all(fake_queue):
+    schedd, _ = fake_queue
+    jobs = [
+        SubmittedJob("fermilab", "11.1@fake01.example.com"),
+        SubmittedJob("fermilab", "13@fake01.example.com"),
+    ]
+    order = [(j.id, j.status) for j in wait_all(jobs, howoften=0)]
+    assert order == [
+        ("11.1@fake01.example.com", JobStatus.HELD),
+        ("13@fake01.example.com", JobStatus.COMPLETED),
+    ]
+    assert len(schedd.queries) == 3
+
+
+SUBMIT_EVENT = """000 ({cluster}.{proc:03d}.000) 2023-11-14 12:00:00 Job submitted from host: <1.2.3.4:9618?addrs=1.2.3.4-9618>
+...
+"""
+TERMINATED_EVENT = """005 ({cluster}.{proc:03d}.000) 2023-11-14 12:01:00 Job terminated.
+	(1) Normal termination (return value 0)
+		Usr 0 00:00:00, Sys 0 00:00:00  -  Run Remote Usage
+		Usr 0 00:00:00, Sys 0 00:00:00  -  Run Local Usage
+		Usr 0 00:00:00, Sys 0 00:00:00  -  Total Remote Usage
+		Usr 0 00:00:00, Sys 0 00:00:00  -  Total Local Usage
+	0  -  Run Bytes Sent By Job
+	0  -  Run Bytes Received By Job
+	0  -  Total Bytes Sent By Job
+	0  -  Total Bytes Received By Job
+...
+"""
+HELD_EVENT = """012 ({cluster}.{proc:03d}.000) 2023-11-14 12:01:00 Job was held.
+	just because
+	Code 0 Subcode 0
+...
+"""
+
+
+def append_later(path, text, delay):
+    def writer():
+        time.sleep(delay)
+        with open(path, "a") as f:
+            f.write(text)
+
+    t = threading.Thread(target=writer)
+    t.start()
+    return t
+
+
+@pytest.mark.unit
+def test_wait_log(tmp_path, monkeypatch):
+    """we notice the job finishing as soon as it is in the log"""
+    log = tmp_path / "job.log"
+    log.write_text(
+        SUBMIT_EVENT.format(cluster=123, proc=0)
+        + SUBMIT_EVENT.format(cluster=124, proc=0)
+    )
+    monkeypatch.setattr(
+        SubmittedJob, "q", lambda self, verbose=0: pytest.fail("should not poll")
+    )
+    t = append_later(
+        str(log),
+        TERMINATED_EVENT.format(cluster=124, proc=0)
+        + TERMINATED_EVENT.format(cluster=123, proc=0),
+        0.3,
+    )
+    job = SubmittedJob("fermilab", "123.0@fake01.example.com")
+    start = time.time()
+    job.wait(howoften=30, log=str(log))
+    assert time.time() - start < 5
+    assert job.status == JobStatus.COMPLETED
+    t.join()
+
+
+@pytest.mark.unit
+def test_wait_log_cluster(tmp_path, monkeypatch):
+    """a cluster is done when all its jobs are"""
+    log = tmp_path / "job.log"
+    log.write_text(
+        SUBMIT_EVENT.format(cluster=123, proc=0)
+        + SUBMIT_EVENT.format(cluster=123, proc=1)
+        + HELD_EVENT.format(cluster=123, proc=1)
+    )
+    monkeypatch.setattr(
+        SubmittedJob, "q", lambda self, verbose=0: pytest.fail("should not poll")
+    )
+    t = append_later(str(log), TERMINATED_EVENT.format(cluster=123, proc=0), 0.3)
+    job = SubmittedJob("fermilab", "123@fake01.example.com")
+    assert job.wait_log(str(log), howoften=30)
+    t.join()
+
+
+@pytest.mark.unit
+def test_wait_no_log_polls(tmp_path, monkeypatch):
+    """without a readable log we fall back to polling"""
+    polls = []
+
+    def fake_q(self, verbose=0):
+        polls.append(1)
+        self.status = JobStatus.COMPLETED
+
+    monkeypatch.setattr(SubmittedJob, "q", fake_q)
+    monkeypatch.setattr(
+        SubmittedJob,
+        "get_attribute",
+        lambda self, attr: pytest.fail("should not ask the schedd"),
+    )
+    job = SubmittedJob("fermilab", "123.0@fake01.example.com")
+    job.wait(howoften=0)
+    assert polls == [1]
+    job.wait(howoften=0, log=str(tmp_path / "missing.log"))
+    assert polls == [1, 1]
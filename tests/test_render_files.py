@@ -50,3 +50,26 @@ def test_render_files_disk_full(fakefs, monkeypatch):
             None,
             False,
         )
+
+
+@pytest.mark.unit
+def test_jinja_env_reused(tmp_path, monkeypatch):
+    """templates are compiled once, and the bytecode kept on disk"""
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    render_files.get_jinja_env.cache_clear()
+    srcdir = os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "data", "fake_templates"
+    )
+    jinja_env = render_files.get_jinja_env(srcdir)
+    assert render_files.get_jinja_env(srcdir) is jinja_env
+    assert render_files.get_jinja_env(srcdir, strict=False) is not jinja_env
+
+    dest = tmp_path / "dest"
+    dest.mkdir()
+    render_files._render_files(
+        srcdir, {"argument": "value_of_argument"}, str(dest), None, False
+    )
+    assert "value_of_argument" in (dest / "fake_basic_template").read_text()
+    bytecode = os.listdir(tmp_path / "cache" / "jobsub_lite" / "jinja_bytecode")
+    assert len(bytecode) == 1 and bytecode[0].endswith(".cache")
+    render_files.get_jinja_env.cache_clear()
@@ -0,0 +1,94 @@
+import bz2
+import gzip
+import io
+import lzma
+import os
+import sys
+
+import pytest
+
+#
+# we assume everwhere our current directory is in the package
+# test area, so go ahead and cd there
+#
+os.chdir(os.path.dirname(__file__))
+
+#
+# import modules we need to test, since we chdir()ed, can use relative path
+# unless we're testing installed, then use /opt/jobsub_lite/...
+#
+if os.environ.get("JOBSUB_TEST_INSTALLED", "0") == "1":
+    sys.path.append("/opt/jobsub_lite/lib")
+else:
+    sys.path.append("../lib")
+
+import tar_codecs
+
+DECOMPRESS = {"bz2": bz2.decompress, "gz": gzip.decompress, "xz": lzma.decompress}
+
+
+def compress(codec, data, threads, block_size=tar_codecs.BLOCK_SIZE):
+    out = io.BytesIO()
+    with tar_codecs.CompressingWriter(out, codec, threads, block_size) as w:
+        for i in range(0, len(data), 3000):
+            w.write(data[i : i + 3000])
+    return out.getvalue()
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize("name", ["bz2", "gz", "xz"])
+def test_block_parallel_roundtrip(name):
+    """concatenated blocks decompress back to what we wrote"""
+    data = os.urandom(5000) * 20
+    codec = tar_codecs.CODECS[name]
+    multi = compress(codec, data, 4, block_size=7000)
+    assert DECOMPRESS[name](multi) == data
+    # and block output doesn't depend on how many threads did it
+    assert compress(codec, data, 2, block_size=7000) == multi
+
+
+@pytest.mark.unit
+def test_single_thread_bz2_unchanged():
+    """one thread gives the same bytes tarfile's w|bz2 always did"""
+    data = b"some tarball contents " * 1000
+    assert compress(tar_codecs.CODECS["bz2"], data, 1) == bz2.compress(data, 9)
+
+
+@pytest.mark.unit
+def test_tarball_codec(monkeypatch):
+    monkeypatch.setenv("JOBSUB_TARBALL_CODEC", "xz")
+    assert tar_codecs.tarball_codec("pnfs").ext == ".txz"
+    # RCDS unpacks things itself, so it only gets bz2
+    assert tar_codecs.tarball_codec("cvmfs").name == "bz2"
+    monkeypatch.setenv("JOBSUB_TARBALL_CODEC", "rar")
+    with pytest.raises(ValueError):
+        tar_codecs.tarball_codec("pnfs")
+
+
+@pytest.mark.unit
+def test_tarball_threads(monkeypatch):
+    monkeypatch.delenv("JOBSUB_TARBALL_THREADS", raising=False)
+    assert tar_codecs.tarball_threads() == 1
+    monkeypatch.setenv("JOBSUB_TARBALL_THREADS", "0")
+    assert tar_codecs.tarball_threads() == (os.cpu_count() or 1)
+
+
+class OldExecutor(tar_codecs.ThreadPoolExecutor):
+    """ThreadPoolExecutor.shutdown as it is before python 3.9"""
+
+    def shutdown(self, wait=True):
+        super().shutdown(wait=wait)
+
+
+@pytest.mark.unit
+def test_close_and_abort_old_python(monkeypatch):
+    monkeypatch.setattr(tar_codecs, "ThreadPoolExecutor", OldExecutor)
+    data = os.urandom(5000) * 20
+    codec = tar_codecs.CODECS["gz"]
+    assert gzip.decompress(compress(codec, data, 4, block_size=7000)) == data
+    out = io.BytesIO()
+    with pytest.raises(RuntimeError):
+        with tar_codecs.CompressingWriter(out, codec, 4, 7000) as w:
+            w.write(data)
+            raise RuntimeError("tar failed")
+    assert not w.pending
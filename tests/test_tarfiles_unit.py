@@ -1,10 +1,15 @@
+import hashlib
+import http.server
 import importlib
 import os
 import sys
 import tarfile as tarfile_mod
 import time
 import tempfile
+import threading
+import urllib.parse
 import pathlib
+from concurrent.futures import ThreadPoolExecutor
 import pytest
 
 #
@@ -61,6 +66,80 @@ def set_fake_args_to_tarfile_publisher_handler_test(tmp_path):
     return fake_cid, fake_creds
 
 
+class FakeChunkedPubAPI(http.server.BaseHTTPRequestHandler):
+    """stand-in PubAPI server that takes chunked uploads"""
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, code, text):
+        body = text.encode()
+        self.send_response(code)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        state = self.server.state
+        if url.path == "/pubapi/upload_offset" and state["offset_fail"]:
+            self.reply(503, "try later")
+        elif url.path == "/pubapi/upload_offset" and state["chunked"]:
+            self.reply(200, f"OFFSET:{len(state['data'])}")
+        else:
+            self.reply(404, "not found")
+
+    def do_POST(self):
+        url = urllib.parse.urlparse(self.path)
+        params = urllib.parse.parse_qs(url.query)
+        state = self.server.state
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if url.path == "/pubapi/upload_chunk":
+            state["received"] += len(body)
+            offset = int(params["offset"][0])
+            assert offset == len(state["data"])
+            assert self.headers["X-Chunk-Sha256"] == hashlib.sha256(body).hexdigest()
+            if state["fail"]:
+                # keep the chunk, but lose the reply
+                state["fail"] -= 1
+                state["data"] += body
+                self.reply(500, "oops")
+                return
+            state["data"] += body
+            self.reply(200, f"OFFSET:{len(state['data'])}")
+        elif url.path == "/pubapi/upload_done":
+            cid = params["cid"][0]
+            assert int(params["size"][0]) == len(state["data"])
+            if cid.endswith(hashlib.sha256(state["data"]).hexdigest()):
+                self.reply(200, f"PRESENT:/cvmfs/fake/{cid}")
+            else:
+                self.reply(200, "MISSING")
+        else:
+            self.reply(404, "not found")
+
+
+@pytest.fixture
+def fake_chunked_pubapi(monkeypatch):
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), FakeChunkedPubAPI)
+    server.state = {
+        "data": bytearray(),
+        "fail": 0,
+        "received": 0,
+        "chunked": True,
+        "offset_fail": False,
+    }
+    t = threading.Thread(target=server.serve_forever, daemon=True)
+    t.start()
+    monkeypatch.setattr(
+        tarfiles.TarfilePublisherHandler,
+        "dropbox_server_string",
+        f"127.0.0.1:{server.server_address[1]}",
+    )
+    monkeypatch.setattr(tarfiles, "RETRY_INTERVAL_SEC", 0)
+    yield server
+    server.shutdown()
+
+
 class TestTarfilesUnit:
     """
     Use with pytest... unit tests for ../lib/*.py
@@ -85,6 +164,12 @@ class TestTarfilesUnit:
         cls.dir_to_tar.cleanup()
         cls.test_tarfile.unlink()
 
+    @pytest.fixture(autouse=True)
+    def in_tmp_path(self, tmp_path, monkeypatch):
+        """tarballs get made in the current directory, so keep them out
+        of the source tree"""
+        monkeypatch.chdir(tmp_path)
+
     # lib/tarfiles.py routines...
     @pytest.mark.unit
     def test_tar_up_1(self):
@@ -121,6 +206,211 @@ class TestTarfilesUnit:
         os.unlink(t2)
         assert h1 == h2
 
+    @pytest.mark.unit
+    def test_build_tarball_matches_tar_up(self, tmp_path):
+        """build_tarball picks the same files tar does, fixes modes,
+        and gives the digest of the file it wrote"""
+        excludes = tmp_path / "excludes"
+        excludes.write_text("*_3\nsubdir/test_l?nk\n\\.git/\n")
+        t1 = tarfiles.tar_up(self.dir_to_tar.name, str(excludes))
+        t2, digest = tarfiles.build_tarball(self.dir_to_tar.name, str(excludes))
+        try:
+            with tarfile_mod.open(t1) as tf1, tarfile_mod.open(t2) as tf2:
+                names1 = sorted(ti.name.rstrip("/") for ti in tf1)
+                members2 = tf2.getmembers()
+            assert sorted(ti.name for ti in members2) == names1
+            assert "./file_3" not in names1
+            assert all(ti.mode & 0o755 == 0o755 for ti in members2)
+            assert digest == tarfiles.checksum_file(t2)
+        finally:
+            os.unlink(t1)
+            os.unlink(t2)
+
+    @pytest.mark.unit
+    def test_build_tarball_too_big(self, monkeypatch):
+        """build_tarball bails on files over the RCDS size limit"""
+        monkeypatch.setattr(tarfiles, "RCDS_MAX_FILE_SIZE", 10)
+        with pytest.raises(ValueError, match="over RCDS 1G limit"):
+            tarfiles.build_tarball(self.dir_to_tar.name, None)
+        assert not [f for f in os.listdir(".") if f.endswith(".tbz2")]
+
+    @pytest.mark.unit
+    def test_build_tarball_same_dir_at_once(self):
+        """two threads tarring up the same directory get their own tarballs"""
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            futures = [
+                executor.submit(tarfiles.build_tarball, self.dir_to_tar.name, None)
+                for _ in range(2)
+            ]
+            (t1, d1), (t2, d2) = [f.result() for f in futures]
+        assert t1 != t2
+        assert d1 == d2 == tarfiles.checksum_file(t1) == tarfiles.checksum_file(t2)
+
+    @pytest.mark.unit
+    def test_tardir_manifest(self, tmp_path):
+        """the manifest changes when the tarball contents would"""
+        d = tmp_path / "code"
+        (d / "sub").mkdir(parents=True)
+        (d / "sub" / "a.sh").write_text("echo a")
+        (d / "b.sh").write_text("echo b")
+        excludes = tmp_path / "excludes"
+        excludes.write_text("*.tar\n")
+        codec = tarfiles.tar_codecs.CODECS["bz2"]
+
+        def manifest():
+            return tarfiles.tardir_manifest(str(d), str(excludes), codec)
+
+        name, m1 = manifest()
+        assert manifest() == (name, m1)
+        # things that come and go in directories don't count...
+        (d / "scratch").write_text("x")
+        (d / "scratch").unlink()
+        assert manifest()[1] == m1
+        # ...nor do excluded ones...
+        (d / "junk.tar").write_text("x")
+        assert manifest()[1] == m1
+        # ...but file changes do
+        os.utime(d / "sub" / "a.sh", ns=(0, 1000))
+        assert manifest()[1] != m1
+
+    @pytest.mark.unit
+    def test_do_tarballs_tardir_index(self, tmp_path, monkeypatch):
+        """the second time round an unchanged directory isn't tarred"""
+        monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+        creds = object()
+        creds_calls = []
+
+        def fake_get_creds(args):
+            creds_calls.append(args)
+            return creds
+
+        monkeypatch.setattr(tarfiles, "get_creds", fake_get_creds)
+        uploads = []
+
+        def fake_tarfile_in_dropbox(
+            args, tfn, digest=None, codec=None, pending=None, cred_set=None
+        ):
+            assert cred_set is creds
+            uploads.append(digest)
+            return f"/cvmfs/fake/{args.group}/{digest}"
+
+        class FakePublisher:
+            def __init__(self, cid, cred_set, fixed_server=False, verbose=0):
+                assert cred_set is creds
+                self.cid = cid
+
+            def update_cid(self):
+                return f"/cvmfs/fake/{self.cid}"
+
+        monkeypatch.setattr(tarfiles, "tarfile_in_dropbox", fake_tarfile_in_dropbox)
+        monkeypatch.setattr(tarfiles, "TarfilePublisherHandler", FakePublisher)
+        argv = [
+            "--tar_file_name",
+            f"tardir:{self.dir_to_tar.name}",
+            "--use-cvmfs-dropbox",
+            "--group",
+            TestUnit.test_group,
+            "file:///bin/true",
+        ]
+        parser = get_parser.get_parser()
+        args = parser.parse_args(argv)
+        tarfiles.do_tarballs(args)
+        assert len(uploads) == 1 and uploads[0] is not None
+
+        def no_build(*args, **kwargs):
+            raise AssertionError("should not build a tarball")
+
+        monkeypatch.setattr(tarfiles, "build_tarball", no_build)
+        args = parser.parse_args(argv)
+        tarfiles.do_tarballs(args)
+        assert len(uploads) == 1
+        assert args.tar_file_name == [f"/cvmfs/fake/{TestUnit.test_group}/{uploads[0]}"]
+        # once per do_tarballs, not once per worker
+        assert len(creds_calls) == 2
+
+    @pytest.mark.unit
+    def test_do_tarballs_concurrent_order(self, tmp_path, monkeypatch):
+        """several dropbox inputs get handled at once, but the results and
+        +PNFS_INPUT_FILES keep the order we were given"""
+        monkeypatch.setenv("JOBSUB_TARBALL_WORKERS", "4")
+        monkeypatch.setattr(tarfiles.os, "cpu_count", lambda: 4)
+        monkeypatch.setattr(tarfiles, "get_creds", lambda args: None)
+        copied = {}
+
+        def fake_cp(src, dst):
+            # make the early ones finish last
+            time.sleep(0.3 if not copied else 0)
+            copied[dst] = src
+
+        monkeypatch.setattr(tarfiles.fake_ifdh, "ls", lambda p: p in copied)
+        monkeypatch.setattr(tarfiles.fake_ifdh, "mkdir_p", lambda p: None)
+        monkeypatch.setattr(tarfiles.fake_ifdh, "chmod", lambda p, m: None)
+        monkeypatch.setattr(tarfiles.fake_ifdh, "cp", fake_cp)
+
+        dirs = []
+        for i in range(3):
+            d = tmp_path / f"dir{i}"
+            d.mkdir()
+            (d / "f").write_text(f"file in dir {i}")
+            dirs.append(str(d))
+        argv = ["-f", f"dropbox://{__file__}", "-f", "/plain/input"]
+        for d in dirs:
+            argv.extend(["--tar_file_name", f"tardir:{d}"])
+        argv.extend(["--tar_file_name", "/plain/tarfile.tar"])
+        argv.extend(["--use-pnfs-dropbox", "--group", TestUnit.test_group])
+        argv.append("file:///bin/true")
+        args = get_parser.get_parser().parse_args(argv)
+        args.lines = []
+        tarfiles.do_tarballs(args)
+
+        assert args.input_file[0].endswith(f"/{os.path.basename(__file__)}")
+        assert args.input_file[1] == "/plain/input"
+        for i in range(3):
+            assert os.path.basename(args.tar_file_name[i]).startswith(f"dir{i}")
+        assert args.tar_file_name[3] == "/plain/tarfile.tar"
+        assert args.tar_file_orig_basenames == ["dir0", "dir1", "dir2", "tarfile"]
+        assert args.lines == [
+            f'+PNFS_INPUT_FILES="{args.input_file[0]},'
+            f'{",".join(args.tar_file_name[:3])}"'
+        ]
+
+    @pytest.mark.unit
+    def test_checksum_file_once(self, tmp_path):
+        """we don't re-read files we already have the digest of"""
+        f = tmp_path / "data"
+        f.write_text("first version")
+        st = f.stat()
+        d1 = tarfiles.checksum_file(str(f))
+        # same size and times, so we believe it is the same file
+        f.write_text("other version")
+        os.utime(f, ns=(st.st_atime_ns, st.st_mtime_ns))
+        assert tarfiles.checksum_file(str(f)) == d1
+        os.utime(f, ns=(st.st_atime_ns, st.st_mtime_ns + 1000))
+        assert (
+            tarfiles.checksum_file(str(f))
+            == hashlib.sha256(b"other version").hexdigest()
+        )
+
+    @pytest.mark.unit
+    def test_checksum_file_persist(self, tmp_path, monkeypatch):
+        """digests can be kept across processes in the cache dir"""
+        monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+        monkeypatch.setenv("JOBSUB_DIGEST_CACHE", "1")
+        monkeypatch.setattr(tarfiles, "_digests", {})
+        monkeypatch.setattr(tarfiles, "_digests_loaded", False)
+        f = tmp_path / "data"
+        f.write_text("first version")
+        st = f.stat()
+        d1 = tarfiles.checksum_file(str(f), persist=True)
+        # as if we were a new process
+        monkeypatch.setattr(tarfiles, "_digests", {})
+        monkeypatch.setattr(tarfiles, "_digests_loaded", False)
+        f.write_text("other version")
+        os.utime(f, ns=(st.st_atime_ns, st.st_mtime_ns))
+        assert tarfiles.checksum_file(str(f), persist=True) == d1
+        path = tarfiles.dcache_persistent_path(TestUnit.test_group, str(f))
+        assert f"/{d1}/data" in path
+
     @pytest.mark.unit
     def test_dcache_persistent_path_1(self):
         """make sure persistent path gives /pnfs/ path digest"""
@@ -361,6 +651,139 @@ class TestTarfilesUnit:
         )
         assert server_is_fixed(tfh)
 
+    @pytest.mark.unit
+    def test_pubapi_sessions_shared(
+        self,
+        set_jobsub_dropbox_server_list,
+        set_fake_args_to_tarfile_publisher_handler_test,
+        monkeypatch,
+    ):
+        """PubAPI calls reuse one session per server, across handlers"""
+        from collections import namedtuple
+
+        FakeResponse = namedtuple("FakeResponse", ["text", "raise_for_status"])
+        used = []
+
+        def fake_get(session, url, **kwargs):
+            used.append((session, url.split("/")[2]))
+            return FakeResponse("PRESENT:/cvmfs/somewhere", lambda: None)
+
+        monkeypatch.setattr(tarfiles.requests.Session, "get", fake_get)
+        fake_cid, fake_creds = set_fake_args_to_tarfile_publisher_handler_test
+        for _ in range(2):
+            tfh = tarfiles.TarfilePublisherHandler(
+                cid=fake_cid, cred_set=fake_creds, fixed_server=True
+            )
+            assert tfh.cid_exists() == "/cvmfs/somewhere"
+            assert tfh.update_cid() == "/cvmfs/somewhere"
+        for session, server in used:
+            assert session is tarfiles.pubapi_session(server)
+        assert len({id(session) for session, _ in used}) <= 2
+
+    @pytest.mark.unit
+    def test_wait_for_publish(self, monkeypatch):
+        """all the pending tarballs are checked on at once"""
+
+        class FakePublisher:
+            def __init__(self, cid, after):
+                self.cid = cid
+                self.after = after
+                self.polls = 0
+
+            def cid_exists(self):
+                self.polls += 1
+                if self.polls >= self.after:
+                    return f"/cvmfs/fake/{self.cid}"
+                return None
+
+        monkeypatch.setattr(tarfiles, "PUBLISH_POLL_START_SEC", 0.05)
+        monkeypatch.setattr(tarfiles, "RETRY_INTERVAL_SEC", 0.2)
+        now = time.time()
+        pending = [
+            tarfiles.PendingPublish(f"grp/{i}", FakePublisher(f"grp/{i}", i), now)
+            for i in (1, 3, 4)
+        ]
+        res = tarfiles.wait_for_publish(pending)
+        assert res == {f"grp/{i}": f"/cvmfs/fake/grp/{i}" for i in (1, 3, 4)}
+        # backoff waits are at most 0.05 + 0.1 + 0.2; done in parallel,
+        # this takes about as long as the slowest one
+        assert time.time() - now < 0.6
+        assert [pp.publisher.polls for pp in pending] == [1, 3, 4]
+
+    @pytest.mark.unit
+    def test_wait_for_publish_gives_up(self, monkeypatch):
+        class NeverPublished:
+            def cid_exists(self):
+                return None
+
+        monkeypatch.setattr(tarfiles, "NUM_RETRIES", 3)
+        monkeypatch.setattr(tarfiles, "RETRY_INTERVAL_SEC", 0)
+        pending = [tarfiles.PendingPublish("grp/x", NeverPublished(), time.time())]
+        with pytest.raises(RuntimeError, match="Max retries 3"):
+            tarfiles.wait_for_publish(pending)
+
+    @pytest.mark.unit
+    def test_publish_chunked_resumes(self, tmp_path, fake_chunked_pubapi, capsys):
+        """a lost chunk reply doesn't mean sending the whole tarball again"""
+        data = os.urandom(10000)
+        tarball = tmp_path / "tarball.tbz2"
+        tarball.write_bytes(data)
+        cid = f"{TestUnit.test_group}/{hashlib.sha256(data).hexdigest()}"
+        token = tmp_path / "token"
+        token.write_text("xyzzy")
+        fake_chunked_pubapi.state["fail"] = 2
+        tfh = tarfiles.TarfilePublisherHandler(
+            cid=cid, cred_set=CredentialSet(token=str(token)), fixed_server=True
+        )
+        tfh.pubapi_base_url_formatter_full = "http://{dropbox_server}/pubapi/{endpoint}"
+        assert tfh.publish_chunked(str(tarball), 3000) == f"/cvmfs/fake/{cid}"
+        assert bytes(fake_chunked_pubapi.state["data"]) == data
+        assert fake_chunked_pubapi.state["received"] == len(data)
+
+    @pytest.mark.unit
+    def test_publish_chunked_fallback(self, tmp_path, fake_chunked_pubapi, monkeypatch):
+        """servers without chunked uploads get the whole file"""
+        tarball = tmp_path / "tarball.tbz2"
+        tarball.write_bytes(b"tarball")
+        token = tmp_path / "token"
+        token.write_text("xyzzy")
+        fake_chunked_pubapi.state["chunked"] = False
+        published = []
+        monkeypatch.setattr(
+            tarfiles.TarfilePublisherHandler,
+            "publish",
+            lambda self, tfn: published.append(tfn),
+        )
+        tfh = tarfiles.TarfilePublisherHandler(
+            cid="x/y", cred_set=CredentialSet(token=str(token)), fixed_server=True
+        )
+        tfh.pubapi_base_url_formatter_full = "http://{dropbox_server}/pubapi/{endpoint}"
+        tfh.publish_chunked(str(tarball), 3000)
+        assert published == [str(tarball)]
+        assert fake_chunked_pubapi.state["received"] == 0
+
+    @pytest.mark.unit
+    def test_publish_chunked_offset_fails(
+        self, tmp_path, fake_chunked_pubapi, monkeypatch
+    ):
+        """if we can't even ask for the upload offset, publish() takes over"""
+        tarball = tmp_path / "tarball.tbz2"
+        tarball.write_bytes(b"tarball")
+        token = tmp_path / "token"
+        token.write_text("xyzzy")
+        fake_chunked_pubapi.state["offset_fail"] = True
+        monkeypatch.setattr(
+            tarfiles.TarfilePublisherHandler,
+            "publish",
+            lambda self, tfn: f"/cvmfs/fake/{tfn}",
+        )
+        tfh = tarfiles.TarfilePublisherHandler(
+            cid="x/y", cred_set=CredentialSet(token=str(token)), fixed_server=True
+        )
+        tfh.pubapi_base_url_formatter_full = "http://{dropbox_server}/pubapi/{endpoint}"
+        assert tfh.publish_chunked(str(tarball), 3000) == f"/cvmfs/fake/{tarball}"
+        assert fake_chunked_pubapi.state["received"] == 0
+
     @pytest.mark.unit
     def test_setup_dropbox_server_selector_no_server_set(
         self,
@@ -0,0 +1,142 @@
+import os
+import sys
+import tarfile
+import threading
+import time
+
+import pytest
+
+#
+# we assume everwhere our current directory is in the package
+# test area, so go ahead and cd there
+#
+os.chdir(os.path.dirname(__file__))
+
+#
+# import modules we need to test, since we chdir()ed, can use relative path
+# unless we're testing installed, then use /opt/jobsub_lite/...
+#
+if os.environ.get("JOBSUB_TEST_INSTALLED", "0") == "1":
+    sys.path.append("/opt/jobsub_lite/lib")
+else:
+    sys.path.append("../lib")
+
+import transfer_sandbox
+
+
+@pytest.fixture
+def sandbox(tmp_path, monkeypatch):
+    src = tmp_path / "submit"
+    src.mkdir()
+    for i in range(12):
+        (src / f"stage_{i}.cmd").write_text(f"stage {i}\n")
+    calls = {"mkdir": [], "cp": [], "env": [], "active": 0, "most": 0}
+    lock = threading.Lock()
+
+    def fake_mkdir_p(d, env=None):
+        calls["mkdir"].append(d)
+
+    def fake_cp(s, d, env=None):
+        calls["env"].append(env)
+        with lock:
+            calls["active"] += 1
+            calls["most"] = max(calls["most"], calls["active"])
+        time.sleep(0.05)
+        with lock:
+            calls["active"] -= 1
+            calls["cp"].append((s, d))
+        if s.endswith("stage_3.cmd"):
+            raise PermissionError("Error: Unable to copy")
+
+    monkeypatch.setattr(transfer_sandbox, "mkdir_p", fake_mkdir_p)
+    monkeypatch.setattr(transfer_sandbox, "cp_env", fake_cp)
+    monkeypatch.delenv("JOBSUB_SANDBOX_MODE", raising=False)
+    return str(src), calls
+
+
+@pytest.mark.unit
+def test_transfer_sandbox_parallel(sandbox, monkeypatch, capsys):
+    src, calls = sandbox
+    monkeypatch.setenv("JOBSUB_SANDBOX_WORKERS", "4")
+    transfer_sandbox.transfer_sandbox(src, "https://example.com/sb")
+    assert calls["mkdir"] == ["https://example.com/sb"]
+    assert len(calls["cp"]) == 12
+    assert 1 < calls["most"] <= 4
+    # one failure is just a warning
+    assert "error copying stage_3.cmd" in capsys.readouterr().out
+
+
+@pytest.mark.unit
+def test_transfer_sandbox_archive(sandbox, monkeypatch, tmp_path):
+    src, calls = sandbox
+    monkeypatch.setenv("JOBSUB_SANDBOX_MODE", "archive")
+    names = []
+
+    def fake_cp(s, d, env=None):
+        with tarfile.open(s) as tf:
+            names.extend(tf.getnames())
+        calls["cp"].append((os.path.basename(s), d))
+
+    monkeypatch.setattr(transfer_sandbox, "cp_env", fake_cp)
+    transfer_sandbox.transfer_sandbox(src, "https://example.com/sb")
+    assert calls["cp"] == [("sandbox.tgz", "https://example.com/sb/sandbox.tgz")]
+    assert sorted(names) == sorted(os.listdir(src))
+
+
+@pytest.mark.unit
+def test_start_transfer_sandbox_async(sandbox, monkeypatch, capsys):
+    src, calls = sandbox
+    monkeypatch.setenv("JOBSUB_SANDBOX_ASYNC", "1")
+    monkeypatch.setenv("JOBSUB_SANDBOX_WORKERS", "1")
+    start = time.time()
+    transfer_sandbox.start_transfer_sandbox(src, "https://example.com/sb")
+    # didn't wait for the 12 copies
+    assert time.time() - start < 0.3
+    transfer_sandbox.wait_for_sandbox(0.1)
+    assert "timed out" in capsys.readouterr().out
+
+    transfer_sandbox.start_transfer_sandbox(src, "https://example.com/sb2")
+    transfer_sandbox.wait_for_sandbox(30)
+    assert len([d for s, d in calls["cp"] if "/sb2/" in d]) == 12
+    assert transfer_sandbox._background == []
+
+
+@pytest.mark.unit
+def test_start_transfer_sandbox_keeps_env(sandbox, monkeypatch):
+    """submitting resets os.environ, the background copies don't see that"""
+    src, calls = sandbox
+    monkeypatch.setenv("JOBSUB_SANDBOX_ASYNC", "1")
+    monkeypatch.setenv("BEARER_TOKEN_FILE", "/tmp/bt_submit_token")
+    transfer_sandbox.start_transfer_sandbox(src, "https://example.com/sb")
+    monkeypatch.setenv("BEARER_TOKEN_FILE", "/tmp/bt_users_own_token")
+    transfer_sandbox.wait_for_sandbox(30)
+    assert len(calls["env"]) == 12
+    assert all(e["BEARER_TOKEN_FILE"] == "/tmp/bt_submit_token" for e in calls["env"])
+
+
+@pytest.mark.unit
+def test_transfer_sandbox_spans(sandbox, monkeypatch):
+    """each copy gets its own cp span, without the environment in it"""
+    src, calls = sandbox
+    spans = []
+
+    class FakeSpan:
+        def __init__(self, name):
+            self.attrs = {}
+            spans.append((name, self.attrs))
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *args):
+            return False
+
+        def set_attribute(self, key, value):
+            self.attrs[key] = value
+
+    monkeypatch.setattr(transfer_sandbox, "start_as_current_span", FakeSpan)
+    monkeypatch.setenv("BEARER_TOKEN_FILE", "/tmp/bt_submit_token")
+    transfer_sandbox.transfer_sandbox(src, "https://example.com/sb", dict(os.environ))
+    assert [name for name, _ in spans] == ["cp"] * 12
+    assert all("stage_" in attrs["args"] for _, attrs in spans)
+    assert not any("bt_submit_token" in repr(attrs) for _, attrs in spans)
@@ -1,9 +1,18 @@
 from collections import namedtuple
 import json
 import os
+import struct
 import sys
 import tempfile
 import time
+
+# (test_grep_n_1 wants json to be the first import)
+import datetime
+import io
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
 import pytest
 
 #
@@ -326,3 +335,170 @@ class TestUtilsUnit:
                 site_blocklist_test_case.site_arg,
                 site_blocklist_test_case.blocklist_arg,
             )
+
+
+def write_ccache(path, principal):
+    """an MIT v4 FILE: credential cache with just the default principal"""
+    name, realm = principal.split("@")
+    data = struct.pack(">HH", 0x0504, 0) + struct.pack(">I", 1)
+    parts = name.split("/")
+    data += struct.pack(">I", len(parts))
+    for p in [realm] + parts:
+        data += struct.pack(">I", len(p)) + p.encode()
+    path.write_bytes(data)
+
+
+@pytest.mark.unit
+def test_get_principal_from_ccache(tmp_path, monkeypatch):
+    ccache = tmp_path / "krb5cc"
+    write_ccache(ccache, "someuser@FNAL.GOV")
+    monkeypatch.setenv("KRB5CCNAME", f"FILE:{ccache}")
+    monkeypatch.setattr(
+        utils.subprocess, "Popen", lambda *a, **k: pytest.fail("ran klist")
+    )
+    assert utils.get_principal() == "someuser@FNAL.GOV"
+    # kinit as someone else
+    write_ccache(ccache, "someone/cron/host.fnal.gov@FNAL.GOV")
+    assert utils.get_principal() == "someone/cron/host.fnal.gov@FNAL.GOV"
+
+
+@pytest.mark.unit
+def test_get_principal_default_ccache_uses_klist(monkeypatch):
+    """without KRB5CCNAME the cache might be KCM or KEYRING, so ask klist"""
+    monkeypatch.delenv("KRB5CCNAME", raising=False)
+    monkeypatch.setattr(utils, "read_ccache_principal", lambda p: pytest.fail(p))
+
+    class FakeKlist:
+        def __init__(self, *args, **kwargs):
+            self.stdout = io.StringIO(
+                "Ticket cache: KCM:1234\nDefault principal: kcmuser@FNAL.GOV\n"
+            )
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *args):
+            pass
+
+    monkeypatch.setattr(utils.subprocess, "Popen", FakeKlist)
+    assert utils.get_principal() == "kcmuser@FNAL.GOV"
+    monkeypatch.setenv("KRB5CCNAME", "KEYRING:persistent:1234")
+    assert utils.get_principal() == "kcmuser@FNAL.GOV"
+
+
+@pytest.mark.unit
+def test_get_client_dn_in_process(tmp_path, monkeypatch):
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name(
+        [
+            x509.NameAttribute(x509.oid.NameOID.DOMAIN_COMPONENT, "org"),
+            x509.NameAttribute(x509.oid.NameOID.DOMAIN_COMPONENT, "cilogon"),
+            x509.NameAttribute(x509.oid.NameOID.COUNTRY_NAME, "US"),
+            x509.NameAttribute(x509.oid.NameOID.COMMON_NAME, "Some User"),
+            x509.NameAttribute(x509.oid.NameOID.COMMON_NAME, "12345"),
+            x509.NameAttribute(x509.oid.NameOID.EMAIL_ADDRESS, "user@example.com"),
+            x509.NameAttribute(x509.oid.NameOID.USER_ID, "someuser"),
+        ]
+    )
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(1)
+        .not_valid_before(now)
+        .not_valid_after(now + datetime.timedelta(hours=1))
+        .sign(key, hashes.SHA256())
+    )
+    proxy = tmp_path / "x509up"
+    proxy.write_bytes(cert.public_bytes(serialization.Encoding.PEM))
+    monkeypatch.setattr(utils.shutil, "which", lambda exe: pytest.fail("ran " + exe))
+    assert (
+        utils.get_client_dn(str(proxy))
+        == "/DC=org/DC=cilogon/C=US/CN=Some User/CN=12345"
+        "/emailAddress=user@example.com/UID=someuser"
+    )
+
+
+@pytest.mark.unit
+def test_set_some_extras_no_ctx(tmp_path, monkeypatch):
+    """condor_submit_dag doesn't pay for the proxy DN or traceparent"""
+    monkeypatch.setattr(utils, "get_principal", lambda: "someuser@FNAL.GOV")
+    monkeypatch.setattr(
+        utils, "get_client_dn", lambda proxy=None: pytest.fail("looked up DN")
+    )
+    monkeypatch.setattr(
+        utils,
+        "get_propagator_carrier",
+        lambda: pytest.fail("looked up traceparent"),
+    )
+    # CredentialSet sets this, have monkeypatch put it back afterwards
+    monkeypatch.setenv("X509_USER_PROXY", "/tmp/x509up_fake")
+    cred_set = utils.CredentialSet(proxy="/tmp/x509up_fake")
+    args = {"outdir": str(tmp_path), "outurl": ""}
+    utils.set_some_extras(args, TestUnit.test_schedd, cred_set)
+    assert args["kerberos_principal"] == "someuser@FNAL.GOV"
+    assert args["schedd"] == TestUnit.test_schedd
+    assert "clientdn" not in args and "traceparent" not in args
+
+
+@pytest.mark.unit
+def test_memo_cred_file_replaced(tmp_path, monkeypatch):
+    """a changed file is read again, and replaces what we had for it"""
+    monkeypatch.setattr(utils, "_cred_file_memo", {})
+    cred = tmp_path / "cred"
+    reads = []
+
+    def reader(path):
+        with open(path, encoding="UTF-8") as f:
+            reads.append(f.read())
+        return reads[-1]
+
+    for i in range(3):
+        cred.write_text(f"version {i}")
+        os.utime(cred, ns=(i, i))
+        assert utils._memo_cred_file("x", str(cred), reader) == f"version {i}"
+        assert utils._memo_cred_file("x", str(cred), reader) == f"version {i}"
+    assert reads == ["version 0", "version 1", "version 2"]
+    assert len(utils._cred_file_memo) == 1
+
+
+@pytest.mark.unit
+def test_read_proxy_subject_fails_soft(tmp_path, monkeypatch):
+    """any trouble reading the proxy here means asking the tools instead"""
+    proxy = tmp_path / "x509up"
+    proxy.write_text("not really a proxy")
+    assert utils.read_proxy_subject(str(proxy)) is None
+
+    def broken(data):
+        raise AttributeError("no such thing in this cryptography")
+
+    monkeypatch.setattr(utils.x509, "load_pem_x509_certificate", broken)
+    assert utils.read_proxy_subject(str(proxy)) is None
+
+
+@pytest.mark.unit
+def test_submission_context_once(monkeypatch):
+    """with a SubmissionContext, stages don't look things up again"""
+    lookups = []
+    monkeypatch.setattr(
+        utils.socket,
+        "getaddrinfo",
+        lambda host, port: lookups.append(host) or [(0, 0, 0, "", ("10.1.2.3", 80))],
+    )
+    monkeypatch.setattr(utils, "get_principal", lambda: "someuser@FNAL.GOV")
+    cred_set = utils.CredentialSet(token="/tmp/bt_token_x")
+    ctx = utils.submission_context(TestUnit.test_schedd, cred_set)
+    assert lookups and ctx.ipaddr == "10.1.2.3"
+    monkeypatch.setattr(
+        utils, "get_principal", lambda: pytest.fail("looked up principal again")
+    )
+    for stage in range(3):
+        args = TestUnit.test_vargs.copy()
+        args["environment"] = list(args["environment"])
+        utils.set_extras_n_fix_units(args, TestUnit.test_schedd, cred_set, ctx)
+        assert args["kerberos_principal"] == "someuser@FNAL.GOV"
+        assert args["token"] == "/tmp/bt_token_x"
+        assert args["ipaddr"] == "10.1.2.3"
+    assert len(lookups) == 1